@@ -32,7 +32,8 @@ See the unit_tests.py file for example usage.
 
 __all__ = ['RiakBucket', 'RiakNode', 'RiakObject', 'RiakClient',
            'RiakMapReduce', 'RiakKeyFilter', 'RiakLink', 'RiakError',
-           'ConflictError', 'ONE', 'ALL', 'QUORUM', 'key_filter']
+           'ConflictError', 'DeadlineExceeded', 'ONE', 'ALL', 'QUORUM',
+           'key_filter']
 
 
 class RiakError(Exception):
@@ -56,6 +57,15 @@ class ConflictError(RiakError):
         super(ConflictError, self).__init__(message)
 
 
+class DeadlineExceeded(RiakError):
+    """
+    Raised when the deadline of an operation passes before it could
+    be completed, see :meth:`~riak.client.RiakClient.deadline`.
+    """
+    def __init__(self, message="Deadline exceeded"):
+        super(DeadlineExceeded, self).__init__(message)
+
+
 from client import RiakClient
 from bucket import RiakBucket
 from node import RiakNode
@@ -65,6 +65,7 @@ class RiakBucket(object):
         self._encoders = {}
         self._decoders = {}
         self._resolver = None
+        self._compression = None
 
     def __hash__(self):
         return hash((self.name, self._client))
@@ -262,6 +263,24 @@ class RiakBucket(object):
                            bucket. If the resolver is not set, the
                            client's resolver will be used.""")
 
+    def _get_compression(self):
+        if self._compression is None:
+            return self._client.compression
+        elif self._compression is False:
+            return None
+        else:
+            return self._compression
+
+    def _set_compression(self, value):
+        self._compression = value
+
+    compression = property(_get_compression, _set_compression, doc="""
+        The :class:`~riak.compression.CompressionPolicy` for values
+        stored in this bucket. If the policy is not set, the client's
+        policy will be used; set it to False to store values
+        uncompressed.
+        """)
+
     n_val = bucket_property('n_val', doc="""
     N-value for this bucket, which is the number of replicas
     that will be written of each object in the bucket.
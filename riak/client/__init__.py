@@ -24,10 +24,13 @@ try:
 except ImportError:
     import json
 
-import random
 from weakref import WeakValueDictionary
 from riak.client.operations import RiakClientOperations
-from riak.node import RiakNode
+from riak.client.health import HealthChecker
+from riak.client.hedge import Hedger
+from riak.client.pipeline import RiakPipeline
+from riak.client.retry import RetryBudget
+from riak.node import RiakNode, power_of_two_policy
 from riak.bucket import RiakBucket
 from riak.mapreduce import RiakMapReduceChain
 from riak.resolver import default_resolver
@@ -59,7 +62,8 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
     PROTOCOLS = ['http', 'https', 'pbc']
 
     def __init__(self, protocol='http', transport_options={},
-                 nodes=None, **unused_args):
+                 nodes=None, prewarm=0, health_check_interval=None,
+                 hedge_percentile=None, **unused_args):
         """
         Construct a new ``RiakClient`` object.
 
@@ -67,11 +71,38 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
         :type protocol: string
         :param nodes: a list of node configurations,
            where each configuration is a dict containing the keys
-           'host', 'http_port', and 'pb_port'
+           'host', 'http_port', and 'pb_port', and optionally
+           'server_version' and 'capability_ttl', see
+           :class:`~riak.node.RiakNode`
         :type nodes: list
         :param transport_options: Optional key-value args to pass to
-                                  the transport constructor
+                                  the transport constructor. The
+                                  ``max_size``, ``min_idle``,
+                                  ``acquire_timeout``, ``max_idle``,
+                                  ``max_lifetime`` and
+                                  ``reap_interval`` options configure
+                                  the connection pools instead, see
+                                  :class:`~riak.transports.pool.Pool`.
+                                  For the socket options of the
+                                  'pbc' transport, see
+                                  :class:`~riak.transports.pbc.RiakPbcTransport`,
+                                  and for the timeout, streaming
+                                  and compression options of the
+                                  'http' transport, see
+                                  :class:`~riak.transports.http.RiakHttpTransport`.
         :type transport_options: dict
+        :param prewarm: the number of connections to open to each
+                        node for the preferred protocol before the
+                        constructor returns, see :meth:`warm_up`
+        :type prewarm: int
+        :param health_check_interval: when given, the number of
+                        seconds between background pings of every
+                        node, see :attr:`health_checker`
+        :type health_check_interval: float
+        :param hedge_percentile: when given, fetches that take longer
+                        than this percentile of recent fetches are
+                        sent again to another node, see :attr:`hedger`
+        :type hedge_percentile: float
         """
         unused_args = unused_args.copy()
 
@@ -98,6 +129,12 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
 
         self.protocol = protocol or 'http'
         self.resolver = default_resolver
+        self.compression = None
+        self.node_policy = power_of_two_policy
+        self.retry_budget = RetryBudget()
+        self.hedger = None
+        if hedge_percentile:
+            self.hedger = Hedger(hedge_percentile)
         self._http_pool = RiakHttpPool(self, **transport_options)
         self._pb_pool = RiakPbcPool(self, **transport_options)
 
@@ -109,6 +146,14 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
                           'text/plain': str}
         self._buckets = WeakValueDictionary()
 
+        self.health_checker = None
+        if health_check_interval:
+            self.health_checker = HealthChecker(self, health_check_interval)
+            self.health_checker.start()
+
+        if prewarm:
+            self.warm_up(prewarm)
+
     def _get_protocol(self):
         return self._protocol
 
@@ -181,9 +226,9 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
 
     def _set_client_id(self, client_id):
         for http in self._http_pool:
-            http.client_id = client_id
+            http.object.client_id = client_id
         for pb in self._pb_pool:
-            pb.client_id = client_id
+            pb.object.client_id = client_id
 
     client_id = property(_get_client_id, _set_client_id,
                          doc="""The client ID for this client instance""")
@@ -249,6 +294,20 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
             self._buckets[name] = bucket
             return bucket
 
+    def pipeline(self, connections=1):
+        """
+        Returns a new :class:`~riak.client.pipeline.RiakPipeline`,
+        which performs a batch of object and counter operations on
+        one Protocol Buffers connection with their requests
+        pipelined, regardless of the preferred protocol.
+
+        :param connections: the most connections to spread the batch
+            over
+        :type connections: int
+        :rtype: :class:`~riak.client.pipeline.RiakPipeline`
+        """
+        return RiakPipeline(self, connections)
+
     @lazy_property
     def solr(self):
         """
@@ -275,15 +334,26 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
             raise TypeError("%s is not a valid node configuration"
                             % repr(n))
 
-    def _choose_node(self, nodes=None):
+    def _choose_node(self, nodes=None, load=None):
         """
-        Chooses a random node from the list of nodes in the client,
-        taking into account each node's recent error rate.
+        Chooses a node from the list of nodes in the client, skipping
+        nodes whose circuit is open, taking into account each node's
+        recent error rate, and then using the :attr:`node_policy`.
+
+        :param nodes: the nodes to choose from, defaults to all nodes
+        :type nodes: list
+        :param load: an optional function giving the load of a node
+            (any comparable value); among nodes with few recent
+            errors, only the least loaded are passed to the policy
+        :type load: function
         :rtype RiakNode
         """
         if not nodes:
             nodes = self.nodes
 
+        # Skip nodes whose circuit is open, unless all of them are
+        nodes = [n for n in nodes if n.available] or nodes
+
         # Prefer nodes which have gone a reasonable time without
         # errors
         def _error_rate(node):
@@ -294,8 +364,13 @@ class RiakClient(RiakMapReduceChain, RiakClientOperations):
         if len(good) is 0:
             # Fall back to a minimally broken node
             return min(nodes, key=_error_rate)
-        else:
-            return random.choice(good)
+
+        if load is not None:
+            loads = dict((n, load(n)) for n in good)
+            least = min(loads.values())
+            good = [n for n in good if loads[n] == least]
+
+        return self.node_policy(good)
 
     def __hash__(self):
         return hash(frozenset([(n.host, n.http_port, n.pb_port)
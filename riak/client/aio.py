@@ -0,0 +1,389 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from collections import deque
+import time
+import trollius as asyncio
+from trollius import From, Return
+from riak import RiakError
+from riak.client import RiakClient
+from riak.client.index_page import IndexPage
+from riak.client.operations import _validate_timeout
+from riak.client.retry import backoff
+from riak.client.transport import _is_retryable
+from riak.transports.pool import BadResource
+from riak.transports.pbc import CONN_CLOSED_ERRORS
+from riak.transports.pbc.aio import AsyncRiakPbcTransport, AsyncKeyStream
+
+__all__ = ['AsyncRiakClient', 'AsyncPool']
+
+
+def _is_connection_error(err):
+    """
+    Whether an error means that the connection was lost, so that the
+    operation can be retried on another node. trollius raises socket
+    errors as ``OSError`` subclasses and a closed connection as
+    :class:`trollius.IncompleteReadError`.
+
+    :rtype: bool
+    """
+    if isinstance(err, asyncio.IncompleteReadError):
+        return True
+    if isinstance(err, EnvironmentError):
+        return _is_retryable(err) or err.errno in CONN_CLOSED_ERRORS
+    return False
+
+
+class AsyncPool(object):
+    """
+    A pool of :class:`~riak.transports.pbc.aio.AsyncRiakPbcTransport`
+    connections for an event loop, with idle connections and a limit
+    per node. Nodes are chosen by the node policy of the client, as
+    for :class:`~riak.transports.pool.NodePool`.
+    """
+
+    def __init__(self, client, loop, max_size=None, **options):
+        """
+        :param client: the client whose nodes are pooled
+        :type client: :class:`~riak.client.RiakClient`
+        :param loop: the event loop
+        :param max_size: the most connections to each node, unlimited
+            by default
+        :type max_size: int
+        :param options: the options of the transports
+        """
+        self._client = client
+        self._loop = loop
+        self._max_size = max_size
+        self._options = options
+        self._idle = {}
+        self._limits = {}
+
+    def choose_node(self, skip_nodes=None):
+        """
+        Chooses the node for a request among the nodes not in
+        ``skip_nodes``, preferring healthy nodes with idle connections.
+
+        :rtype: :class:`~riak.node.RiakNode`
+        """
+        nodes = self._client.nodes
+        if skip_nodes:
+            nodes = [n for n in nodes if n not in skip_nodes] or nodes
+        nodes = [n for n in nodes if n.available] or nodes
+
+        def _load(node):
+            return not self._idle.get(node)
+
+        return self._client._choose_node(nodes, load=_load)
+
+    @asyncio.coroutine
+    def acquire(self, node):
+        """
+        Takes an idle connection to the node, or opens one. If the node
+        already has ``max_size`` connections, waits for one to be
+        released.
+
+        :param node: the node, see :meth:`choose_node`
+        :type node: :class:`~riak.node.RiakNode`
+        :rtype: :class:`~riak.transports.pbc.aio.AsyncRiakPbcTransport`
+        """
+        if self._max_size:
+            if node not in self._limits:
+                self._limits[node] = asyncio.Semaphore(self._max_size,
+                                                       loop=self._loop)
+            yield From(self._limits[node].acquire())
+
+        idle = self._idle.setdefault(node, deque())
+        if idle:
+            raise Return(idle.pop())
+
+        transport = AsyncRiakPbcTransport(node=node, client=self._client,
+                                          loop=self._loop, **self._options)
+        try:
+            yield From(transport.connect())
+        except BaseException:
+            self.discard(transport)
+            raise
+        raise Return(transport)
+
+    def release(self, transport):
+        """
+        Returns a connection to the pool for reuse.
+        """
+        self._idle[transport._node].append(transport)
+        if self._max_size:
+            self._limits[transport._node].release()
+
+    def discard(self, transport):
+        """
+        Closes a connection that cannot be reused.
+        """
+        transport.close()
+        if self._max_size:
+            self._limits[transport._node].release()
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+
+
+class AsyncRiakClient(object):
+    """
+    A client for asyncio-style services, on the trollius event loop,
+    speaking Protocol Buffers without threads. Its operations are
+    coroutines that mirror those of :class:`~riak.client.RiakClient`,
+    with the same retries, backoff, retry budget and node selection::
+
+        client = AsyncRiakClient(nodes=[...])
+
+        @trollius.coroutine
+        def handle(key):
+            obj = yield From(client.get(client.bucket('users').new(key)))
+            ...
+
+    Buckets and objects come from a regular
+    :class:`~riak.client.RiakClient`, which holds the nodes, encoders
+    and resolvers. Note that the methods of the objects themselves,
+    such as :meth:`~riak.riak_object.RiakObject.store`, use that
+    client and block.
+    """
+
+    def __init__(self, client=None, loop=None, **options):
+        """
+        :param client: the client providing nodes, buckets and
+            settings, by default one created with the other options
+        :type client: :class:`~riak.client.RiakClient`
+        :param loop: the event loop, by default the current one
+        :param options: the options of
+            :class:`~riak.client.RiakClient`, when no client is given
+        """
+        if client is None:
+            client = RiakClient(protocol='pbc', **options)
+        self.client = client
+        self._loop = loop or asyncio.get_event_loop()
+        transport_options = dict(client._pb_pool._options)
+        self._pool = AsyncPool(client, self._loop,
+                               client._pb_pool._pool_options['max_size'],
+                               **transport_options)
+
+    def bucket(self, name):
+        """
+        Gets a bucket of the underlying client.
+
+        :rtype: :class:`~riak.bucket.RiakBucket`
+        """
+        return self.client.bucket(name)
+
+    def close(self):
+        """
+        Closes the idle connections of the client.
+        """
+        self._pool.close()
+
+    @asyncio.coroutine
+    def _with_retries(self, fn):
+        """
+        Performs the passed coroutine function with a connection from
+        the pool, retrying it on another node if the connection fails,
+        as :meth:`RiakClient._with_retries
+        <riak.client.transport.RiakClientTransport._with_retries>`
+        does. Each attempt is limited by the ``timeout`` transport
+        option.
+
+        :param fn: the function to pass a transport
+        :type fn: function
+        """
+        client = self.client
+        skip_nodes = []
+        retry_count = client.retries
+        budget = client.retry_budget
+        if budget is not None:
+            budget.deposit()
+
+        for retry in range(retry_count):
+            if retry > 0:
+                yield From(asyncio.sleep(backoff(retry, client.retry_backoff,
+                                                 client.max_retry_backoff),
+                                         loop=self._loop))
+            try:
+                result = yield From(self._attempt(fn, skip_nodes))
+            except BadResource as e:
+                if retry < (retry_count - 1) and \
+                        (budget is None or budget.withdraw()):
+                    continue
+                else:
+                    # Re-raise the inner exception
+                    raise e.args[0]
+            raise Return(result)
+
+    @asyncio.coroutine
+    def _attempt(self, fn, skip_nodes):
+        node = self._pool.choose_node(skip_nodes)
+        try:
+            transport = yield From(self._pool.acquire(node))
+        except (EnvironmentError, EOFError) as e:
+            if _is_connection_error(e):
+                node.error_rate.incr(1)
+                skip_nodes.append(node)
+                raise BadResource(e)
+            raise
+
+        node._start_request()
+        elapsed = None
+        start = time.time()
+        try:
+            result = yield From(asyncio.wait_for(fn(transport),
+                                                 transport._timeout,
+                                                 loop=self._loop))
+        except (EnvironmentError, EOFError) as e:
+            self._pool.discard(transport)
+            if _is_connection_error(e):
+                node.error_rate.incr(1)
+                skip_nodes.append(node)
+                raise BadResource(e)
+            raise
+        except RiakError:
+            # An error response leaves the connection usable
+            elapsed = time.time() - start
+            self._pool.release(transport)
+            raise
+        except BaseException:
+            # Timed out or cancelled with the response outstanding
+            self._pool.discard(transport)
+            raise
+        else:
+            elapsed = time.time() - start
+            self._pool.release(transport)
+        finally:
+            node._finish_request(elapsed)
+        raise Return(result)
+
+    def get(self, robj, r=None, pr=None, timeout=None):
+        """
+        Fetches the contents of a Riak object, as
+        :meth:`RiakClient.get <riak.client.RiakClient.get>` does.
+
+        :rtype: coroutine
+        """
+        _validate_timeout(timeout)
+        if not isinstance(robj.key, basestring):
+            raise TypeError(
+                'key must be a string, instead got {0}'.format(repr(robj.key)))
+        return self._with_retries(
+            lambda t: t.get(robj, r=r, pr=pr, timeout=timeout))
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=None,
+            if_none_match=None, timeout=None):
+        """
+        Stores an object, as :meth:`RiakClient.put
+        <riak.client.RiakClient.put>` does.
+
+        :rtype: coroutine
+        """
+        _validate_timeout(timeout)
+        return self._with_retries(
+            lambda t: t.put(robj, w=w, dw=dw, pw=pw,
+                            return_body=return_body,
+                            if_none_match=if_none_match, timeout=timeout))
+
+    def delete(self, robj, rw=None, r=None, w=None, dw=None, pr=None,
+               pw=None, timeout=None):
+        """
+        Deletes an object, as :meth:`RiakClient.delete
+        <riak.client.RiakClient.delete>` does.
+
+        :rtype: coroutine
+        """
+        _validate_timeout(timeout)
+        return self._with_retries(
+            lambda t: t.delete(robj, rw=rw, r=r, w=w, dw=dw, pr=pr, pw=pw,
+                               timeout=timeout))
+
+    @asyncio.coroutine
+    def get_index(self, bucket, index, startkey, endkey=None,
+                  return_terms=None, max_results=None, continuation=None,
+                  timeout=None, term_regex=None):
+        """
+        Queries a secondary index, as :meth:`RiakClient.get_index
+        <riak.client.RiakClient.get_index>` does. The
+        :meth:`~riak.client.index_page.IndexPage.next_page` of the
+        resulting page is a coroutine as well.
+
+        :rtype: coroutine
+        """
+        if timeout != 'infinity':
+            _validate_timeout(timeout)
+
+        page = IndexPage(self, bucket, index, startkey, endkey,
+                         return_terms, max_results, term_regex)
+
+        results, continuation = yield From(self._with_retries(
+            lambda t: t.get_index(bucket, index, startkey, endkey,
+                                  return_terms=return_terms,
+                                  max_results=max_results,
+                                  continuation=continuation,
+                                  timeout=timeout, term_regex=term_regex)))
+
+        page.results = results
+        page.continuation = continuation
+        raise Return(page)
+
+    def mapred(self, inputs, query, timeout=None):
+        """
+        Executes a MapReduce query, as :meth:`RiakClient.mapred
+        <riak.client.RiakClient.mapred>` does.
+
+        :rtype: coroutine
+        """
+        _validate_timeout(timeout)
+        return self._with_retries(
+            lambda t: t.mapred(inputs, query, timeout))
+
+    @asyncio.coroutine
+    def stream_keys(self, bucket, timeout=None):
+        """
+        Lists the keys of a bucket as they arrive, returning an
+        :class:`~riak.transports.pbc.aio.AsyncKeyStream`. Like
+        :meth:`RiakClient.stream_keys
+        <riak.client.RiakClient.stream_keys>`, this is not retried.
+
+        .. warning:: Do not use this in production, as it requires
+           traversing through all keys stored in a cluster.
+
+        :rtype: coroutine
+        """
+        _validate_timeout(timeout)
+        transport = yield From(self._pool.acquire(
+            self._pool.choose_node()))
+        try:
+            yield From(transport.stream_keys(bucket, timeout=timeout))
+        except BaseException:
+            self._pool.discard(transport)
+            raise
+
+        def _done(transport, finished):
+            if finished:
+                self._pool.release(transport)
+            else:
+                self._pool.discard(transport)
+
+        raise Return(AsyncKeyStream(transport, _done))
@@ -0,0 +1,383 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from collections import deque
+import select
+import socket
+import time
+from riak import RiakError, DeadlineExceeded
+from riak.transports.pool import BadResource
+
+__all__ = ['fanout', 'fanout_multiget', 'FANOUT_CONNECTIONS']
+
+#: The default number of connections used by :func:`fanout`
+FANOUT_CONNECTIONS = 8
+
+
+class Poller(object):
+    """
+    Waits for any of a set of sockets to become readable or writable,
+    using ``epoll`` where the platform has it, then ``poll``, then
+    ``select``.
+    """
+
+    def __init__(self):
+        self._writers = set()
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._in, self._out = select.EPOLLIN, select.EPOLLOUT
+            # Errors and hang-ups show up as failing reads
+            self._err = select.EPOLLERR | select.EPOLLHUP
+            self._units = 1
+        elif hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._in, self._out = select.POLLIN, select.POLLOUT
+            self._err = select.POLLERR | select.POLLHUP
+            self._units = 1000
+        else:
+            self._poller = None
+            self._readers = set()
+
+    def register(self, fd, write=False):
+        """
+        Watches a socket for reads, and for writes if ``write``.
+        """
+        if self._poller is None:
+            self._readers.add(fd)
+        else:
+            self._poller.register(fd, self._in | (write and self._out))
+        if write:
+            self._writers.add(fd)
+
+    def modify(self, fd, write):
+        """
+        Changes whether a socket is watched for writes.
+        """
+        if write == (fd in self._writers):
+            return
+        if write:
+            self._writers.add(fd)
+        else:
+            self._writers.discard(fd)
+        if self._poller is not None:
+            self._poller.modify(fd, self._in | (write and self._out))
+
+    def unregister(self, fd):
+        self._writers.discard(fd)
+        if self._poller is None:
+            self._readers.discard(fd)
+        else:
+            self._poller.unregister(fd)
+
+    def poll(self, timeout=None):
+        """
+        Waits up to ``timeout`` seconds, returning a list of
+        ``(fd, readable, writable)`` tuples.
+
+        :rtype: list
+        """
+        if self._poller is None:
+            readable, writable, _ = select.select(self._readers,
+                                                  self._writers, [],
+                                                  timeout)
+            writable = set(writable)
+            events = [(fd, True, fd in writable) for fd in readable]
+            events.extend((fd, False, True) for fd in writable
+                          if fd not in readable)
+            return events
+
+        if timeout is None:
+            timeout = -1
+        else:
+            timeout *= self._units
+        return [(fd, bool(event & (self._in | self._err)),
+                 bool(event & self._out))
+                for fd, event in self._poller.poll(timeout)]
+
+    def close(self):
+        if self._poller is not None and hasattr(self._poller, 'close'):
+            self._poller.close()
+
+
+class Channel(object):
+    """
+    A PBC connection claimed from the pool for a fan-out, with the
+    operations whose requests were written to it but not answered.
+    """
+
+    def __init__(self, transport, claim):
+        self.transport = transport
+        self.claim = claim
+        self.in_flight = deque()
+        self.fd = transport._socket.fileno()
+        self.writing = False
+
+
+def fanout(client, operations, connections=FANOUT_CONNECTIONS):
+    """
+    Performs object and counter operations over several Protocol
+    Buffers connections at once from the calling thread, instead of a
+    thread per connection. The sockets are put in non-blocking mode
+    and driven by ``epoll`` (or ``poll``, or ``select``): each
+    connection has up to
+    :attr:`~riak.transports.pbc.RiakPbcTransport.PIPELINE_WINDOW`
+    requests in flight, and is given the next operation as soon as it
+    has room, so that slower nodes take on less of the work.
+
+    The operations are given as with
+    :meth:`RiakPbcTransport.pipeline
+    <riak.transports.pbc.RiakPbcTransport.pipeline>` and their
+    results are returned in the same order, with the exception as the
+    result of an operation that failed. Operations other than counter
+    updates that were in flight on a connection that fails are retried
+    on the others, up to :attr:`~riak.client.RiakClient.retries`
+    attempts in all. The :meth:`~riak.client.RiakClient.deadline` of
+    the calling thread applies to the whole fan-out; otherwise, the
+    socket timeout of the transports limits the time without any
+    progress.
+
+    :param client: the client to use
+    :type client: :class:`~riak.client.RiakClient`
+    :param operations: the operations to perform
+    :type operations: list
+    :param connections: the most connections to use
+    :type connections: int
+    :rtype: list
+    """
+    results = [None] * len(operations)
+    if not operations:
+        return results
+
+    pool = client._choose_pool('pbc')
+    retries = client.retries
+    attempts = [0] * len(operations)
+    pending = deque(range(len(operations)))
+    channels = {}
+    poller = Poller()
+    error = None
+
+    def _fail(channel, err):
+        """
+        Closes a failed connection, retrying or failing what was in
+        flight on it.
+        """
+        del channels[channel.fd]
+        poller.unregister(channel.fd)
+        node = channel.transport._node
+        node.error_rate.incr(1)
+        node._finish_request()
+        for index in reversed(channel.in_flight):
+            if operations[index][0] != 'update_counter' and \
+                    attempts[index] < retries:
+                pending.appendleft(index)
+            else:
+                results[index] = err
+        channel.claim.__exit__(BadResource, BadResource(err), None)
+
+    def _fill(channel):
+        transport = channel.transport
+        window = transport.PIPELINE_WINDOW
+        while pending and len(channel.in_flight) < window:
+            index = pending.popleft()
+            name, args, kwargs = operations[index]
+            req_code, resp_code = transport.PIPELINE_OPERATIONS[name]
+            try:
+                req = getattr(transport, '_%s_req' % name)(*args, **kwargs)
+                transport._write_msg(req_code, req)
+            except Exception as e:
+                results[index] = e
+            else:
+                attempts[index] += 1
+                channel.in_flight.append(index)
+        if transport._outbuf_end:
+            channel.writing = not transport._send_some()
+        poller.modify(channel.fd, channel.writing)
+
+    def _step(channel, readable=False, writable=False):
+        try:
+            if writable and channel.writing:
+                channel.writing = not channel.transport._send_some()
+            if readable:
+                _read(channel)
+            _fill(channel)
+        except Exception as e:
+            _fail(channel, e)
+            return e
+
+    def _read(channel):
+        transport = channel.transport
+        count = transport._recv_some()
+        if count == 0:
+            raise RiakError("Socket closed with %d responses outstanding"
+                            % len(channel.in_flight))
+        while channel.in_flight:
+            pkt = transport._buffered_pkt()
+            if pkt is None:
+                break
+            index = channel.in_flight.popleft()
+            name, args, kwargs = operations[index]
+            req_code, resp_code = transport.PIPELINE_OPERATIONS[name]
+            try:
+                msg_code, resp = transport._decode_pkt(*pkt,
+                                                       expect=resp_code)
+                results[index] = getattr(transport,
+                                         '_%s_resp' % name)(args[0], resp)
+            except RiakError as e:
+                results[index] = e
+
+    try:
+        # Claim connections, spread over the nodes, and do any
+        # blocking setup (connecting, detecting the server version)
+        # before switching them to non-blocking mode.
+        used = []
+        for i in range(min(connections, len(operations))):
+            if len(used) >= len(client.nodes):
+                used = []
+            claim = pool.take(skip_nodes=used)
+            try:
+                transport = claim.__enter__()
+            except Exception as e:
+                error = e
+                continue
+            try:
+                transport._connect()
+                transport._object_features
+                transport._socket.setblocking(0)
+            except Exception as e:
+                error = e
+                claim.__exit__(BadResource, BadResource(e), None)
+                continue
+            transport._node._start_request()
+            used.append(transport._node)
+            channel = Channel(transport, claim)
+            channels[channel.fd] = channel
+            poller.register(channel.fd)
+
+        deadline = client._locals.riak_deadline
+        idle_timeout = None
+        for channel in channels.values():
+            idle_timeout = channel.transport._timeout
+            error = _step(channel) or error
+
+        while channels and (pending or any(c.in_flight for c in
+                                           channels.itervalues())):
+            timeout = idle_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded()
+                timeout = remaining if timeout is None \
+                    else min(timeout, remaining)
+
+            events = poller.poll(timeout)
+            if not events:
+                if deadline is not None and deadline <= time.time():
+                    raise DeadlineExceeded()
+                raise socket.timeout("timed out")
+
+            for fd, readable, writable in events:
+                channel = channels.get(fd)
+                if channel is not None:
+                    error = _step(channel, readable, writable) or error
+            # Operations retried after a failure may be taken up by
+            # connections that had nothing left to do
+            if pending:
+                for channel in channels.values():
+                    error = _step(channel) or error
+    except (socket.timeout, DeadlineExceeded) as e:
+        # Responses may still arrive, so the connections cannot be
+        # reused.
+        error = e
+        for channel in channels.values():
+            _fail(channel, e)
+        for index in pending:
+            results[index] = e
+    finally:
+        for channel in channels.values():
+            if channel.in_flight or channel.writing:
+                # Interrupted, leaving the connection out of step
+                _fail(channel, error)
+                continue
+            transport = channel.transport
+            transport._socket.settimeout(transport._request_timeout or
+                                         transport._timeout)
+            transport._node._finish_request()
+            channel.claim.__exit__(None, None, None)
+        poller.close()
+
+    # Whatever could not be sent because every connection failed
+    for index in pending:
+        results[index] = error or RiakError("no connection was available")
+    return results
+
+
+def fanout_multiget(client, keys, connections=FANOUT_CONNECTIONS,
+                    **options):
+    """
+    Fetches many keys with :func:`fanout`, as an alternative to the
+    thread pool of :func:`~riak.client.multiget.multiget`. The results
+    are returned in the order of the keys, in the same form.
+
+    :param client: the client to use
+    :type client: :class:`~riak.client.RiakClient`
+    :param keys: the bucket/key pairs to fetch
+    :type keys: list of two-tuples -- bucket/key pairs
+    :param connections: the most connections to use
+    :type connections: int
+    :rtype: list
+    """
+    operations = [('get', (client.bucket(bucket).new(key),), options)
+                  for bucket, key in keys]
+    results = fanout(client, operations, connections)
+    return [(bucket, key, result) if isinstance(result, Exception)
+            else result
+            for (bucket, key), result in zip(keys, results)]
+
+if __name__ == '__main__':
+    # Run a benchmark of fetching many keys with the thread pool of
+    # multiget and with a fan-out over as many connections as there
+    # are threads, against a node on localhost.
+    from riak import RiakClient
+    from riak.client.multiget import multiget, POOL_SIZE
+    import riak.benchmark as benchmark
+    client = RiakClient(protocol='pbc')
+    bkeys = [('multiget', str(key)) for key in xrange(10000)]
+
+    data = open(__file__).read()
+
+    print "Benchmarking fan-out multiget:"
+    print "   Threads: {0}".format(POOL_SIZE)
+    print "      Keys: {0}".format(len(bkeys))
+    print
+
+    with benchmark.measure() as b:
+        with b.report('populate'):
+            with client.pipeline(connections=POOL_SIZE) as pipeline:
+                for bucket, key in bkeys:
+                    pipeline.put(client.bucket(bucket).new(
+                        key, encoded_data=data, content_type='text/plain'),
+                        return_body=False)
+    for b in benchmark.measure_with_rehearsal():
+        with b.report('threads'):
+            multiget(client, bkeys)
+
+        with b.report('fanout'):
+            fanout_multiget(client, bkeys, POOL_SIZE)
+
+        with b.report('fanout x4'):
+            fanout_multiget(client, bkeys, POOL_SIZE * 4)
@@ -0,0 +1,164 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from threading import Thread, Event, RLock
+import weakref
+
+__all__ = ['HealthChecker']
+
+
+class HealthChecker(object):
+    """
+    Pings every node of a client on an interval from a background
+    thread and maintains the circuit state of each
+    :class:`~riak.node.RiakNode`. Nodes whose circuit is open are
+    skipped when choosing nodes for requests, so an outage is
+    detected without failing user requests.
+
+    The checker uses a connection of its own to each node, outside of
+    the connection pools, so that checks neither wait for nor occupy
+    pooled connections. These connections have a timeout of their
+    own, so that a node that does not answer at all fails its check
+    instead of holding up the checks of the others.
+    """
+
+    def __init__(self, client, interval=5.0, failure_threshold=2,
+                 open_timeout=None, protocol=None, timeout=None):
+        """
+        :param client: the client whose nodes are checked
+        :type client: riak.client.RiakClient
+        :param interval: the number of seconds between checks
+        :type interval: float
+        :param failure_threshold: the number of consecutive failed
+            checks that open the circuit of a node
+        :type failure_threshold: int
+        :param open_timeout: the number of seconds an open node is
+            left alone before it is checked again (half-open),
+            defaults to ``interval``
+        :type open_timeout: float
+        :param protocol: the protocol to check with, defaults to the
+            preferred protocol of the client
+        :type protocol: string
+        :param timeout: the number of seconds to connect and wait for
+            a ping, defaults to half of ``interval``
+        :type timeout: float
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+
+        self._client = client
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout or interval
+        self.protocol = protocol
+        self.timeout = timeout or interval / 2.0
+        self._transports = {}
+        self._lock = RLock()
+        self._stop = Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Checks each node that is due for a check once, in the calling
+        thread.
+        """
+        pool = self._client._choose_pool(self.protocol)
+        for node in list(self._client.nodes):
+            if node._check_due(self.open_timeout):
+                self._check_node(pool, node)
+
+    def _check_node(self, pool, node):
+        """
+        Pings a single node, updating its circuit state. The lock is
+        only held to take and return the connection, not while
+        waiting for the node.
+        """
+        key = (pool, node)
+        with self._lock:
+            transport = self._transports.pop(key, None)
+        try:
+            if transport is None:
+                transport = pool.create_node_resource(
+                    node, timeout=self.timeout, connect_timeout=self.timeout)
+            ok = transport.ping()
+        except Exception:
+            ok = False
+
+        if ok:
+            node._check_passed()
+        else:
+            node._check_failed(self.failure_threshold)
+
+        with self._lock:
+            if ok and not self._stop.is_set() and \
+                    key not in self._transports:
+                self._transports[key] = transport
+                transport = None
+        if transport is not None:
+            self._destroy(pool, transport)
+
+    def _destroy(self, pool, transport):
+        try:
+            pool.destroy_resource(transport)
+        except Exception:
+            pass
+
+    def start(self):
+        """
+        Starts the background thread if it is not already running.
+        The thread only holds a weak reference to the checker and
+        exits once it is stopped or garbage-collected.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        ref = weakref.ref(self)
+        stop = self._stop
+        interval = self.interval
+
+        def _run():
+            while not stop.wait(interval):
+                checker = ref()
+                if checker is None:
+                    return
+                try:
+                    checker.check()
+                except Exception:
+                    # The client is in an unexpected state; the next
+                    # run will try again.
+                    pass
+                del checker
+
+        self._thread = Thread(target=_run,
+                              name="riak.client.health-checker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread and closes the connections used
+        for checks. Nodes keep their last circuit state.
+        """
+        self._stop.set()
+        with self._lock:
+            transports, self._transports = self._transports, {}
+        # A check in progress closes its own connection
+        for (pool, node), transport in transports.iteritems():
+            self._destroy(pool, transport)
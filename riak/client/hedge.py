@@ -0,0 +1,187 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from collections import deque
+from Queue import Queue
+from threading import Lock, Thread
+
+__all__ = ['Hedger', 'AttemptPool']
+
+
+class AttemptPool(object):
+    """
+    A pool of daemon threads that run the attempts of hedged fetches,
+    so that a thread is not started for every fetch. An idle thread
+    is reused if there is one, and a new one is started otherwise,
+    so attempts never wait for each other. Up to ``idle_threads``
+    threads are kept once their attempts are done; the others exit.
+    """
+
+    def __init__(self, idle_threads=8):
+        """
+        :param idle_threads: the most threads kept waiting for
+            another attempt
+        :type idle_threads: int
+        """
+        self.idle_threads = idle_threads
+        self._tasks = Queue()
+        # The number of idle threads not yet promised a queued task
+        self._idle = 0
+        self._lock = Lock()
+
+    def run(self, fn, *args):
+        """
+        Calls ``fn`` with ``args`` in one of the threads of the pool.
+
+        :param fn: the function to call
+        :type fn: function
+        """
+        with self._lock:
+            start = self._idle == 0
+            if not start:
+                self._idle -= 1
+        self._tasks.put((fn, args))
+        if start:
+            worker = Thread(target=self._work, name="riak.client.hedge")
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            fn, args = self._tasks.get()
+            try:
+                fn(*args)
+            finally:
+                with self._lock:
+                    if self._idle >= self.idle_threads:
+                        return
+                    self._idle += 1
+
+
+class Hedger(object):
+    """
+    Decides when a fetch is hedged and counts how hedging goes. A
+    fetch that has not answered after the given percentile of recent
+    fetch latencies is sent a second time, to a different node, and
+    the first response wins.
+
+    Example::
+
+        client = RiakClient(protocol='pbc', nodes=[...],
+                            hedge_percentile=95)
+        ...
+        print client.hedger.hedge_rate, client.hedger.win_rate
+    """
+
+    def __init__(self, percentile=95, min_delay=0.001, window=1000,
+                 min_samples=20):
+        """
+        :param percentile: the percentile of recent latencies after
+            which a fetch is hedged
+        :type percentile: float
+        :param min_delay: the smallest delay in seconds before a
+            fetch is hedged
+        :type min_delay: float
+        :param window: the number of recent latencies kept
+        :type window: int
+        :param min_samples: the number of latencies needed before any
+            fetch is hedged
+        :type min_samples: int
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100")
+
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._samples = deque(maxlen=window)
+        self._recorded = 0
+        self._delay = None
+        self._lock = Lock()
+        #: The threads that run the attempts of hedged fetches
+        self.attempts = AttemptPool()
+
+    def delay(self):
+        """
+        Returns the number of seconds to wait before hedging a fetch,
+        or None while too few latencies are known.
+
+        :rtype: float
+        """
+        with self._lock:
+            if self._delay is None and len(self._samples) >= \
+                    self.min_samples:
+                ordered = sorted(self._samples)
+                index = int(len(ordered) * self.percentile / 100.0)
+                self._delay = max(self.min_delay,
+                                  ordered[min(index, len(ordered) - 1)])
+            return self._delay
+
+    def record(self, latency):
+        """
+        Records the latency of a fetch that was not hedged, or of the
+        first attempt of a hedged one.
+
+        :param latency: the latency in seconds
+        :type latency: float
+        """
+        with self._lock:
+            self._samples.append(latency)
+            self._recorded += 1
+            # Sorting the window on every fetch would be wasteful, so
+            # the delay is only recomputed every few samples.
+            if self._recorded % 16 == 0:
+                self._delay = None
+
+    def count(self, hedged, won):
+        """
+        Counts a fetch towards :attr:`hedge_rate` and :attr:`win_rate`.
+
+        :param hedged: whether the fetch was hedged
+        :type hedged: bool
+        :param won: whether the hedge answered first
+        :type won: bool
+        """
+        with self._lock:
+            self.requests += 1
+            if hedged:
+                self.hedges += 1
+            if won:
+                self.hedge_wins += 1
+
+    @property
+    def hedge_rate(self):
+        """
+        The fraction of fetches that were hedged.
+
+        :rtype: float
+        """
+        return self.hedges / float(self.requests or 1)
+
+    @property
+    def win_rate(self):
+        """
+        The fraction of hedged fetches that were answered by the
+        hedge first.
+
+        :rtype: float
+        """
+        return self.hedge_wins / float(self.hedges or 1)
@@ -16,8 +16,10 @@ specific language governing permissions and limitations
 under the License.
 """
 
-from transport import RiakClientTransport, retryable, retryableHttpOnly
+from transport import RiakClientTransport, retryable, retryableHttpOnly, \
+    hedgeable
 from multiget import multiget
+from fanout import fanout_multiget
 from index_page import IndexPage
 
 
@@ -306,7 +308,7 @@ class RiakClientOperations(RiakClientTransport):
                              if_none_match=if_none_match,
                              timeout=timeout)
 
-    @retryable
+    @hedgeable
     def get(self, transport, robj, r=None, pr=None, timeout=None):
         """
         get(robj, r=None, pr=None, timeout=None)
@@ -314,7 +316,8 @@ class RiakClientOperations(RiakClientTransport):
         Fetches the contents of a Riak object.
 
         .. note:: This request is automatically retried :attr:`retries`
-           times if it fails due to network error.
+           times if it fails due to network error, and is hedged if
+           the client has a :attr:`hedger`.
 
         :param robj: the object to fetch
         :type robj: RiakObject
@@ -546,17 +549,25 @@ class RiakClientOperations(RiakClientTransport):
         """
         transport.fulltext_delete(index, docs, queries)
 
-    def multiget(self, pairs, **params):
+    def multiget(self, pairs, connections=None, **params):
         """
-        Fetches many keys in parallel via threads.
+        Fetches many keys in parallel via threads, or, when the number
+        of ``connections`` is given, over that many Protocol Buffers
+        connections driven from the calling thread with
+        :func:`~riak.client.fanout.fanout_multiget`.
 
         :param pairs: list of bucket/key tuple pairs
         :type pairs: list
+        :param connections: the number of connections to fetch over
+            without threads
+        :type connections: int
         :param params: additional request flags, e.g. r, pr
         :type params: dict
         :rtype: list of :class:`RiakObject <riak.riak_object.RiakObject>`
             instances
         """
+        if connections:
+            return fanout_multiget(self, pairs, connections, **params)
         return multiget(self, pairs, **params)
 
     @retryable
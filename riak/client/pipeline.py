@@ -0,0 +1,183 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from riak.client.operations import _validate_timeout
+from riak.client.fanout import fanout
+
+__all__ = ['RiakPipeline']
+
+
+class RiakPipeline(object):
+    """
+    Collects object and counter operations and performs them together
+    on a single Protocol Buffers connection, writing all requests
+    before reading the responses, so that a batch costs about one
+    round trip instead of one per operation. Create one with
+    :meth:`RiakClient.pipeline() <riak.client.RiakClient.pipeline>`.
+
+    Each method adds an operation and returns its position in the
+    results. :meth:`execute` returns the results in the order the
+    operations were added; an operation that failed has the exception
+    as its result, without affecting the others. Example::
+
+        with client.pipeline() as pipeline:
+            for key in keys:
+                pipeline.get(bucket.new(key))
+            pipeline.update_counter(counters, 'fetches', len(keys))
+        for result in pipeline.results:
+            ...
+
+    Batches without counter updates are retried like other requests if
+    the connection fails; since counter updates are not idempotent,
+    batches including them are not.
+
+    Large batches can be spread over several connections, which are
+    driven together by :func:`~riak.client.fanout.fanout` from the
+    calling thread, by giving the number of ``connections``. Failed
+    operations are then retried one by one instead.
+    """
+
+    def __init__(self, client, connections=1):
+        """
+        :param client: the client to perform the operations with
+        :type client: :class:`~riak.client.RiakClient`
+        :param connections: the most connections to use
+        :type connections: int
+        """
+        self._client = client
+        self.connections = connections
+        self._operations = []
+        self._idempotent = True
+        #: The results of the last :meth:`execute`
+        self.results = None
+
+    def __len__(self):
+        return len(self._operations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def _add(self, name, *args, **kwargs):
+        self._operations.append((name, args, kwargs))
+        return len(self._operations) - 1
+
+    def get(self, robj, r=None, pr=None, timeout=None):
+        """
+        Adds a fetch of an object, as with :meth:`RiakClient.get
+        <riak.client.RiakClient.get>`. The result is the object.
+
+        :param robj: the object to fetch
+        :type robj: RiakObject
+        :rtype: int
+        """
+        _validate_timeout(timeout)
+        if not isinstance(robj.key, basestring):
+            raise TypeError(
+                'key must be a string, instead got {0}'.format(repr(robj.key)))
+        return self._add('get', robj, r=r, pr=pr, timeout=timeout)
+
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, timeout=None):
+        """
+        Adds a store of an object, as with :meth:`RiakClient.put
+        <riak.client.RiakClient.put>`. The result is the object.
+
+        :param robj: the object to store
+        :type robj: RiakObject
+        :rtype: int
+        """
+        _validate_timeout(timeout)
+        return self._add('put', robj, w=w, dw=dw, pw=pw,
+                         return_body=return_body,
+                         if_none_match=if_none_match, timeout=timeout)
+
+    def delete(self, robj, rw=None, r=None, w=None, dw=None, pr=None,
+               pw=None, timeout=None):
+        """
+        Adds a deletion of an object, as with :meth:`RiakClient.delete
+        <riak.client.RiakClient.delete>`. The result is the object.
+
+        :param robj: the object to delete
+        :type robj: RiakObject
+        :rtype: int
+        """
+        _validate_timeout(timeout)
+        return self._add('delete', robj, rw=rw, r=r, w=w, dw=dw, pr=pr,
+                         pw=pw, timeout=timeout)
+
+    def get_counter(self, bucket, key, r=None, pr=None, basic_quorum=None,
+                    notfound_ok=None):
+        """
+        Adds a fetch of a counter, as with
+        :meth:`RiakClient.get_counter
+        <riak.client.RiakClient.get_counter>`. The result is the value
+        of the counter.
+
+        :rtype: int
+        """
+        return self._add('get_counter', bucket, key, r=r, pr=pr,
+                         basic_quorum=basic_quorum, notfound_ok=notfound_ok)
+
+    def update_counter(self, bucket, key, value, w=None, dw=None, pw=None,
+                       returnvalue=False):
+        """
+        Adds an update of a counter, as with
+        :meth:`RiakClient.update_counter
+        <riak.client.RiakClient.update_counter>`.
+
+        :rtype: int
+        """
+        if type(value) not in (int, long):
+            raise TypeError("Counter update amount must be an integer")
+        if value == 0:
+            raise ValueError("Cannot increment counter by 0")
+
+        self._idempotent = False
+        return self._add('update_counter', bucket, key, value, w=w, dw=dw,
+                         pw=pw, returnvalue=returnvalue)
+
+    def execute(self):
+        """
+        Performs the operations added so far and clears them,
+        returning their results.
+
+        :rtype: list
+        """
+        operations, self._operations = self._operations, []
+        idempotent, self._idempotent = self._idempotent, True
+
+        client = self._client
+        pool = client._choose_pool('pbc')
+
+        def thunk(transport):
+            return transport.pipeline(operations)
+
+        if not operations:
+            self.results = []
+        elif self.connections > 1:
+            self.results = fanout(client, operations, self.connections)
+        elif idempotent:
+            self.results = client._with_retries(pool, thunk)
+        else:
+            with client.retry_count(1):
+                self.results = client._with_retries(pool, thunk)
+        return self.results
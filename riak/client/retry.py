@@ -0,0 +1,104 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+from threading import Lock
+import random
+import time
+
+__all__ = ['RetryBudget', 'backoff']
+
+
+def backoff(attempt, base, cap):
+    """
+    Returns the number of seconds to wait before the given retry,
+    using exponential backoff with full jitter: a random time between
+    zero and ``base * 2 ** (attempt - 1)``, but at most ``cap``.
+
+    :param attempt: the number of the retry, starting at 1
+    :type attempt: int
+    :param base: the longest wait before the first retry, in seconds
+    :type base: float
+    :param cap: the longest wait before any retry, in seconds
+    :type cap: float
+    :rtype: float
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RetryBudget(object):
+    """
+    A token bucket that limits retries to a percentage of the recent
+    request volume of a client, so that clients do not multiply the
+    load on the surviving nodes during an outage. Every request adds
+    ``percent / 100`` tokens and every retry takes one; a small
+    number of retries per second is always allowed so that clients
+    with little traffic can still retry.
+    """
+
+    def __init__(self, percent=20, min_per_second=10, max_tokens=100):
+        """
+        :param percent: the percentage of requests that may be retried
+        :type percent: float
+        :param min_per_second: the number of retries per second that
+            are allowed regardless of the request volume
+        :type min_per_second: float
+        :param max_tokens: the most tokens the bucket holds, which
+            bounds how far back "recent" reaches
+        :type max_tokens: float
+        """
+        if percent < 0:
+            raise ValueError("percent must not be negative")
+
+        self.ratio = percent / 100.0
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = float(max_tokens)
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self._t0 = time.time()
+        self._lock = Lock()
+
+    def _refill(self, tokens):
+        now = time.time()
+        tokens += self.min_per_second * (now - self._t0)
+        self._t0 = now
+        self.tokens = min(self.max_tokens, self.tokens + tokens)
+
+    def deposit(self):
+        """
+        Records a request, adding to the budget.
+        """
+        with self._lock:
+            self.requests += 1
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """
+        Takes a retry from the budget, returning False if it is spent.
+
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill(0)
+            if self.tokens < 1:
+                self.rejected += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
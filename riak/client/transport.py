@@ -16,11 +16,18 @@ specific language governing permissions and limitations
 under the License.
 """
 from contextlib import contextmanager
-from riak.transports.pool import BadResource
+from riak import DeadlineExceeded
+from riak.transports.pool import BadResource, PoolExhausted
+from riak.client.retry import backoff
 from riak.transports.pbc import is_retryable as is_pbc_retryable
 from riak.transports.http import is_retryable as is_http_retryable
+from Queue import Queue, Empty
+import inspect
+import math
+import socket
 import threading
 import httplib
+import time
 
 #: The default (global) number of times to retry requests that are
 #: retryable. This can be modified locally, per-thread, via the
@@ -28,6 +35,17 @@ import httplib
 #: :attr:`RiakClient.retry_count` method in a ``with`` statement.
 DEFAULT_RETRY_COUNT = 3
 
+#: The default longest wait in seconds before the first retry of a
+#: request. The wait doubles with every retry, and a random time up
+#: to it is spent; see :func:`riak.client.retry.backoff`. This can be
+#: modified per client via :attr:`RiakClient.retry_backoff`.
+DEFAULT_RETRY_BACKOFF = 0.01
+
+#: The default longest wait in seconds before any retry of a request.
+#: This can be modified per client via
+#: :attr:`RiakClient.max_retry_backoff`.
+DEFAULT_MAX_RETRY_BACKOFF = 1.0
+
 
 class _client_locals(threading.local):
     """
@@ -35,6 +53,7 @@ class _client_locals(threading.local):
     """
     def __init__(self):
         self.riak_retries_count = DEFAULT_RETRY_COUNT
+        self.riak_deadline = None
 
 
 class RiakClientTransport(object):
@@ -47,6 +66,10 @@ class RiakClientTransport(object):
     _http_pool = None
     _pb_pool = None
     _locals = _client_locals()
+    hedger = None
+    retry_budget = None
+    retry_backoff = DEFAULT_RETRY_BACKOFF
+    max_retry_backoff = DEFAULT_MAX_RETRY_BACKOFF
 
     def _get_retry_count(self):
         return self._locals.riak_retries_count or DEFAULT_RETRY_COUNT
@@ -91,6 +114,88 @@ class RiakClientTransport(object):
         finally:
             self.retries = old_retries
 
+    @contextmanager
+    def deadline(self, timeout):
+        """
+        deadline(timeout)
+
+        Bounds the total time spent by the operations in the scope of
+        the ``with`` statement (in the current thread), including all
+        of their retries, to ``timeout`` milliseconds. The server-side
+        ``timeout`` of each request and the socket timeouts are
+        lowered to the time remaining, and once the deadline has
+        passed operations raise :class:`~riak.DeadlineExceeded`
+        without being attempted. Nested deadlines can only shorten the
+        enclosing one.
+
+        The same bound can be given to a single retryable operation
+        with its ``deadline`` option.
+
+        Example::
+
+            with client.deadline(200):
+                obj = bucket.get('key')
+                obj.store()
+
+            bucket.get('key', deadline=50)
+
+        :param timeout: the time allowed in milliseconds
+        :type timeout: int
+        """
+        if not isinstance(timeout, (int, long, float)) or timeout <= 0:
+            raise ValueError("deadline must be a positive number of "
+                             "milliseconds")
+
+        old_deadline = self._locals.riak_deadline
+        deadline = time.time() + timeout / 1000.0
+        if old_deadline is not None:
+            deadline = min(old_deadline, deadline)
+        self._locals.riak_deadline = deadline
+        try:
+            yield
+        finally:
+            self._locals.riak_deadline = old_deadline
+
+    def _time_remaining(self):
+        """
+        Returns the number of seconds left until the deadline of the
+        current thread, or None if there is none, raising
+        :class:`~riak.DeadlineExceeded` once it has passed.
+
+        :rtype: float
+        """
+        deadline = self._locals.riak_deadline
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining
+
+    def warm_up(self, count, protocol=None):
+        """
+        warm_up(count, protocol=None)
+
+        Opens ``count`` connections to every node in parallel, detects
+        the server version on each of them and parks them in the
+        connection pool, so that the first requests don't pay for
+        connection setup. Nodes that cannot be reached are skipped.
+        Returns the number of idle connections in the pool.
+
+        Example::
+
+            client = RiakClient(protocol='pbc')
+            client.warm_up(5)
+
+        :param count: the number of connections per node
+        :type count: int
+        :param protocol: the protocol to warm up, defaults to the
+            preferred protocol
+        :type protocol: string
+        :rtype: int
+        """
+        return self._choose_pool(protocol).warm_up(count)
+
     @contextmanager
     def _transport(self):
         """
@@ -103,41 +208,175 @@ class RiakClientTransport(object):
         with pool.take() as transport:
             yield transport
 
-    def _with_retries(self, pool, fn):
+    def _with_retries(self, pool, fn, skip_nodes=None):
         """
         Performs the passed function with retries against the given pool.
+        The latency and number of requests in flight are recorded on
+        the node of each transport used, for node selection. Retries
+        are spaced out by :func:`~riak.client.retry.backoff` and
+        limited by the :attr:`retry_budget`, and stop at the
+        :meth:`deadline` of the current thread.
 
         :param pool: the connection pool to use
-        :type pool: Pool
+        :type pool: NodePool
         :param fn: the function to pass a transport
         :type fn: function
+        :param skip_nodes: nodes to avoid, if possible
+        :type skip_nodes: list
         """
-        skip_nodes = []
-
-        def _skip_bad_nodes(transport):
-            return transport._node not in skip_nodes
-
+        skip_nodes = list(skip_nodes or [])
         retry_count = self.retries
+        budget = self.retry_budget
+        if budget is not None:
+            budget.deposit()
 
         for retry in range(retry_count):
+            remaining = self._time_remaining()
+            if retry > 0:
+                wait = backoff(retry, self.retry_backoff,
+                               self.max_retry_backoff)
+                if remaining is not None and wait >= remaining:
+                    raise DeadlineExceeded()
+                time.sleep(wait)
+                remaining = self._time_remaining()
             try:
-                with pool.take(_filter=_skip_bad_nodes) as transport:
+                with pool.take(skip_nodes=skip_nodes,
+                               timeout=remaining) as transport:
+                    # Waiting for the transport used up some of the
+                    # time left.
+                    remaining = self._time_remaining()
+                    node = transport._node
+                    node._start_request()
+                    elapsed = None
+                    start = time.time()
+                    if remaining is not None:
+                        transport._set_timeout(remaining)
                     try:
-                        return fn(transport)
+                        result = fn(transport)
+                        elapsed = time.time() - start
+                        return result
+                    except socket.timeout:
+                        if remaining is None:
+                            raise
+                        # The response may still arrive, so the
+                        # connection cannot be reused.
+                        raise BadResource(DeadlineExceeded())
                     except (IOError, httplib.HTTPException) as e:
                         if _is_retryable(e):
-                            transport._node.error_rate.incr(1)
-                            skip_nodes.append(transport._node)
+                            node.error_rate.incr(1)
+                            skip_nodes.append(node)
                             raise BadResource(e)
                         else:
+                            elapsed = time.time() - start
                             raise
+                    finally:
+                        node._finish_request(elapsed)
+                        if remaining is not None:
+                            transport._set_timeout(None)
+            except PoolExhausted:
+                if remaining is not None:
+                    # Raises DeadlineExceeded if the wait was cut short
+                    # by the deadline rather than the acquire timeout.
+                    self._time_remaining()
+                raise
             except BadResource as e:
-                if retry < (retry_count - 1):
+                if retry < (retry_count - 1) and \
+                        not isinstance(e.args[0], DeadlineExceeded) and \
+                        (budget is None or budget.withdraw()):
                     continue
                 else:
                     # Re-raise the inner exception
                     raise e.args[0]
 
+    def _with_hedging(self, pool, robj, fn):
+        """
+        Performs the passed fetch with retries against the given pool,
+        sending it a second time to a different node if it takes
+        longer than the delay given by the :attr:`hedger`. Each
+        attempt fetches into a copy of ``robj``, and the first
+        successful one is copied back into it. The attempts run in
+        the threads of the hedger's
+        :class:`~riak.client.hedge.AttemptPool`, and the losing one is
+        left to finish there, so that its connection is drained and
+        returned to the pool, and its result is discarded.
+
+        :param pool: the connection pool to use
+        :type pool: NodePool
+        :param robj: the object to fetch
+        :type robj: RiakObject
+        :param fn: the function to pass a transport and an object
+        :type fn: function
+        """
+        hedger = self.hedger
+        delay = hedger.delay()
+        if delay is None:
+            start = time.time()
+            result = self._with_retries(pool, lambda t: fn(t, robj))
+            hedger.record(time.time() - start)
+            hedger.count(False, False)
+            return result
+
+        done = threading.Event()
+        node_known = threading.Event()
+        results = Queue()
+        used_nodes = []
+        deadline = self._locals.riak_deadline
+        retries = self._locals.riak_retries_count
+
+        def _attempt(index, skip_nodes):
+            self._locals.riak_deadline = deadline
+            self._locals.riak_retries_count = retries
+            obj = robj.__class__(robj.client, robj.bucket, robj.key)
+            obj._resolver = robj._resolver
+
+            def thunk(transport):
+                if done.is_set():
+                    # The other attempt has already won
+                    return None
+                used_nodes.append(transport._node)
+                node_known.set()
+                return fn(transport, obj)
+
+            start = time.time()
+            try:
+                result = self._with_retries(pool, thunk, skip_nodes)
+                if index == 0:
+                    hedger.record(time.time() - start)
+                results.put((index, obj, result, None))
+            except Exception as e:
+                results.put((index, obj, None, e))
+            finally:
+                node_known.set()
+
+        hedger.attempts.run(_attempt, 0, None)
+        try:
+            index, obj, result, error = results.get(timeout=delay)
+            hedged = False
+        except Empty:
+            # The hedge has to avoid the node of the first attempt,
+            # which is only known once it has a connection.
+            node_known.wait()
+            hedger.attempts.run(_attempt, 1, list(used_nodes))
+            hedged = True
+            index, obj, result, error = results.get()
+            if error is not None:
+                # Give the other attempt a chance to succeed
+                other = results.get()
+                if other[3] is None:
+                    index, obj, result, error = other
+        done.set()
+        hedger.count(hedged, hedged and index == 1 and error is None)
+
+        if error is not None:
+            raise error
+        robj.vclock = obj.vclock
+        robj.siblings = obj.siblings
+        for sibling in robj.siblings:
+            sibling._robject = robj
+        if result is obj:
+            return robj
+        return result
+
     def _choose_pool(self, protocol=None):
         """
         Selects a connection pool according to the default protocol
@@ -145,7 +384,7 @@ class RiakClientTransport(object):
 
         :param protocol: the protocol to use
         :type protocol: string
-        :rtype: Pool
+        :rtype: NodePool
         """
         if not protocol:
             protocol = self.protocol
@@ -170,16 +409,72 @@ def _is_retryable(error):
     return is_pbc_retryable(error) or is_http_retryable(error)
 
 
+def _timeout_position(fn):
+    """
+    Returns the position of the ``timeout`` argument of a client
+    operation among the arguments that follow the transport, or None
+    if it has none.
+
+    :rtype: int
+    """
+    args = inspect.getargspec(fn).args
+    if 'timeout' in args:
+        return args.index('timeout') - 2
+    return None
+
+
+def _apply_deadline(client, position, args, kwargs):
+    """
+    Lowers the ``timeout`` argument of a client operation to the time
+    left until the deadline of the current thread, if any. Returns
+    the new arguments.
+
+    :rtype: tuple
+    """
+    remaining = client._time_remaining()
+    if remaining is None or position is None:
+        return args, kwargs
+
+    timeout = int(math.ceil(remaining * 1000))
+    if position < len(args):
+        if args[position] is None or args[position] > timeout:
+            args = args[:position] + (timeout,) + args[position + 1:]
+    elif kwargs.get('timeout') is None or kwargs['timeout'] > timeout:
+        kwargs = dict(kwargs, timeout=timeout)
+    return args, kwargs
+
+
+def _deadline_option(wrapper):
+    """
+    Adds the ``deadline`` option to a wrapped client operation, which
+    runs it within :meth:`RiakClient.deadline`.
+    """
+    def _wrapper(self, *args, **kwargs):
+        deadline = kwargs.pop('deadline', None)
+        if deadline is None:
+            return wrapper(self, *args, **kwargs)
+        with self.deadline(deadline):
+            return wrapper(self, *args, **kwargs)
+
+    return _wrapper
+
+
 def retryable(fn, protocol=None):
     """
     Wraps a client operation that can be retried according to the set
-    :attr:`RiakClient.retries`. Used internally.
+    :attr:`RiakClient.retries`. The operation also accepts the
+    ``deadline`` option, see :meth:`RiakClient.deadline`. Used
+    internally.
     """
+    position = _timeout_position(fn)
+
+    @_deadline_option
     def wrapper(self, *args, **kwargs):
         pool = self._choose_pool(protocol)
 
         def thunk(transport):
-            return fn(self, transport, *args, **kwargs)
+            _args, _kwargs = _apply_deadline(self, position, args, kwargs)
+            return fn(self, transport, *_args, **_kwargs)
 
         return self._with_retries(pool, thunk)
 
@@ -189,6 +484,35 @@ def retryable(fn, protocol=None):
     return wrapper
 
 
+def hedgeable(fn):
+    """
+    Wraps a retryable fetch of an object, which is hedged when the
+    client has a :attr:`RiakClient.hedger`. The wrapped function
+    takes the object as its first argument after the transport. Used
+    internally.
+    """
+    position = _timeout_position(fn)
+
+    @_deadline_option
+    def wrapper(self, robj, *args, **kwargs):
+        pool = self._choose_pool()
+
+        def thunk(transport, obj):
+            _args, _kwargs = _apply_deadline(self, position, (obj,) + args,
+                                             kwargs)
+            return fn(self, transport, *_args, **_kwargs)
+
+        if self.hedger is None:
+            return self._with_retries(pool, lambda t: thunk(t, robj))
+        else:
+            return self._with_hedging(pool, robj, thunk)
+
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__repr__ = fn.__repr__
+
+    return wrapper
+
+
 def retryableHttpOnly(fn):
     """
     Wraps a retryable client operation that is only valid over HTTP.
@@ -0,0 +1,190 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import zlib
+
+__all__ = ['CompressionPolicy', 'compress', 'decompress',
+           'COMPRESSION_THRESHOLD']
+
+#: The default size, in bytes, from which values are compressed
+COMPRESSION_THRESHOLD = 4096
+
+#: The zlib window bits of the content encodings that values can be
+#: compressed with
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+#: The content encodings of values that are decompressed when read
+ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+
+def compress(data, encoding, level=6):
+    """
+    Compresses a value with the given content encoding.
+
+    :param data: the encoded value
+    :type data: str
+    :param encoding: 'gzip' or 'deflate'
+    :type encoding: str
+    :param level: the zlib compression level, from 1 (fastest) to 9
+        (smallest)
+    :type level: int
+    :rtype: str
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_wbits(encoding, head):
+    """
+    Returns the zlib window bits to decompress data of the given
+    content encoding with, one of :data:`ENCODINGS`. For deflate,
+    whether the data is a zlib stream or raw deflate data is told by
+    the zlib header check of its first two bytes.
+
+    :param encoding: the content encoding
+    :type encoding: str
+    :param head: the first two bytes of the data
+    :type head: str
+    :rtype: int
+    """
+    if encoding in ('gzip', 'x-gzip'):
+        return 16 + zlib.MAX_WBITS
+    if len(head) >= 2:
+        cmf, flg = ord(head[0]), ord(head[1])
+        if cmf & 0x0f == 8 and (cmf << 8 | flg) % 31 == 0:
+            return zlib.MAX_WBITS
+    return -zlib.MAX_WBITS
+
+
+def decompress(data, encoding):
+    """
+    Decompresses a value stored with the given content encoding, one
+    of :data:`ENCODINGS`. As over HTTP, deflate values may be either
+    zlib streams or raw deflate data.
+
+    :param data: the compressed value
+    :type data: str
+    :param encoding: the content encoding
+    :type encoding: str
+    :rtype: str
+    """
+    return zlib.decompress(data, decompress_wbits(encoding, data[:2]))
+
+
+class CompressionPolicy(object):
+    """
+    Decides which values are compressed before they are stored, and
+    how. Values of at least ``threshold`` bytes, once encoded, are
+    compressed with gzip or deflate, and the ``content_encoding`` of
+    the object is set to match, so that Riak and other clients can
+    tell. Values that do not get smaller are stored as they are.
+    Set one as the :attr:`~riak.client.RiakClient.compression` of a
+    client or the :attr:`~riak.bucket.RiakBucket.compression` of a
+    bucket::
+
+        client.compression = CompressionPolicy(threshold=16384)
+    """
+
+    def __init__(self, threshold=COMPRESSION_THRESHOLD, algorithm='gzip',
+                 level=6):
+        """
+        :param threshold: the size, in bytes, from which encoded values
+            are compressed
+        :type threshold: int
+        :param algorithm: the content encoding to compress with, 'gzip'
+            or 'deflate'
+        :type algorithm: str
+        :param level: the zlib compression level, from 1 (fastest) to 9
+            (smallest)
+        :type level: int
+        """
+        if algorithm not in WBITS:
+            raise ValueError("algorithm must be 'gzip' or 'deflate'")
+        if not 1 <= level <= 9:
+            raise ValueError("level must be between 1 and 9")
+
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.level = level
+
+    def compress(self, data):
+        """
+        Compresses an encoded value if it is large enough, returning
+        the value to store and its content encoding, which is None if
+        it was left uncompressed.
+
+        :param data: the encoded value
+        :type data: str
+        :rtype: tuple
+        """
+        if not isinstance(data, str) or len(data) < self.threshold:
+            return data, None
+        compressed = compress(data, self.algorithm, self.level)
+        if len(compressed) >= len(data):
+            return data, None
+        return compressed, self.algorithm
+
+if __name__ == '__main__':
+    # Run a benchmark of the client CPU time of compressing and
+    # decompressing JSON documents of 50 KB and 500 KB with each
+    # algorithm and a few levels, printing the compressed sizes.
+    import json
+    import random
+    import riak.benchmark as benchmark
+
+    random.seed(42)
+    words = ['riak', 'bucket', 'vclock', 'sibling', 'quorum', 'vnode',
+             'handoff', 'ring', 'partition', 'entropy']
+
+    def document(size):
+        items = []
+        while sum(len(i) for i in items) < size:
+            items.append(json.dumps({
+                'id': len(items),
+                'name': ' '.join(random.sample(words, 3)),
+                'score': random.random(),
+                'tags': random.sample(words, 4)}))
+        return '[' + ', '.join(items) + ']'
+
+    documents = [('50K', document(50 * 1024), 200),
+                 ('500K', document(500 * 1024), 20)]
+    settings = [('gzip', 1), ('gzip', 6), ('deflate', 6)]
+    abbreviations = {'gzip': 'gz', 'deflate': 'df'}
+
+    print "Benchmarking value compression:"
+    for label, data, count in documents:
+        for algorithm, level in settings:
+            size = len(compress(data, algorithm, level))
+            print "   {0} {1}/{2}: {3} bytes ({4:.0%})".format(
+                label, algorithm, level, size, size / float(len(data)))
+    print
+
+    for b in benchmark.measure_with_rehearsal():
+        for label, data, count in documents:
+            for algorithm, level in settings:
+                policy = CompressionPolicy(algorithm=algorithm, level=level)
+                compressed, encoding = policy.compress(data)
+                name = '{0} {1}{2}'.format(label, abbreviations[algorithm],
+                                           level)
+                with b.report(name + ' cmp'):
+                    for _ in xrange(count):
+                        policy.compress(data)
+                with b.report(name + ' dec'):
+                    for _ in xrange(count):
+                        decompress(compressed, encoding)
@@ -16,6 +16,7 @@ specific language governing permissions and limitations
 under the License.
 """
 from riak import RiakError
+from riak.compression import decompress, ENCODINGS
 from riak.util import deprecated
 
 
@@ -58,6 +59,8 @@ class RiakContent(object):
         this property will result in decoding the `encoded_data`
         property into Python values. The decoding is dependent on the
         `content_type` property and the bucket's registered decoders.
+        Values compressed with gzip or deflate, as told by the
+        `content_encoding` property, are decompressed first.
         :type mixed """)
 
     def get_encoded_data(self):
@@ -85,21 +88,37 @@ class RiakContent(object):
         form of the `data` property. If unset, accessing this property
         will result in encoding the `data` property into a string. The
         encoding is dependent on the `content_type` property and the
-        bucket's registered encoders.
+        bucket's registered encoders. Encoded values are compressed
+        according to the bucket's compression policy, which sets the
+        `content_encoding` property.
         :type basestring""")
 
     def _serialize(self, value):
-        encoder = self._robject.bucket.get_encoder(self.content_type)
+        bucket = self._robject.bucket
+        encoder = bucket.get_encoder(self.content_type)
         if encoder:
-            return encoder(value)
+            value = encoder(value)
         elif isinstance(value, basestring):
-            return value.encode()
+            value = value.encode()
         else:
             raise TypeError('No encoder for non-string data '
                             'with content type "{0}"'.
                             format(self.content_type))
 
+        # Values with a content encoding set are left as they are
+        policy = bucket.compression
+        if policy is not None and self.content_encoding in (None, 'identity'):
+            value, encoding = policy.compress(value)
+            if encoding is not None:
+                self.content_encoding = encoding
+        return value
+
     def _deserialize(self, value):
+        if self.content_encoding in ENCODINGS:
+            # The decoded data is no longer compressed; it is compressed
+            # again, if the policy says so, when next encoded.
+            value = decompress(value, self.content_encoding)
+            self.content_encoding = None
         decoder = self._robject.bucket.get_decoder(self.content_type)
         if decoder:
             return decoder(value)
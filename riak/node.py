@@ -16,10 +16,24 @@ specific language governing permissions and limitations
 under the License.
 """
 import math
+import random
 import time
 from threading import RLock
 from riak.util import deprecated
 
+#: The circuit state of a node that is receiving requests.
+CIRCUIT_CLOSED = 'closed'
+#: The circuit state of a node that failed its health checks and is
+#: skipped when choosing nodes.
+CIRCUIT_OPEN = 'open'
+#: The circuit state of a node that is being checked again after
+#: having been open. It is still skipped when choosing nodes.
+CIRCUIT_HALF_OPEN = 'half-open'
+
+#: The default number of seconds for which the server version and
+#: resources detected on a node are reused by new connections.
+CAPABILITY_TTL = 300
+
 
 class Decaying(object):
     """
@@ -70,14 +84,65 @@ class Decaying(object):
             return self.p
 
 
+class Ewma(object):
+    """
+    An exponentially-weighted moving average of samples, such as
+    request latencies. Samples are weighted by the time since the
+    previous one, and the average decays toward 0 while no samples
+    arrive, so that a node which was slow is eventually tried again.
+    """
+
+    def __init__(self, tau=10.0):
+        """
+        Creates a new moving average.
+
+        :param tau: the time constant in seconds; a sample taken
+            ``tau`` seconds ago has 1/e of the weight of a new one
+        :type tau: float
+        """
+        self.tau = float(tau)
+        self.p = 0.0
+        self.lock = RLock()
+        self.t0 = None
+
+    def add(self, x):
+        """
+        Adds a sample to the average.
+
+        :param x: the sample
+        :type x: float
+        """
+        with self.lock:
+            now = time.time()
+            if self.t0 is None:
+                self.p = x
+            else:
+                w = math.exp((self.t0 - now) / self.tau)
+                self.p = self.p * w + x * (1 - w)
+            self.t0 = now
+
+    def value(self):
+        """
+        Returns the current average, decayed for the time since the
+        last sample.
+
+        :rtype: float
+        """
+        with self.lock:
+            if self.t0 is None:
+                return 0.0
+            return self.p * math.exp((self.t0 - time.time()) / self.tau)
+
+
 class RiakNode(object):
     """
     The internal representation of a Riak node to which the client can
     connect. Encapsulates both the configuration for the node and
-    error tracking used for node-selection.
+    the error, latency and load tracking used for node-selection.
     """
 
     def __init__(self, host='127.0.0.1', http_port=8098, pb_port=8087,
+                 server_version=None, capability_ttl=CAPABILITY_TTL,
                  **unused_args):
         """
         Creates a node.
@@ -88,6 +153,13 @@ class RiakNode(object):
         :type http_port: integer
         :param pb_port: the Protcol Buffers port of the node
         :type pb_port: integer
+        :param server_version: the version of Riak running on the
+            node, e.g. "1.4.8", to skip detecting it on new connections
+        :type server_version: string
+        :param capability_ttl: the number of seconds for which the
+            detected server version and HTTP resources are reused, or
+            None to keep them until :meth:`forget_capabilities`
+        :type capability_ttl: float
         """
 
         if 'port' in unused_args and not 'already_warned_port' in unused_args:
@@ -97,3 +169,180 @@ class RiakNode(object):
         self.http_port = http_port
         self.pb_port = pb_port
         self.error_rate = Decaying()
+        self.latency = Ewma()
+        self.in_flight = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.server_version = server_version
+        self.capability_ttl = capability_ttl
+        self._capabilities = {}
+        self._check_failures = 0
+        self._opened_at = None
+        self._lock = RLock()
+
+    @property
+    def available(self):
+        """
+        Whether requests may be sent to this node, i.e. whether its
+        circuit is closed. Without a
+        :class:`~riak.client.health.HealthChecker` nodes are always
+        available.
+
+        :rtype: bool
+        """
+        return self.circuit == CIRCUIT_CLOSED
+
+    def _check_due(self, open_timeout):
+        """
+        Whether the node should be health-checked now. Open nodes are
+        only checked again after ``open_timeout`` seconds, moving them
+        to the half-open state.
+
+        :param open_timeout: the number of seconds to leave a node open
+        :type open_timeout: float
+        :rtype: bool
+        """
+        with self._lock:
+            if self.circuit == CIRCUIT_OPEN:
+                if time.time() - self._opened_at < open_timeout:
+                    return False
+                self.circuit = CIRCUIT_HALF_OPEN
+            return True
+
+    def _check_passed(self):
+        """
+        Records a successful health check, closing the circuit.
+        """
+        with self._lock:
+            self.circuit = CIRCUIT_CLOSED
+            self._check_failures = 0
+            self._opened_at = None
+
+    def _check_failed(self, threshold):
+        """
+        Records a failed health check. The circuit opens after
+        ``threshold`` consecutive failures, or after a single failure
+        when half-open.
+
+        :param threshold: the number of failures that open the circuit
+        :type threshold: int
+        """
+        with self._lock:
+            self._check_failures += 1
+            if (self.circuit == CIRCUIT_HALF_OPEN or
+                    self._check_failures >= threshold):
+                self.circuit = CIRCUIT_OPEN
+                self._opened_at = time.time()
+
+    def capability(self, name, detect=None):
+        """
+        Returns what is known about the node under the given name, such
+        as its server version, shared by all connections to it. The
+        ``detect`` function is called to find it out when it is not
+        cached or is older than :attr:`capability_ttl`; without one,
+        None is returned instead.
+
+        :param name: the name of the capability
+        :type name: string
+        :param detect: a function returning the capability
+        :type detect: function
+        """
+        cached = self._capabilities.get(name)
+        if cached is not None:
+            value, detected_at = cached
+            if self.capability_ttl is None or \
+                    time.time() - detected_at < self.capability_ttl:
+                return value
+        if detect is None:
+            return None
+        # Detected without the lock, as it takes a request; concurrent
+        # connections may both detect it, with the same result.
+        value = detect()
+        self.remember_capability(name, value)
+        return value
+
+    def remember_capability(self, name, value):
+        """
+        Caches a capability of the node detected by a connection.
+
+        :param name: the name of the capability
+        :type name: string
+        :param value: the capability
+        """
+        with self._lock:
+            self._capabilities[name] = (value, time.time())
+
+    def forget_capabilities(self):
+        """
+        Discards the cached capabilities of the node, so that new
+        connections detect them again, e.g. after it was upgraded.
+        """
+        with self._lock:
+            self._capabilities.clear()
+
+    def _start_request(self):
+        """
+        Records that a request to this node has started.
+        """
+        with self._lock:
+            self.in_flight += 1
+
+    def _finish_request(self, elapsed=None):
+        """
+        Records that a request to this node has finished.
+
+        :param elapsed: the duration of the request in seconds, or
+            None if it failed without a response
+        :type elapsed: float
+        """
+        with self._lock:
+            self.in_flight -= 1
+        if elapsed is not None:
+            self.latency.add(elapsed)
+
+
+def random_policy(nodes):
+    """
+    A node-selection policy that chooses one of the nodes at random.
+
+    :param nodes: the candidate nodes
+    :type nodes: list of :class:`RiakNode`
+    :rtype: :class:`RiakNode`
+    """
+    return random.choice(nodes)
+
+
+def least_outstanding_policy(nodes):
+    """
+    A node-selection policy that chooses the node with the fewest
+    requests in flight, breaking ties at random.
+
+    :param nodes: the candidate nodes
+    :type nodes: list of :class:`RiakNode`
+    :rtype: :class:`RiakNode`
+    """
+    least = min(n.in_flight for n in nodes)
+    return random.choice([n for n in nodes if n.in_flight == least])
+
+
+def power_of_two_policy(nodes):
+    """
+    A node-selection policy that picks two nodes at random and
+    chooses the one with the lower expected cost, that is its average
+    latency multiplied by the number of requests in flight (plus
+    one). This is the default policy of
+    :class:`~riak.client.RiakClient`.
+
+    :param nodes: the candidate nodes
+    :type nodes: list of :class:`RiakNode`
+    :rtype: :class:`RiakNode`
+    """
+    if len(nodes) < 2:
+        return nodes[0]
+
+    def _cost(node):
+        return node.latency.value() * (node.in_flight + 1)
+
+    a, b = random.sample(nodes, 2)
+    if _cost(b) < _cost(a):
+        return b
+    return a
@@ -171,7 +171,10 @@ class RiakObject(object):
 
     content_encoding = content_property('content_encoding', doc="""
         The encoding (compression) of the encoded data. Valid values
-        are identity, deflate, gzip
+        are identity, deflate, gzip. It is set when the data is
+        compressed on encoding, see
+        :attr:`RiakBucket.compression <riak.bucket.RiakBucket.compression>`,
+        and cleared when compressed data is decoded.
         """)
 
     last_modified = content_property('last_modified', """
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
+# Run from the top of the tree, e.g.
+# PYTHONPATH=. python riak/tests/pool-grinder.py bench
+
 from Queue import Queue
 from threading import Thread
+from contextlib import contextmanager
+from itertools import count
 import sys
-sys.path.append("../transports/")
-from pool import Pool
+from riak.transports.pool import Pool, Element, BadResource
+from riak.benchmark import measure_with_rehearsal
 from random import SystemRandom
 from time import sleep
 
@@ -66,12 +71,148 @@ def test():
     else:
         return True
 
-ret = True
-count = 0
-while ret:
-    ret = test()
-    count += 1
-    print count
+
+class NodeResource(list):
+    """
+    A list standing in for a transport, tagged with its node.
+    """
+    node = None
+
+
+class NodeListPool(Pool):
+    """
+    A pool of resources spread evenly over ``nodes`` nodes.
+    """
+    nodes = 5
+
+    def __init__(self):
+        self.created = count()
+        Pool.__init__(self)
+
+    def create_resource(self):
+        resource = NodeResource()
+        resource.node = next(self.created) % self.nodes
+        return resource
+
+
+class LinearScanPool(NodeListPool):
+    """
+    The checkout strategy used before the free-list: every take()
+    scans all elements (claimed or not) while holding the lock.
+    """
+    @contextmanager
+    def take(self, _filter=None, default=None):
+        if not _filter:
+            def _filter(obj):
+                return True
+
+        element = None
+        with self.lock:
+            for e in self.elements:
+                if not e.claimed and _filter(e.object):
+                    element = e
+                    break
+            if element is None:
+                element = Element(self.create_resource())
+                self.elements.append(element)
+            element.claimed = True
+        try:
+            yield element.object
+        except BadResource:
+            self.delete_element(element)
+            raise
+        finally:
+            with self.releaser:
+                element.claimed = False
+                self.releaser.notify_all()
+
+
+def fill(pool, size, busy=0):
+    """
+    Creates `size` resources in the pool, and returns the claims of
+    the `busy` ones left claimed, standing in for requests in flight.
+    """
+    claims = [pool.take() for i in range(size)]
+    for claim in claims:
+        claim.__enter__()
+    for claim in claims[busy:]:
+        claim.__exit__(None, None, None)
+    return claims[:busy]
+
+
+def contend(pool, threads, rounds, _filter=None, hold=0):
+    """
+    Runs `threads` workers that each check a resource out and back in
+    `rounds` times, with all workers starting at once. Each resource
+    is held for `hold` seconds, if any, standing in for a network
+    round-trip.
+    """
+    started = Queue()
+    workers = []
+
+    def _run():
+        started.put(1)
+        started.join()
+        for i in xrange(rounds):
+            with pool.take(_filter=_filter) as a:
+                a.append(i)
+                if hold:
+                    sleep(hold)
+                del a[:]
+
+    for i in range(threads):
+        th = Thread(target=_run)
+        workers.append(th)
+        th.start()
+
+    for i in range(threads):
+        started.get()
+        started.task_done()
+
+    for th in workers:
+        th.join()
+
+
+def bench(threads=16, rounds=5000, size=500):
+    """
+    Compares the cost of checking resources out of the free-list pool
+    and out of the old linear scan, with `threads` threads contending
+    for a pool of `size` resources and nothing held in between, so
+    that the checkout itself is measured. The pool is either all idle
+    or has 90% of its resources claimed for the whole run, as under
+    load ('90%'). The filter ('flt') mimics the client's retry logic
+    skipping the transports of two failed nodes out of five.
+    """
+    def _skip_failed(resource):
+        return resource.node not in (0, 1)
+
+    print "Pool checkout: {0} threads x {1} checkouts, {2} resources".format(
+        threads, rounds, size)
+    for b in measure_with_rehearsal():
+        for name, klass in (('scan', LinearScanPool),
+                            ('lifo', NodeListPool)):
+            for busy in (0, size * 9 // 10):
+                for suffix, _filter in (('', None), (' flt', _skip_failed)):
+                    pool = klass()
+                    claims = fill(pool, size, busy)
+                    label = '%s%s%s' % (name, ' 90%' if busy else '',
+                                        suffix)
+                    with b.report(label):
+                        contend(pool, threads, rounds, _filter)
+                    for claim in claims:
+                        claim.__exit__(None, None, None)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        bench(*[int(arg) for arg in sys.argv[2:5]])
+    else:
+        ret = True
+        count = 0
+        while ret:
+            ret = test()
+            count += 1
+            print count
 
 
 # INSTRUMENTED FUNCTION
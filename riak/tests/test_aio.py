@@ -0,0 +1,100 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import platform
+import socket
+from riak import RiakError
+from riak.tests.test_fanout import FakeNode
+
+try:
+    import trollius
+    from trollius import From, Return
+    from riak.client.aio import AsyncRiakClient
+except ImportError:
+    trollius = None
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+@unittest.skipIf(trollius is None, "trollius is not installed")
+class AsyncClientTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = trollius.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.node = FakeNode()
+        self.addCleanup(self.node.close)
+
+    def client(self, *ports, **transport_options):
+        client = AsyncRiakClient(loop=self.loop,
+                                 transport_options=transport_options,
+                                 nodes=[{'pb_port': p} for p in ports])
+        self.addCleanup(client.close)
+        return client
+
+    def run_gets(self, client, keys):
+        bucket = client.bucket('aio')
+
+        @trollius.coroutine
+        def gets():
+            results = yield From(trollius.gather(
+                *[client.get(bucket.new(key)) for key in keys],
+                loop=self.loop, return_exceptions=True))
+            raise Return(results)
+
+        return self.loop.run_until_complete(gets())
+
+    def test_get(self):
+        client = self.client(self.node.port, max_size=4)
+        keys = [str(i) for i in range(50)]
+        results = self.run_gets(client, keys + ['bad'])
+        self.assertEqual(keys, [r.encoded_data for r in results[:-1]])
+        self.assertIsInstance(results[-1], RiakError)
+        # The connections are reused, at most max_size at a time
+        idle = client._pool._idle.values()[0]
+        self.assertTrue(0 < len(idle) <= 4)
+
+    def test_retries_on_another_node(self):
+        dead = socket.socket()
+        dead.bind(('127.0.0.1', 0))
+        dead_port = dead.getsockname()[1]
+        dead.close()
+        broken = FakeNode(healthy=False)
+        self.addCleanup(broken.close)
+
+        client = self.client(dead_port, broken.port, self.node.port)
+        client.client.retries = 3
+        client.client.retry_backoff = 0
+        results = self.run_gets(client, [str(i) for i in range(20)])
+        self.assertEqual([str(i) for i in range(20)],
+                         [r.encoded_data for r in results])
+        self.assertEqual(20, self.node.fetches)
+
+    def test_timeout(self):
+        client = self.client(self.node.port, timeout=0.2)
+        results = self.run_gets(client, ['hang'])
+        self.assertIsInstance(results[0], trollius.TimeoutError)
+        # The connection is out of step, so it is not reused
+        self.assertEqual(0, len(client._pool._idle.values()[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import json
+import os
+import platform
+import zlib
+import riak_pb
+from riak.client import RiakClient
+from riak.compression import CompressionPolicy, compress, decompress
+from riak.content import RiakContent
+from riak.transports.pbc.codec import RiakPbcCodec, RiakPbcContent
+from riak.transports.http.codec import RiakHttpCodec
+from riak.transports.http.resources import RiakHttpResources
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+DOCUMENT = {'items': [{'id': i, 'name': 'item %d' % i} for i in range(200)]}
+
+
+class HttpCodec(RiakHttpResources, RiakHttpCodec):
+    resources = {'riak_kv_wm_buckets': '/buckets'}
+    _client_id = 'client'
+
+
+class CompressionPolicyTest(unittest.TestCase):
+    def test_threshold(self):
+        policy = CompressionPolicy(threshold=100)
+        self.assertEqual(('a' * 99, None), policy.compress('a' * 99))
+        data, encoding = policy.compress('a' * 100)
+        self.assertEqual('gzip', encoding)
+        self.assertEqual('a' * 100, decompress(data, 'gzip'))
+
+    def test_incompressible(self):
+        data = os.urandom(1000)
+        policy = CompressionPolicy(threshold=100)
+        self.assertEqual((data, None), policy.compress(data))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, CompressionPolicy, algorithm='lzma')
+        self.assertRaises(ValueError, CompressionPolicy, level=0)
+
+    def test_deflate(self):
+        data = 'abc' * 100
+        self.assertEqual(data, decompress(compress(data, 'deflate'),
+                                          'deflate'))
+        # Raw deflate data, as some clients store
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = compressor.compress(data) + compressor.flush()
+        self.assertEqual(data, decompress(raw, 'deflate'))
+        self.assertEqual(data, decompress(compress(data, 'gzip'), 'x-gzip'))
+
+
+class ContentCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.client = RiakClient()
+        self.client.compression = CompressionPolicy(threshold=1024)
+        self.bucket = self.client.bucket('compressed')
+
+    def test_encode(self):
+        robj = self.bucket.new('k', data=DOCUMENT)
+        self.assertEqual(DOCUMENT,
+                         json.loads(decompress(robj.encoded_data, 'gzip')))
+        self.assertEqual('gzip', robj.content_encoding)
+
+    def test_small_values(self):
+        robj = self.bucket.new('k', data={'a': 1})
+        self.assertEqual('{"a": 1}', robj.encoded_data)
+        self.assertEqual(None, robj.content_encoding)
+
+    def test_decode(self):
+        robj = self.bucket.new('k')
+        robj.content_encoding = 'gzip'
+        robj.encoded_data = compress(json.dumps(DOCUMENT), 'gzip')
+        self.assertEqual(DOCUMENT, robj.data)
+        self.assertEqual(None, robj.content_encoding)
+
+    def test_decode_without_policy(self):
+        self.client.compression = None
+        robj = self.bucket.new('k')
+        robj.content_encoding = 'deflate'
+        robj.encoded_data = compress(json.dumps(DOCUMENT), 'deflate')
+        self.assertEqual(DOCUMENT, robj.data)
+        # Stored back uncompressed
+        self.assertEqual(DOCUMENT, json.loads(robj.encoded_data))
+        self.assertEqual(None, robj.content_encoding)
+
+    def test_bucket_policy(self):
+        self.bucket.compression = CompressionPolicy(threshold=1024,
+                                                    algorithm='deflate')
+        robj = self.bucket.new('k', data=DOCUMENT)
+        self.assertEqual(DOCUMENT,
+                         json.loads(decompress(robj.encoded_data, 'deflate')))
+        self.assertEqual('deflate', robj.content_encoding)
+
+        self.bucket.compression = False
+        robj = self.bucket.new('k', data=DOCUMENT)
+        self.assertEqual(DOCUMENT, json.loads(robj.encoded_data))
+        self.assertEqual(None, robj.content_encoding)
+
+    def test_content_encoding_set(self):
+        robj = self.bucket.new('k', data=DOCUMENT)
+        robj.content_encoding = 'identity'
+        robj.encoded_data
+        self.assertEqual('gzip', robj.content_encoding)
+
+        robj = self.bucket.new('k', data='x' * 2000,
+                               content_type='text/plain')
+        robj.content_encoding = 'br'
+        self.assertEqual('x' * 2000, robj.encoded_data)
+        self.assertEqual('br', robj.content_encoding)
+
+    def test_pbc(self):
+        codec = RiakPbcCodec()
+        robj = self.bucket.new('k', data=DOCUMENT)
+        rpb = riak_pb.RpbContent()
+        codec._encode_content(robj, rpb)
+        self.assertEqual('gzip', rpb.content_encoding)
+        self.assertEqual(robj.encoded_data, rpb.value)
+
+        fetched = self.bucket.new('k')
+        fetched.siblings = [RiakPbcContent(fetched, rpb)]
+        self.assertEqual('gzip', fetched.content_encoding)
+        self.assertEqual(DOCUMENT, fetched.data)
+
+    def test_http(self):
+        codec = HttpCodec()
+        robj = self.bucket.new('k', data=DOCUMENT)
+        data = str(robj.encoded_data)
+        headers = codec._build_put_headers(robj)
+        self.assertEqual('gzip', headers['Content-Encoding'])
+
+        fetched = self.bucket.new('k')
+        sibling = codec._parse_sibling(RiakContent(fetched),
+                                       headers.items(), data)
+        fetched.siblings = [sibling]
+        self.assertEqual('gzip', fetched.content_encoding)
+        self.assertEqual(DOCUMENT, fetched.data)
+
+        robj = self.bucket.new('k', data={'a': 1})
+        self.assertFalse('Content-Encoding' in
+                         codec._build_put_headers(robj))
+
+
+if __name__ == '__main__':
+    unittest.main()
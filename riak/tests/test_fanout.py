@@ -0,0 +1,217 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import platform
+import riak_pb
+import socket
+import struct
+from threading import Thread
+from riak import RiakError
+from riak.client import RiakClient
+from riak.client.fanout import fanout, Poller
+from riak.transports.pbc.connection import RiakPbcConnection
+from riak_pb.messages import MSG_CODE_GET_REQ, MSG_CODE_GET_RESP, \
+    MSG_CODE_GET_SERVER_INFO_REQ, MSG_CODE_GET_SERVER_INFO_RESP, \
+    MSG_CODE_ERROR_RESP
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class FakeNode(object):
+    """
+    Answers fetches with the key as the value, failing fetches of the
+    key 'bad' and never answering fetches of the key 'hang'. Unless
+    ``healthy``, connections are closed on the first fetch. Its
+    threads are stopped by :meth:`close`.
+    """
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.fetches = 0
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.conns = []
+        self.handlers = []
+        self.accepter = Thread(target=self._accept)
+        self.accepter.daemon = True
+        self.accepter.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            handler = Thread(target=self._handle, args=(conn,))
+            handler.daemon = True
+            self.conns.append(conn)
+            self.handlers.append(handler)
+            handler.start()
+
+    def _handle(self, conn):
+        encode = RiakPbcConnection()._encode_msg
+        try:
+            while True:
+                header = self._recv(conn, 4)
+                msglen, = struct.unpack('!i', header)
+                data = self._recv(conn, msglen)
+                code = ord(data[0])
+                if code == MSG_CODE_GET_SERVER_INFO_REQ:
+                    resp = riak_pb.RpbGetServerInfoResp(
+                        node='fake', server_version='1.4.0')
+                    conn.sendall(encode(MSG_CODE_GET_SERVER_INFO_RESP,
+                                        resp))
+                elif code == MSG_CODE_GET_REQ:
+                    if not self.healthy:
+                        break
+                    req = riak_pb.RpbGetReq()
+                    req.ParseFromString(data[1:])
+                    self.fetches += 1
+                    if req.key == 'bad':
+                        err = riak_pb.RpbErrorResp(errmsg='bad', errcode=1)
+                        conn.sendall(encode(MSG_CODE_ERROR_RESP, err))
+                    elif req.key == 'hang':
+                        # Riak answers in order, so nothing more is
+                        # answered on this connection
+                        self._recv(conn, 1 << 20)
+                    else:
+                        resp = riak_pb.RpbGetResp(vclock='vclock')
+                        resp.content.add(value=req.key)
+                        conn.sendall(encode(MSG_CODE_GET_RESP, resp))
+        except (socket.error, EOFError):
+            pass
+        finally:
+            conn.close()
+
+    def _recv(self, conn, size):
+        data = ''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def close(self):
+        # Closing a socket does not wake a thread blocked on it, but
+        # shutting it down does.
+        self._shutdown(self.listener)
+        self.accepter.join()
+        self.listener.close()
+        for conn in self.conns:
+            self._shutdown(conn)
+        for handler in self.handlers:
+            handler.join()
+
+    def _shutdown(self, sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            # Already closed
+            pass
+
+
+class FanoutTest(unittest.TestCase):
+    def client(self, *nodes, **transport_options):
+        client = RiakClient(protocol='pbc',
+                            transport_options=transport_options,
+                            nodes=[{'pb_port': n.port} for n in nodes])
+        self.addCleanup(client._pb_pool.clear)
+        return client
+
+    def fetches(self, client, keys):
+        bucket = client.bucket('fanout')
+        return [('get', (bucket.new(key),), {}) for key in keys]
+
+    def setUp(self):
+        self.node = FakeNode()
+        self.addCleanup(self.node.close)
+
+    def test_results_in_order(self):
+        client = self.client(self.node)
+        keys = [str(i) for i in range(500)] + ['bad']
+        results = fanout(client, self.fetches(client, keys), 4)
+        self.assertEqual(keys[:-1], [r.encoded_data for r in results[:-1]])
+        self.assertIsInstance(results[-1], RiakError)
+        self.assertEqual(501, self.node.fetches)
+        # The connections go back to the pool in blocking mode
+        stats = client._pb_pool.stats().values()[0]
+        self.assertEqual(4, stats['idle'])
+        for element in client._pb_pool.elements:
+            self.assertIsNone(element.object._socket.gettimeout())
+
+    def test_failed_connection_retried_elsewhere(self):
+        broken = FakeNode(healthy=False)
+        self.addCleanup(broken.close)
+        client = self.client(self.node, broken)
+        keys = [str(i) for i in range(300)]
+        results = fanout(client, self.fetches(client, keys), 2)
+        self.assertEqual(keys, [r.encoded_data for r in results])
+
+    def test_timeout(self):
+        client = self.client(self.node, timeout=0.2)
+        results = fanout(client, self.fetches(client, ['1', 'hang', '2']),
+                         1)
+        self.assertEqual('1', results[0].encoded_data)
+        self.assertIsInstance(results[1], socket.timeout)
+        self.assertIsInstance(results[2], socket.timeout)
+        # The connection was out of step and is not reused
+        self.assertEqual(0, client._pb_pool.stats().values()[0]['size'])
+
+    def test_multiget(self):
+        client = self.client(self.node)
+        results = client.multiget([('fanout', '1'), ('fanout', 'bad'),
+                                   ('fanout', '2')], connections=2)
+        self.assertEqual('1', results[0].encoded_data)
+        self.assertEqual(('fanout', 'bad'), results[1][:2])
+        self.assertIsInstance(results[1][2], RiakError)
+        self.assertEqual('2', results[2].encoded_data)
+
+    def test_pipeline(self):
+        client = self.client(self.node)
+        bucket = client.bucket('fanout')
+        with client.pipeline(connections=3) as pipeline:
+            for i in range(50):
+                pipeline.get(bucket.new(str(i)))
+        self.assertEqual([str(i) for i in range(50)],
+                         [r.encoded_data for r in pipeline.results])
+
+
+class PollerTest(unittest.TestCase):
+    def test_readable_and_writable(self):
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        poller = Poller()
+        poller.register(left.fileno())
+        self.assertEqual([], poller.poll(0))
+        poller.modify(left.fileno(), True)
+        self.assertEqual([(left.fileno(), False, True)], poller.poll(0))
+        right.sendall('x')
+        poller.modify(left.fileno(), False)
+        self.assertEqual([(left.fileno(), True, False)], poller.poll(0))
+        poller.unregister(left.fileno())
+        poller.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,14 +17,14 @@ under the License.
 """
 
 import platform
+from riak.node import RiakNode
+from riak.transports.feature_detect import FeatureDetection
 
 if platform.python_version() < '2.7':
     unittest = __import__('unittest2')
 else:
     import unittest
 
-from riak.transports.feature_detect import FeatureDetection
-
 
 class IncompleteTransport(FeatureDetection):
     pass
@@ -38,6 +38,19 @@ class DummyTransport(FeatureDetection):
         return self._version
 
 
+class NodeTransport(FeatureDetection):
+    _protocol = 'pbc'
+
+    def __init__(self, node, version):
+        self._node = node
+        self._version = version
+        self.detections = 0
+
+    def _server_version(self):
+        self.detections += 1
+        return self._version
+
+
 class FeatureDetectionTest(unittest.TestCase):
     def test_implements_server_version(self):
         t = IncompleteTransport()
@@ -150,5 +163,44 @@ class FeatureDetectionTest(unittest.TestCase):
         self.assertTrue(t.stream_indexes())
         self.assertTrue(t.index_term_regex())
 
+
+class NodeCapabilityTest(unittest.TestCase):
+    def test_version_shared_by_connections(self):
+        node = RiakNode()
+        first = NodeTransport(node, "1.4.6")
+        self.assertTrue(first.index_term_regex())
+        second = NodeTransport(node, "1.2.0")
+        self.assertTrue(second.index_term_regex())
+        self.assertEqual(1, first.detections)
+        self.assertEqual(0, second.detections)
+
+    def test_version_expires(self):
+        node = RiakNode(capability_ttl=0)
+        NodeTransport(node, "1.2.0").server_version
+        upgraded = NodeTransport(node, "1.4.6")
+        self.assertTrue(upgraded.index_term_regex())
+        self.assertEqual(1, upgraded.detections)
+
+    def test_forget_capabilities(self):
+        node = RiakNode(capability_ttl=None)
+        NodeTransport(node, "1.2.0").server_version
+        node.forget_capabilities()
+        self.assertTrue(NodeTransport(node, "1.4.6").counters())
+
+    def test_pinned_version(self):
+        node = RiakNode(server_version="1.4.0")
+        t = NodeTransport(node, "1.4.6")
+        self.assertTrue(t.counters())
+        self.assertFalse(t.index_term_regex())
+        self.assertEqual(0, t.detections)
+
+    def test_capability_without_detection(self):
+        node = RiakNode()
+        self.assertIsNone(node.capability('resources'))
+        node.remember_capability('resources', {'riak_kv_wm_buckets': '/'})
+        self.assertEqual({'riak_kv_wm_buckets': '/'},
+                         node.capability('resources'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,162 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import platform
+import socket
+from threading import Thread
+from time import sleep, time
+from riak.client import RiakClient
+from riak.client.health import HealthChecker
+from riak.node import CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN
+from riak.transports.pool import NodePool
+from riak.tests.test_pool import FakeClient
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class FakeTransport(object):
+    def __init__(self, node):
+        self.node = node
+        self.closed = False
+
+    def ping(self):
+        if self.node.host == 'down':
+            raise IOError("connection refused")
+        return True
+
+
+class FakeTransportPool(NodePool):
+    def create_node_resource(self, node, **options):
+        return FakeTransport(node)
+
+    def destroy_resource(self, transport):
+        transport.closed = True
+
+
+class HealthClient(FakeClient):
+    def __init__(self, count):
+        FakeClient.__init__(self, count)
+        self.pool = FakeTransportPool(self)
+
+    def _choose_pool(self, protocol=None):
+        return self.pool
+
+
+class HealthCheckTest(unittest.TestCase):
+    def test_circuit_opens_after_failures(self):
+        """
+        A node should stay available until the failure threshold is
+        reached, and close again after a successful check.
+        """
+        client = HealthClient(2)
+        client.nodes[1].host = 'down'
+        checker = HealthChecker(client, interval=1, failure_threshold=2,
+                                open_timeout=0.05)
+        checker.check()
+        self.assertEqual(CIRCUIT_CLOSED, client.nodes[1].circuit)
+        checker.check()
+        self.assertEqual(CIRCUIT_OPEN, client.nodes[1].circuit)
+        self.assertFalse(client.nodes[1].available)
+        self.assertTrue(client.nodes[0].available)
+
+        client.nodes[1].host = 'node1'
+        checker.check()
+        self.assertEqual(CIRCUIT_OPEN, client.nodes[1].circuit)
+        sleep(0.05)
+        checker.check()
+        self.assertEqual(CIRCUIT_CLOSED, client.nodes[1].circuit)
+
+    def test_half_open_failure_reopens(self):
+        """
+        A half-open node should open again after a single failure.
+        """
+        node = HealthClient(1).nodes[0]
+        node._check_failed(1)
+        self.assertTrue(node._check_due(0))
+        self.assertEqual(CIRCUIT_HALF_OPEN, node.circuit)
+        self.assertFalse(node.available)
+        node._check_failed(5)
+        self.assertEqual(CIRCUIT_OPEN, node.circuit)
+
+    def test_open_nodes_are_skipped(self):
+        """
+        Node selection and the pools should avoid open nodes, unless
+        every node is open.
+        """
+        client = HealthClient(2)
+        client.nodes[0]._check_failed(1)
+        for i in range(10):
+            self.assertIs(client.nodes[1], client._choose_node())
+            with client.pool.take() as transport:
+                self.assertIs(client.nodes[1], transport.node)
+        client.nodes[1]._check_failed(1)
+        self.assertIn(client._choose_node(), client.nodes)
+
+    def test_stop_closes_transports(self):
+        """
+        Stopping the checker should close its connections.
+        """
+        client = HealthClient(2)
+        checker = HealthChecker(client, interval=0.01)
+        checker.start()
+        sleep(0.05)
+        transports = checker._transports.values()
+        self.assertEqual(2, len(transports))
+        checker.stop()
+        self.assertEqual({}, checker._transports)
+        for transport in transports:
+            self.assertTrue(transport.closed)
+
+    def test_node_that_never_answers(self):
+        """
+        A node that accepts connections but never answers should fail
+        its check after the timeout of the checker, and should not
+        keep the checker from being stopped meanwhile.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = RiakClient(protocol='pbc', nodes=[
+            {'host': '127.0.0.1', 'pb_port': listener.getsockname()[1]}])
+        try:
+            checker = HealthChecker(client, interval=60, failure_threshold=1,
+                                    timeout=0.1)
+            start = time()
+            checker.check()
+            self.assertLess(time() - start, 1)
+            self.assertEqual(CIRCUIT_OPEN, client.nodes[0].circuit)
+
+            checker = HealthChecker(client, interval=60, failure_threshold=1,
+                                    open_timeout=0.01, timeout=0.5)
+            sleep(0.01)
+            thread = Thread(target=checker.check)
+            thread.start()
+            sleep(0.1)
+            start = time()
+            checker.stop()
+            self.assertLess(time() - start, 0.1)
+            thread.join()
+            self.assertEqual({}, checker._transports)
+        finally:
+            listener.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import httplib
+import platform
+import threading
+from Queue import Queue
+from time import sleep
+from riak.client import RiakClient
+from riak.client.hedge import Hedger, AttemptPool
+from riak.content import RiakContent
+from riak.transports.pool import NodePool
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class SlowTransport(object):
+    """
+    Answers fetches with the host of its node, after the delay given
+    for that node, or fails them if the node is 'down'. Connecting
+    takes the connect delay of the node.
+    """
+    delays = {}
+    connect_delays = {}
+    fetches = 0
+
+    def __init__(self, node):
+        self._node = node
+        sleep(self.connect_delays.get(node.host, 0))
+
+    def get(self, robj, r=None, pr=None, timeout=None):
+        SlowTransport.fetches += 1
+        if self._node.host == 'down':
+            raise httplib.NotConnected()
+        sleep(self.delays.get(self._node.host, 0))
+        robj.siblings = [RiakContent(robj, encoded_data=self._node.host,
+                                     content_type='text/plain')]
+        return robj
+
+
+class SlowPool(NodePool):
+    def create_node_resource(self, node):
+        return SlowTransport(node)
+
+
+class HedgeTest(unittest.TestCase):
+    def setUp(self):
+        self.client = RiakClient(nodes=[{'host': 'fast'}, {'host': 'slow'}],
+                                 hedge_percentile=50)
+        self.client.hedger = Hedger(50, min_samples=4)
+        self.client._http_pool = SlowPool(self.client)
+        self.bucket = self.client.bucket('hedge')
+
+    def tearDown(self):
+        SlowTransport.delays = {}
+        SlowTransport.connect_delays = {}
+        SlowTransport.fetches = 0
+
+    def test_percentile_delay(self):
+        """
+        The hedge delay should follow the recorded latencies once
+        enough are known.
+        """
+        hedger = Hedger(90, min_delay=0.0, min_samples=10)
+        self.assertIsNone(hedger.delay())
+        for i in range(10):
+            hedger.record(i / 100.0)
+        self.assertEqual(0.09, hedger.delay())
+
+    def test_no_hedge_when_fast(self):
+        """
+        Fetches that answer within the delay should not be hedged.
+        """
+        for i in range(10):
+            obj = self.bucket.get('key')
+            self.assertIn(obj.encoded_data, ['fast', 'slow'])
+            self.assertIs(obj, obj.siblings[0]._robject)
+        self.assertEqual(10, self.client.hedger.requests)
+        self.assertEqual(0, self.client.hedger.hedges)
+
+    def test_hedge_wins_over_slow_node(self):
+        """
+        A fetch stuck on a slow node should be answered by a hedge
+        sent to the other node.
+        """
+        for i in range(4):
+            self.client.hedger.record(0.001)
+        SlowTransport.delays = {'slow': 0.5}
+        self.client.node_policy = lambda nodes: nodes[-1]
+        obj = self.bucket.get('key')
+        self.assertEqual('fast', obj.encoded_data)
+        self.assertIs(obj, obj.siblings[0]._robject)
+        self.assertEqual(1, self.client.hedger.hedges)
+        self.assertEqual(1, self.client.hedger.hedge_wins)
+        self.assertEqual(1.0, self.client.hedger.hedge_rate)
+
+    def test_hedge_avoids_connecting_node(self):
+        """
+        A hedge sent while the first attempt is still connecting
+        should go to another node.
+        """
+        for i in range(4):
+            self.client.hedger.record(0.001)
+        SlowTransport.connect_delays = {'slow': 0.2}
+        SlowTransport.delays = {'slow': 0.5}
+        self.client.node_policy = lambda nodes: nodes[-1]
+        obj = self.bucket.get('key')
+        self.assertEqual('fast', obj.encoded_data)
+        self.assertEqual(1, self.client.hedger.hedge_wins)
+
+    def test_retry_count_applies(self):
+        """
+        The retry count of the calling thread should apply to the
+        attempts of a hedged fetch.
+        """
+        for i in range(4):
+            self.client.hedger.record(1.0)
+        for node in self.client.nodes:
+            node.host = 'down'
+        with self.client.retry_count(1):
+            self.assertRaises(httplib.NotConnected, self.bucket.get, 'key')
+        self.assertEqual(1, SlowTransport.fetches)
+
+
+class AttemptPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = AttemptPool(idle_threads=1)
+        self.threads = Queue()
+
+    def _attempt(self, hold=0):
+        self.threads.put(threading.current_thread())
+        sleep(hold)
+
+    def test_reuses_idle_threads(self):
+        """
+        Attempts run one after another should share a thread.
+        """
+        self.pool.run(self._attempt)
+        first = self.threads.get(timeout=1)
+        sleep(0.01)
+        self.pool.run(self._attempt)
+        self.assertIs(first, self.threads.get(timeout=1))
+
+    def test_starts_threads_when_busy(self):
+        """
+        An attempt should not wait for a busy thread, and threads
+        beyond the idle limit should exit once done.
+        """
+        self.pool.run(self._attempt, 0.1)
+        self.pool.run(self._attempt, 0.1)
+        first = self.threads.get(timeout=1)
+        second = self.threads.get(timeout=1)
+        self.assertIsNot(first, second)
+        first.join(0.5)
+        second.join(0.5)
+        self.assertEqual(1, [first.is_alive(), second.is_alive()].count(True))
+        self.assertEqual(1, self.pool._idle)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import platform
+from riak import RiakError
+from riak.client import RiakClient
+from riak.content import RiakContent
+from riak.riak_object import VClock
+from riak.transports.http.codec import RiakHttpCodec, MAX_LINK_HEADER_SIZE
+from riak.transports.http.resources import RiakHttpResources
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class Codec(RiakHttpResources, RiakHttpCodec):
+    resources = {'riak_kv_wm_buckets': '/buckets'}
+    _client_id = 'client'
+
+
+class HeaderCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = Codec()
+        self.robj = RiakClient().bucket('b').new('k')
+
+    def decode(self, headers):
+        sibling = RiakContent(self.robj)
+        return self.codec._parse_sibling(sibling, headers, 'data')
+
+    def test_decode(self):
+        sibling = self.decode([
+            ('Content-Type', 'text/plain; charset="utf-8"'),
+            ('ETag', '"abc"'),
+            ('Last-Modified', 'Tue, 14 Jan 2014 10:00:00 GMT'),
+            ('X-Riak-Meta-Color', 'blue'),
+            ('x-riak-index-age_int', '1, 2,3'),
+            ('X-Riak-Index-Name_bin', '"a, b", c'),
+            ('Link', '</buckets/b%20x/keys/k1>; riaktag="t1", '
+                     '</riak/b/k2>;riaktag="t2"'),
+            ('Link', '</buckets/b/keys/k3>; riaktag="t3"'),
+            ('X-Unknown', 'ignored')])
+        self.assertTrue(sibling.exists)
+        self.assertEqual('text/plain', sibling.content_type)
+        self.assertEqual('utf-8', sibling.charset)
+        self.assertEqual('"abc"', sibling.etag)
+        self.assertEqual(1389693600, sibling.last_modified)
+        self.assertEqual({'color': 'blue'}, sibling.usermeta)
+        self.assertEqual({('age_int', 1), ('age_int', 2), ('age_int', 3),
+                          ('name_bin', 'a, b'), ('name_bin', 'c')},
+                         sibling.indexes)
+        self.assertEqual([('b x', 'k1', 't1'), ('b', 'k2', 't2'),
+                          ('b', 'k3', 't3')], sibling.links)
+        self.assertEqual('data', sibling.encoded_data)
+
+    def test_decode_deleted(self):
+        self.assertFalse(self.decode([('X-Riak-Deleted', 'true')]).exists)
+
+    def test_decode_invalid_index(self):
+        with self.assertRaises(RiakError):
+            self.decode([('X-Riak-Index-Age', '1')])
+
+    def test_encode(self):
+        robj = self.robj
+        robj.content_type = 'application/json'
+        robj.vclock = VClock('vclock', 'binary')
+        robj.usermeta = {'color': 'blue'}
+        robj.add_index('age_int', 1).add_index('age_int', 2)
+        robj.add_index('name_bin', 'a')
+        robj.add_link(robj.bucket.new('k2'), 'tag')
+        headers = self.codec._build_put_headers(robj, if_none_match=True)
+        self.assertEqual('application/json', headers['Content-Type'])
+        self.assertEqual('client', headers['X-Riak-ClientId'])
+        self.assertEqual(VClock('vclock', 'binary').encode('base64'),
+                         headers['X-Riak-Vclock'])
+        self.assertEqual('blue', headers['X-Riak-Meta-color'])
+        self.assertEqual(['1', '2'], sorted(
+            headers['X-Riak-Index-age_int'].split(', ')))
+        self.assertEqual('a', headers['X-Riak-Index-name_bin'])
+        self.assertEqual('</buckets/b/keys/k2>; riaktag="tag"',
+                         headers['Link'])
+        self.assertEqual('*', headers['If-None-Match'])
+
+        # The headers decode to the same metadata
+        sibling = self.decode(headers.items())
+        self.assertEqual(robj.usermeta, sibling.usermeta)
+        self.assertEqual(robj.indexes, sibling.indexes)
+        self.assertEqual(robj.links, sibling.links)
+
+    def test_encode_many_links(self):
+        for i in range(1000):
+            self.robj.add_link(('b', 'key%04d' % i, 'tag'))
+        headers = self.codec._build_put_headers(self.robj)
+        values = headers.getall('Link')
+        self.assertTrue(len(values) > 1)
+        for value in values:
+            self.assertTrue(len(value) <= MAX_LINK_HEADER_SIZE)
+        self.assertEqual(self.robj.links, self.decode(
+            [('Link', value) for value in values]).links)
+
+
+if __name__ == '__main__':
+    unittest.main()
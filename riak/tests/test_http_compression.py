@@ -0,0 +1,156 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import gzip
+import json
+import platform
+import zlib
+from cStringIO import StringIO
+from riak.tests.test_http_stream import FakeResponse
+from riak.transports.http.compression import Decompressor, \
+    DecompressedResponse, decompress
+from riak.transports.http.connection import RiakHttpConnection
+from riak.transports.http.stream import RiakHttpKeyStream
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+def gzipped(data):
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+def raw_deflated(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+CONTENT = ''.join(json.dumps({'keys': ['key%d' % i for i in range(j, j + 50)]})
+                  for j in range(0, 1000, 50))
+
+
+class DecompressorTest(unittest.TestCase):
+    def feed(self, data, encoding, size):
+        decompressor = Decompressor(encoding)
+        output = [decompressor.decompress(data[i:i + size])
+                  for i in range(0, len(data), size)]
+        return ''.join(output) + decompressor.flush()
+
+    def test_formats(self):
+        for data, encoding in ((gzipped(CONTENT), 'gzip'),
+                               (zlib.compress(CONTENT), 'deflate'),
+                               (raw_deflated(CONTENT), 'deflate')):
+            self.assertEqual(CONTENT, decompress(data, encoding))
+            for size in (1, 3, 100):
+                self.assertEqual(CONTENT, self.feed(data, encoding, size))
+
+    def test_gzip_members(self):
+        data = gzipped(CONTENT[:500]) + gzipped(CONTENT[500:])
+        self.assertEqual(CONTENT, decompress(data, 'x-gzip'))
+        self.assertEqual(CONTENT, self.feed(data, 'gzip', 7))
+        # Padding after the last member is ignored
+        self.assertEqual(CONTENT, decompress(gzipped(CONTENT) + '\0' * 8,
+                                             'gzip'))
+
+    def test_corrupt(self):
+        with self.assertRaises(zlib.error):
+            decompress('\x1f\x8b' + 'x' * 20, 'gzip')
+
+
+class DecompressedResponseTest(unittest.TestCase):
+    def test_read(self):
+        response = DecompressedResponse(FakeResponse(gzipped(CONTENT)),
+                                        'gzip')
+        # Up to the given size is returned, as it is decompressed
+        first = response.read(10)
+        self.assertTrue(0 < len(first) <= 10)
+        self.assertEqual(CONTENT, first + response.read())
+        self.assertEqual('', response.read(10))
+
+    def test_stream(self):
+        response = FakeResponse(gzipped(CONTENT),
+                                {'content-encoding': 'gzip'})
+        stream = RiakHttpKeyStream(DecompressedResponse(response, 'gzip'),
+                                   16)
+        keys = [key for chunk in stream for key in chunk]
+        self.assertEqual(['key%d' % i for i in range(1000)], keys)
+
+
+class FakeConnection(object):
+    def __init__(self, body, headers):
+        self.response = FakeResponse(body, headers)
+        self.response.status = 200
+        self.response.msg = headers
+        self.response.close = lambda: None
+
+    def request(self, method, uri, body, headers):
+        self.headers = headers
+
+    def getresponse(self):
+        return self.response
+
+
+class CompressedRequestTest(unittest.TestCase):
+    def connection(self, compression, body, headers={}):
+        connection = RiakHttpConnection()
+        connection._compression = compression
+        connection._connection = FakeConnection(body, headers)
+        return connection
+
+    def test_compressed(self):
+        connection = self.connection(True, zlib.compress(CONTENT),
+                                     {'content-encoding': 'deflate'})
+        _, _, body = connection._request('GET', '/keys', compress=True)
+        self.assertEqual(CONTENT, body)
+        self.assertEqual('gzip, deflate',
+                         connection._connection.headers['Accept-Encoding'])
+
+        connection = self.connection(True, gzipped(CONTENT),
+                                     {'content-encoding': 'gzip'})
+        _, _, response = connection._request('GET', '/keys', stream=True,
+                                             compress=True)
+        self.assertEqual(CONTENT, response.read())
+
+    def test_not_requested(self):
+        # Object requests, or transports without compression, leave
+        # the body as it is
+        data = gzipped(CONTENT)
+        for compression, compress in ((True, False), (False, True)):
+            connection = self.connection(compression, data,
+                                         {'content-encoding': 'gzip'})
+            _, _, body = connection._request('GET', '/object',
+                                             compress=compress)
+            self.assertEqual(data, body)
+            self.assertNotIn('Accept-Encoding',
+                             connection._connection.headers)
+
+    def test_identity(self):
+        connection = self.connection(True, CONTENT)
+        _, _, body = connection._request('GET', '/keys', compress=True)
+        self.assertEqual(CONTENT, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
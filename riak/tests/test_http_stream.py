@@ -0,0 +1,163 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+import json
+import platform
+from cStringIO import StringIO
+from riak.client import RiakClient
+from riak.client.index_page import CONTINUATION
+from riak.transports.http.codec import RiakHttpCodec
+from riak.transports.http.multipart import parse_multipart, \
+    MultipartParser
+from riak.transports.http.stream import RiakHttpKeyStream, \
+    RiakHttpBucketStream, RiakHttpIndexStream
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class FakeResponse(object):
+    """
+    A response body read from memory, with headers.
+    """
+
+    def __init__(self, body, headers={}):
+        self._body = StringIO(body)
+        self._headers = headers
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._body.read()
+        return self._body.read(amt)
+
+    def getheader(self, name, default=None):
+        return self._headers.get(name.lower(), default)
+
+
+class JsonStreamTest(unittest.TestCase):
+    def stream(self, body, block_size=None, cls=RiakHttpKeyStream):
+        return list(cls(FakeResponse(body), block_size))
+
+    def test_split_across_reads(self):
+        chunks = [['a', 'b'], [], ['c' * 100, 'd']]
+        body = '\n'.join(json.dumps({'keys': c}) for c in chunks)
+        for block_size in (1, 2, 3, 7, 64, None):
+            self.assertEqual(chunks, self.stream(body, block_size))
+
+    def test_braces_and_escapes_in_keys(self):
+        chunks = [['}', '{"', '\\"}', u'\xe9}'], ['a\\'], ['"']]
+        body = ''.join(json.dumps({'keys': c}) for c in chunks)
+        for block_size in (1, 5, None):
+            self.assertEqual(chunks, self.stream(body, block_size))
+
+    def test_nested_objects(self):
+        body = '{"keys":["a"],"meta":{"x":{"y":"}"}}}{"keys":["b"]}'
+        self.assertEqual([['a'], ['b']], self.stream(body, 4))
+
+    def test_incomplete_object(self):
+        body = '{"keys":["a"]}{"keys":["b"'
+        self.assertEqual([['a']], self.stream(body, 3))
+        self.assertEqual([], self.stream(''))
+
+    def test_buckets(self):
+        body = '{"buckets":["x","y"]}{"buckets":["z"]}'
+        self.assertEqual([['x', 'y'], ['z']],
+                         self.stream(body, 8, RiakHttpBucketStream))
+
+
+SIBLINGS = ('\r\n--XYZ\r\n'
+            'Content-Type: text/plain\r\n'
+            'Link: </buckets/b/keys/a>; riaktag="x",\r\n'
+            ' </buckets/b/keys/c>; riaktag="y"\r\n'
+            'X-Riak-Meta-Color: blue\r\n'
+            '\r\n'
+            'first\r\n--XY\r\nnot a delimiter'
+            '\r\n--XYZ\r\n'
+            'Content-Type: application/json\r\n'
+            'X-Riak-Index-Age_int: 1, 2\r\n'
+            '\r\n'
+            '{"a": 1}'
+            '\r\n--XYZ\r\n'
+            'X-Riak-Deleted: true\r\n'
+            '\r\n'
+            '\r\n--XYZ--\r\n')
+
+
+class Codec(RiakHttpCodec):
+    def check_http_code(self, status, expected_statuses):
+        pass
+
+
+class MultipartTest(unittest.TestCase):
+    def test_parse(self):
+        parts = parse_multipart(SIBLINGS, 'XYZ')
+        self.assertEqual(3, len(parts))
+        headers, body = parts[0]
+        self.assertEqual('first\r\n--XY\r\nnot a delimiter', body)
+        self.assertEqual([('Content-Type', 'text/plain'),
+                          ('Link', '</buckets/b/keys/a>; riaktag="x", '
+                           '</buckets/b/keys/c>; riaktag="y"'),
+                          ('X-Riak-Meta-Color', 'blue')], headers)
+        self.assertEqual('{"a": 1}', parts[1][1])
+        self.assertEqual(([('X-Riak-Deleted', 'true')], ''), parts[2])
+
+    def test_unterminated(self):
+        self.assertEqual(2, len(parse_multipart(SIBLINGS[:-9], 'XYZ')))
+        self.assertEqual([], parse_multipart('', 'XYZ'))
+        # The first delimiter may be at the very start
+        self.assertEqual(3, len(parse_multipart(SIBLINGS[2:], 'XYZ')))
+
+    def test_feed(self):
+        expected = parse_multipart(SIBLINGS, 'XYZ')
+        for size in (1, 2, 5, 16, 1024):
+            parser = MultipartParser('XYZ')
+            parts = []
+            for i in range(0, len(SIBLINGS), size):
+                parts.extend(parser.feed(SIBLINGS[i:i + size]))
+            self.assertEqual(expected, parts)
+            self.assertTrue(parser.done)
+
+    def test_siblings(self):
+        robj = RiakClient().bucket('b').new('k')
+        headers = {'content-type': 'multipart/mixed; boundary=XYZ'}
+        Codec()._parse_body(robj, (300, headers, SIBLINGS), [300])
+        first, second, third = robj.siblings
+        self.assertEqual('first\r\n--XY\r\nnot a delimiter',
+                         first.encoded_data)
+        self.assertEqual([('b', 'a', 'x'), ('b', 'c', 'y')], first.links)
+        self.assertEqual({'color': 'blue'}, first.usermeta)
+        self.assertEqual({('age_int', 1), ('age_int', 2)}, second.indexes)
+        self.assertEqual({'a': 1}, second.data)
+        self.assertFalse(third.exists)
+
+    def test_index_stream(self):
+        body = ('\r\n--XYZ\r\nContent-Type: application/json\r\n\r\n'
+                '{"keys":["a","b"]}\r\n--XYZ\r\n'
+                'Content-Type: application/json\r\n\r\n'
+                '{"continuation":"c1"}\r\n--XYZ--\r\n')
+        response = FakeResponse(body, {'content-type':
+                                       'multipart/mixed; boundary=XYZ'})
+        stream = RiakHttpIndexStream(response, 'field_bin', False)
+        self.assertEqual([['a', 'b'], CONTINUATION('c1')], list(stream))
+
+
+if __name__ == '__main__':
+    unittest.main()
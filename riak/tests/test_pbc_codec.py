@@ -0,0 +1,147 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import platform
+import riak_pb
+from distutils.version import LooseVersion
+from riak.client import RiakClient
+from riak.content import RiakContent
+from riak.node import RiakNode
+from riak.riak_object import VClock
+from riak.transports.pbc import RiakPbcTransport
+from riak.transports.pbc.codec import RiakPbcCodec, RiakPbcContent
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class LazyContentTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = RiakPbcCodec()
+        self.robj = RiakClient().bucket('lazy').new('key')
+        self.rpb = riak_pb.RpbContent(value='{"a": 1}',
+                                      content_type='application/json',
+                                      vtag='vtag', last_mod=1380000000,
+                                      last_mod_usecs=500000)
+        self.rpb.indexes.add(key='field_int', value='10')
+        self.rpb.indexes.add(key='field_bin', value='ten')
+        self.rpb.links.add(bucket='b', key='k', tag='t')
+        self.rpb.links.add(bucket='b', key='k2')
+        self.rpb.usermeta.add(key='m', value='v')
+
+    def test_matches_eager_decoding(self):
+        eager = self.codec._decode_content(self.rpb, RiakContent(self.robj))
+        lazy = RiakPbcContent(self.robj, self.rpb)
+        for name in ('data', 'encoded_data', 'exists', 'content_type',
+                     'charset', 'content_encoding', 'etag', 'links',
+                     'last_modified', 'usermeta', 'indexes'):
+            self.assertEqual(getattr(eager, name), getattr(lazy, name),
+                             name)
+
+    def test_missing_fields(self):
+        lazy = RiakPbcContent(self.robj, riak_pb.RpbContent(value=''))
+        self.assertEqual([], lazy.links)
+        self.assertEqual({}, lazy.usermeta)
+        self.assertEqual(set(), lazy.indexes)
+        self.assertIsNone(lazy.last_modified)
+        self.assertEqual('application/json', lazy.content_type)
+
+    def test_assignment_before_access(self):
+        lazy = RiakPbcContent(self.robj, self.rpb)
+        lazy.links = []
+        lazy.usermeta = {'other': 'value'}
+        self.assertEqual([], lazy.links)
+        self.assertEqual({'other': 'value'}, lazy.usermeta)
+
+    def test_releases_message(self):
+        lazy = RiakPbcContent(self.robj, self.rpb)
+        self.assertEqual({'a': 1}, lazy.data)
+        lazy.links
+        lazy.usermeta
+        lazy.indexes = set()
+        self.assertIsNotNone(lazy._rpb_content)
+        self.assertEqual(1380000000.5, lazy.last_modified)
+        self.assertIsNone(lazy._rpb_content)
+        self.assertEqual({'m': 'v'}, lazy.usermeta)
+
+    def test_message_unchanged(self):
+        before = self.rpb.SerializeToString()
+        first = RiakPbcContent(self.robj, self.rpb)
+        first.data, first.links, first.usermeta, first.indexes
+        self.assertEqual(before, self.rpb.SerializeToString())
+        second = RiakPbcContent(self.robj, self.rpb)
+        self.assertEqual({'a': 1}, second.data)
+
+    def test_modification_through_object(self):
+        self.codec._decode_contents([self.rpb], self.robj)
+        self.assertIsInstance(self.robj.siblings[0], RiakPbcContent)
+        self.robj.add_index('other_int', 5)
+        self.robj.remove_index('field_bin')
+        self.assertEqual(set([('field_int', 10), ('other_int', 5)]),
+                         self.robj.indexes)
+        self.robj.add_link(('b', 'k3', None))
+        self.assertEqual(3, len(self.robj.links))
+
+        encoded = riak_pb.RpbContent()
+        self.codec._encode_content(self.robj, encoded)
+        self.assertEqual(2, len(encoded.indexes))
+        self.assertEqual(3, len(encoded.links))
+        self.assertEqual(1, len(encoded.usermeta))
+
+
+class RequestTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = RiakPbcTransport(node=RiakNode())
+        self.transport.server_version = LooseVersion('1.4.0')
+        self.bucket = RiakClient().bucket('templates')
+
+    def test_requests_do_not_share_fields(self):
+        first = self.transport._get_req(self.bucket.new('a'), r=1, pr=2,
+                                        timeout=100).SerializeToString()
+        second = riak_pb.RpbGetReq()
+        second.ParseFromString(self.transport._get_req(
+            self.bucket.new('b')).SerializeToString())
+        self.assertNotEqual(first, second.SerializeToString())
+        self.assertEqual('b', second.key)
+        self.assertTrue(second.deletedvclock)
+        for field in ('r', 'pr', 'timeout'):
+            self.assertFalse(second.HasField(field), field)
+
+        robj = self.bucket.new('c', encoded_data='value',
+                               content_type='text/plain')
+        robj.vclock = VClock('vclock', 'binary')
+        robj.add_index('field_bin', 'value')
+        self.transport._put_req(robj, w=1, timeout=100)
+        put = self.transport._put_req(self.bucket.new('d', data=1))
+        self.assertFalse(put.HasField('vclock'))
+        self.assertFalse(put.HasField('w'))
+        self.assertEqual(0, len(put.content.indexes))
+        self.assertEqual('1', put.content.value)
+
+    def test_features_follow_server_version(self):
+        self.transport.server_version = LooseVersion('0.14.2')
+        req = self.transport._get_req(self.bucket.new('a'), pr=2,
+                                      timeout=100)
+        self.assertFalse(req.HasField('pr'))
+        self.assertFalse(req.HasField('timeout'))
+        self.assertFalse(req.HasField('deletedvclock'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,367 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import platform
+import riak_pb
+import socket
+import struct
+from threading import Thread
+from riak import RiakError
+from riak.client import RiakClient
+from riak.node import RiakNode
+from riak.transports.pbc import RiakPbcTransport
+from riak.transports.pool import BadResource
+from riak.transports.pbc.connection import RiakPbcConnection, \
+    MAX_RETAINED_BUFFER
+from riak_pb.messages import MSG_CODE_GET_REQ, MSG_CODE_GET_RESP, \
+    MSG_CODE_ERROR_RESP, MSG_CODE_COUNTER_UPDATE_REQ, \
+    MSG_CODE_COUNTER_UPDATE_RESP, MSG_CODE_PUT_RESP
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class PairedConnection(RiakPbcConnection):
+    """
+    A connection whose socket is one end of a socket pair, the other
+    end being played by the test.
+    """
+    def __init__(self):
+        self.server, self._socket = socket.socketpair()
+
+    def serve(self, data):
+        sender = Thread(target=self.server.sendall, args=(data,))
+        sender.start()
+        return sender
+
+    def close(self):
+        self.server.close()
+        self._socket.close()
+
+
+class PbcConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = PairedConnection()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def frame(self, size):
+        resp = riak_pb.RpbGetResp(vclock='vclock')
+        resp.content.add(value='x' * size)
+        return self.conn._encode_msg(MSG_CODE_GET_RESP, resp)
+
+    def test_receives_messages_of_any_size(self):
+        """
+        Messages smaller and larger than the buffer should decode
+        intact, and only reasonably sized buffers should be kept.
+        """
+        sizes = [10, 100000, 10, MAX_RETAINED_BUFFER * 2, 10]
+        sender = self.conn.serve(''.join(self.frame(n) for n in sizes))
+        for size in sizes:
+            msg_code, resp = self.conn._recv_msg(expect=MSG_CODE_GET_RESP)
+            self.assertEqual('vclock', resp.vclock)
+            self.assertEqual('x' * size, resp.content[0].value)
+            self.assertLessEqual(len(self.conn._inbuf), MAX_RETAINED_BUFFER)
+        sender.join()
+
+    def test_receives_many_small_messages(self):
+        """
+        A stream of small messages arriving in arbitrary pieces should
+        be sliced into the right messages.
+        """
+        data = ''.join(self.frame(n % 300) for n in range(2000))
+        chunks = [data[i:i + 7777] for i in range(0, len(data), 7777)]
+        sender = Thread(target=lambda: [self.conn.server.sendall(c)
+                                        for c in chunks])
+        sender.start()
+        for n in range(2000):
+            msg_code, resp = self.conn._recv_msg(expect=MSG_CODE_GET_RESP)
+            self.assertEqual('x' * (n % 300), resp.content[0].value)
+        sender.join()
+
+    def test_reserve_moves_overlapping_partial_message(self):
+        """
+        Moving a partial message to the front of the same buffer should
+        work when it overlaps its new place.
+        """
+        self.conn._inbuf = bytearray('abcdefghij')
+        self.conn._inbuf_start, self.conn._inbuf_end = 3, 10
+        self.conn._reserve(8)
+        self.assertEqual(10, len(self.conn._inbuf))
+        self.assertEqual('defghij', str(self.conn._inbuf[:7]))
+        self.assertEqual((0, 7), (self.conn._inbuf_start,
+                                  self.conn._inbuf_end))
+
+    def test_timeout_keeps_partial_message(self):
+        """
+        Bytes read before a timeout should still be buffered, so that
+        the message can be read once the rest arrives.
+        """
+        data = self.frame(100000)
+        self.conn._socket.settimeout(0.05)
+        self.conn.serve(data[:50000]).join()
+        with self.assertRaises(socket.timeout):
+            self.conn._recv_msg(expect=MSG_CODE_GET_RESP)
+        self.conn.serve(data[50000:]).join()
+        msg_code, resp = self.conn._recv_msg(expect=MSG_CODE_GET_RESP)
+        self.assertEqual('x' * 100000, resp.content[0].value)
+
+    def test_timeout_shuts_down_large_message(self):
+        """
+        A message too large to buffer cannot be resumed after a
+        timeout, so the connection should not be usable afterwards.
+        """
+        data = self.frame(MAX_RETAINED_BUFFER * 2)
+        self.conn._socket.settimeout(0.05)
+        self.conn.serve(data[:50000]).join()
+        with self.assertRaises(socket.timeout):
+            self.conn._recv_msg(expect=MSG_CODE_GET_RESP)
+        with self.assertRaises(socket.error):
+            self.conn._send_msg(MSG_CODE_GET_REQ, None)
+
+    def test_sends_large_messages_whole(self):
+        """
+        Messages should be sent completely, and messages written
+        together should be sent back to back.
+        """
+        resp = riak_pb.RpbGetResp(vclock='vclock')
+        resp.content.add(value='x' * (MAX_RETAINED_BUFFER * 3))
+        expected = self.conn._encode_msg(MSG_CODE_GET_RESP, resp) + \
+            self.conn._encode_msg(MSG_CODE_ERROR_RESP)
+        received = []
+
+        def _receive():
+            size = 0
+            while size < len(expected):
+                received.append(self.conn.server.recv(65536))
+                size += len(received[-1])
+        receiver = Thread(target=_receive)
+        receiver.start()
+
+        self.conn._write_msg(MSG_CODE_GET_RESP, resp)
+        self.conn._write_msg(MSG_CODE_ERROR_RESP)
+        self.conn._flush()
+        receiver.join()
+        self.assertEqual(expected, ''.join(received))
+        self.assertIsNone(self.conn._outbuf)
+
+    def test_error_response(self):
+        """
+        Error responses should raise RiakError.
+        """
+        err = riak_pb.RpbErrorResp(errmsg='boom', errcode=1)
+        self.conn.serve(self.conn._encode_msg(MSG_CODE_ERROR_RESP, err))
+        with self.assertRaises(RiakError):
+            self.conn._recv_msg()
+
+    def test_short_packet(self):
+        """
+        A connection closed in the middle of a message should raise
+        RiakError.
+        """
+        self.conn.serve(self.frame(1000)[:500]).join()
+        self.conn.server.close()
+        with self.assertRaises(RiakError):
+            self.conn._recv_msg()
+
+
+class PairedTransport(RiakPbcTransport, PairedConnection):
+    def __init__(self):
+        RiakPbcTransport.__init__(self, node=RiakNode())
+        PairedConnection.__init__(self)
+        self.server_version = '1.4.0'
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = PairedTransport()
+        self.bucket = RiakClient().bucket('pipeline')
+
+    def tearDown(self):
+        self.transport.close()
+
+    def respond(self, count):
+        """
+        Reads ``count`` requests and only then answers them all,
+        failing fetches of the key 'bad' and answering fetches of the
+        key 'garbled' with an unknown message code.
+        """
+        def _serve():
+            requests = []
+            for i in range(count):
+                msglen, = struct.unpack('!i', recv(4))
+                data = recv(msglen)
+                requests.append((ord(data[0]), data[1:]))
+            for code, data in requests:
+                if code == MSG_CODE_GET_REQ:
+                    req = riak_pb.RpbGetReq()
+                    req.ParseFromString(data)
+                    if req.key == 'bad':
+                        err = riak_pb.RpbErrorResp(errmsg='bad', errcode=1)
+                        reply(MSG_CODE_ERROR_RESP, err)
+                    elif req.key == 'garbled':
+                        self.transport.server.sendall(
+                            struct.pack('!iB', 1, 100))
+                    else:
+                        resp = riak_pb.RpbGetResp(vclock='vclock')
+                        resp.content.add(value=req.key)
+                        reply(MSG_CODE_GET_RESP, resp)
+                elif code == MSG_CODE_COUNTER_UPDATE_REQ:
+                    resp = riak_pb.RpbCounterUpdateResp(value=5)
+                    reply(MSG_CODE_COUNTER_UPDATE_RESP, resp)
+
+        def recv(size):
+            data = ''
+            while len(data) < size:
+                data += self.transport.server.recv(size - len(data))
+            return data
+
+        def reply(code, msg):
+            self.transport.server.sendall(
+                self.transport._encode_msg(code, msg))
+
+        server = Thread(target=_serve)
+        server.start()
+        return server
+
+    def test_pipelined_results_in_order(self):
+        """
+        All requests should be written before any response is read,
+        with the results in order and errors confined to their item.
+        """
+        server = self.respond(4)
+        operations = [('get', (self.bucket.new('a'),), {}),
+                      ('get', (self.bucket.new('bad'),), {}),
+                      ('update_counter', (self.bucket, 'c', 1),
+                       {'returnvalue': True}),
+                      ('get', (self.bucket.new('b'),), {})]
+        results = self.transport.pipeline(operations)
+        server.join()
+        self.assertEqual('a', results[0].encoded_data)
+        self.assertIsInstance(results[1], RiakError)
+        self.assertEqual(5, results[2])
+        self.assertEqual('b', results[3].encoded_data)
+
+    def test_large_values_do_not_deadlock(self):
+        """
+        Requests and responses larger than the socket buffers should
+        not leave both sides blocked sending, when the server answers
+        each request before reading the next.
+        """
+        size = 4 * self.transport._socket.getsockopt(socket.SOL_SOCKET,
+                                                     socket.SO_SNDBUF)
+        values = [c * size for c in 'abcde']
+        self.transport._socket.settimeout(5)
+        self.transport.server.settimeout(5)
+
+        def _echo():
+            for value in values:
+                msglen, = struct.unpack('!i', recv(4))
+                req = riak_pb.RpbPutReq()
+                req.ParseFromString(recv(msglen)[1:])
+                resp = riak_pb.RpbPutResp(vclock='vclock')
+                resp.content.add(value=req.content.value)
+                self.transport.server.sendall(
+                    self.transport._encode_msg(MSG_CODE_PUT_RESP, resp))
+
+        def recv(size):
+            data = ''
+            while len(data) < size:
+                data += self.transport.server.recv(size - len(data))
+            return data
+
+        server = Thread(target=_echo)
+        server.start()
+        operations = [('put', (self.bucket.new(value[0], encoded_data=value,
+                                               content_type='text/plain'),),
+                       {'return_body': True})
+                      for value in values]
+        results = self.transport.pipeline(operations)
+        server.join()
+        self.assertEqual(values, [robj.encoded_data for robj in results])
+
+    def test_garbled_response_discards_connection(self):
+        """
+        A response that cannot be decoded in the middle of a window
+        should leave the connection to be discarded, not reused with
+        responses unread.
+        """
+        server = self.respond(3)
+        operations = [('get', (self.bucket.new('a'),), {}),
+                      ('get', (self.bucket.new('garbled'),), {}),
+                      ('get', (self.bucket.new('b'),), {})]
+        with self.assertRaises(BadResource):
+            self.transport.pipeline(operations)
+        server.join()
+
+
+class SocketOptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.node = RiakNode(pb_port=self.listener.getsockname()[1])
+        self.transport = None
+
+    def tearDown(self):
+        if self.transport:
+            self.transport.close()
+        self.listener.close()
+
+    def connect(self, **options):
+        self.transport = RiakPbcTransport(node=self.node, **options)
+        self.transport._connect()
+        return self.transport._socket
+
+    def test_default_options(self):
+        sock = self.connect()
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP,
+                                        socket.TCP_NODELAY))
+        self.assertFalse(sock.getsockopt(socket.SOL_SOCKET,
+                                         socket.SO_KEEPALIVE))
+        self.assertIsNone(sock.gettimeout())
+
+    def test_options(self):
+        sock = self.connect(nodelay=False, keepalive=True,
+                            keepalive_idle=30, keepalive_interval=5,
+                            keepalive_count=3, recv_buffer=262144,
+                            send_buffer=262144)
+        self.assertFalse(sock.getsockopt(socket.IPPROTO_TCP,
+                                         socket.TCP_NODELAY))
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET,
+                                        socket.SO_KEEPALIVE))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.assertEqual(30, sock.getsockopt(socket.IPPROTO_TCP,
+                                                 socket.TCP_KEEPIDLE))
+            self.assertEqual(5, sock.getsockopt(socket.IPPROTO_TCP,
+                                                socket.TCP_KEEPINTVL))
+            self.assertEqual(3, sock.getsockopt(socket.IPPROTO_TCP,
+                                                socket.TCP_KEEPCNT))
+        # Some systems double the requested size
+        self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET,
+                                                socket.SO_RCVBUF), 262144)
+
+    def test_connect_timeout_is_separate(self):
+        sock = self.connect(timeout=10, connect_timeout=0.5)
+        self.assertEqual(10, sock.gettimeout())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,7 +19,10 @@ under the License.
 import platform
 from Queue import Queue
 from threading import Thread, currentThread
-from riak.transports.pool import Pool, BadResource
+from riak.transports.pool import Pool, BadResource, PoolExhausted, NodePool
+from riak.client import RiakClient
+from riak.node import RiakNode, Ewma, power_of_two_policy, \
+    least_outstanding_policy
 from random import SystemRandom
 from time import sleep
 
@@ -31,9 +34,9 @@ import os
 
 
 class SimplePool(Pool):
-    def __init__(self):
+    def __init__(self, **options):
         self.count = 0
-        Pool.__init__(self)
+        Pool.__init__(self, **options)
 
     def create_resource(self):
         self.count += 1
@@ -48,6 +51,24 @@ class EmptyListPool(Pool):
         return []
 
 
+class FakeClient(object):
+    _choose_node = RiakClient.__dict__['_choose_node']
+    node_policy = staticmethod(power_of_two_policy)
+
+    def __init__(self, count):
+        self.nodes = [RiakNode(host='node%d' % i) for i in range(count)]
+
+
+class NodeListPool(NodePool):
+    def create_node_resource(self, node):
+        return [node]
+
+    def warm_resource(self, resource):
+        if resource[0].host == 'down':
+            raise IOError("connection refused")
+        resource.append('warm')
+
+
 @unittest.skipIf(os.environ.get('SKIP_POOL'),
                  'Skipping connection pool tests')
 class PoolTest(unittest.TestCase):
@@ -137,6 +158,22 @@ class PoolTest(unittest.TestCase):
         with pool.take(_filter=filtereven) as f:
             self.assertEqual([2], f)
 
+    def test_reuses_most_recently_released(self):
+        """
+        The pool should hand out the most recently released resource
+        first, so that rarely-used resources stay idle.
+        """
+        pool = SimplePool()
+        with pool.take():
+            with pool.take():
+                with pool.take():
+                    pass
+
+        with pool.take() as first:
+            self.assertEqual([1], first)
+            with pool.take() as second:
+                self.assertEqual([2], second)
+
     def test_requires_filter_to_be_callable(self):
         """
         The _filter parameter should be required to be a callable, or
@@ -236,6 +273,62 @@ class PoolTest(unittest.TestCase):
 
             self.assertItemsEqual(pool.elements, touched)
 
+    def test_iteration_claims_all_unclaimed(self):
+        """
+        Iteration should touch every resource even when they are all
+        unclaimed at the start, claiming each while it is current and
+        releasing them all by the end.
+        """
+        pool = SimplePool()
+        with pool.take():
+            with pool.take():
+                with pool.take():
+                    pass
+
+        touched = []
+        for element in pool:
+            self.assertTrue(element.claimed)
+            touched.append(element)
+        self.assertItemsEqual(pool.elements, touched)
+        for element in touched:
+            self.assertFalse(element.claimed)
+
+        with pool.take() as reused:
+            self.assertIn(reused, [[1], [2], [3]])
+
+    def test_iteration_within_max_size(self):
+        """
+        Iterating over a full pool should leave its resources
+        available to be taken again.
+        """
+        pool = SimplePool(max_size=2, acquire_timeout=0.1)
+        with pool.take():
+            with pool.take():
+                pass
+
+        iterator = iter(pool)
+        iterator.next()
+        iterator.close()
+        for element in pool:
+            pass
+        with pool.take() as first:
+            with pool.take() as second:
+                self.assertItemsEqual([[1], [2]], [first, second])
+
+    def test_set_client_id(self):
+        """
+        Setting the client ID should change it on the pooled
+        transports, and leave them available.
+        """
+        client = RiakClient(nodes=[{'server_version': '1.4.8'}],
+                            transport_options={'max_size': 1,
+                                               'acquire_timeout': 0.1})
+        with client._http_pool.take():
+            pass
+        client.client_id = 'abc'
+        with client._http_pool.take() as transport:
+            self.assertEqual('abc', transport.client_id)
+
     def test_clear(self):
         """
         Clearing the pool should remove all resources known at the
@@ -289,6 +382,264 @@ class PoolTest(unittest.TestCase):
         # Make sure that the pool resources are gone
         self.assertEqual(0, len(pool.elements))
 
+    def test_max_size_blocks_until_release(self):
+        """
+        A full pool should wait for a resource to be released rather
+        than create a new one.
+        """
+        pool = SimplePool(max_size=1)
+        claimed = Queue()
+        release = Queue()
+
+        def _run():
+            with pool.take() as resource:
+                claimed.put(resource)
+                release.get()
+
+        th = Thread(target=_run)
+        th.start()
+        first = claimed.get()
+        Thread(target=lambda: (sleep(0.1), release.put(1))).start()
+
+        with pool.take() as second:
+            self.assertIs(first, second)
+        th.join()
+        self.assertEqual(1, len(pool.elements))
+
+    def test_acquire_timeout_raises_exhausted(self):
+        """
+        A full pool should raise PoolExhausted when no resource is
+        released within the acquire timeout.
+        """
+        pool = SimplePool(max_size=2, acquire_timeout=0.05)
+        with pool.take():
+            with pool.take():
+                with self.assertRaises(PoolExhausted):
+                    with pool.take():
+                        pass
+        self.assertEqual(2, len(pool.elements))
+
+    def test_full_pool_replaces_unmatching_element(self):
+        """
+        A full pool should replace an unclaimed resource that the
+        filter rejects instead of waiting.
+        """
+        def filtereven(numlist):
+            return numlist[0] % 2 == 0
+
+        pool = SimplePool(max_size=1, acquire_timeout=0.05)
+        with pool.take():
+            pass
+        with pool.take(_filter=filtereven) as even:
+            self.assertEqual([2], even)
+        self.assertEqual(1, len(pool.elements))
+
+    def test_fill_creates_min_idle(self):
+        """
+        Filling the pool should create unclaimed resources up to
+        min_idle, bounded by max_size.
+        """
+        pool = SimplePool(min_idle=3)
+        pool.fill()
+        self.assertEqual(3, len(pool.elements))
+        for element in pool.elements:
+            self.assertFalse(element.claimed)
+
+        bounded = SimplePool(max_size=2, min_idle=2)
+        with bounded.take():
+            bounded.fill()
+        self.assertEqual(2, len(bounded.elements))
+
+    def test_tracks_element_usage(self):
+        """
+        Elements should record their creation time, last release and
+        number of claims.
+        """
+        pool = SimplePool()
+        for i in range(3):
+            with pool.take():
+                pass
+        element = pool.elements[0]
+        self.assertEqual(3, element.use_count)
+        self.assertGreaterEqual(element.last_used, element.created_at)
+
+    def test_expired_elements_not_handed_out(self):
+        """
+        The pool should destroy a resource past max_lifetime rather
+        than yield it.
+        """
+        pool = SimplePool(max_lifetime=60)
+        with pool.take() as first:
+            self.assertEqual([1], first)
+        pool.elements[0].created_at -= 120
+        with pool.take() as second:
+            self.assertEqual([2], second)
+        self.assertEqual([], first)
+        self.assertEqual(1, len(pool.elements))
+
+    def test_reap_removes_idle_elements(self):
+        """
+        Reaping should remove resources that have been unclaimed for
+        longer than max_idle, keeping min_idle of them.
+        """
+        pool = SimplePool(max_idle=60, min_idle=1, reap_interval=3600)
+        with pool.take():
+            with pool.take():
+                with pool.take():
+                    pass
+        for element in pool.elements:
+            element.last_used -= 120
+
+        self.assertEqual(2, pool.reap())
+        self.assertEqual(1, len(pool.elements))
+        # The most recently released resource is the one kept
+        self.assertEqual([1], pool.elements[0].object)
+
+    def test_reap_refills_min_idle(self):
+        """
+        Reaping resources past max_lifetime should replace them to
+        keep min_idle resources in the pool.
+        """
+        pool = SimplePool(max_lifetime=60, min_idle=2, reap_interval=3600)
+        pool.fill()
+        for element in pool.elements:
+            element.created_at -= 120
+
+        self.assertEqual(2, pool.reap())
+        self.assertEqual(2, len(pool.elements))
+        self.assertItemsEqual([[3], [4]], [e.object for e in pool.elements])
+
+    def test_min_idle_alone_is_kept(self):
+        """
+        Setting only min_idle should start the reaper, which keeps
+        that many unclaimed resources in the pool, and in the
+        sub-pool of each node.
+        """
+        def _wait_for(condition):
+            for i in range(100):
+                if condition():
+                    return True
+                sleep(0.01)
+            return False
+
+        pool = SimplePool(min_idle=2, reap_interval=0.01)
+        self.assertTrue(_wait_for(lambda: len(pool._idle) == 2))
+        with pool.take():
+            self.assertTrue(_wait_for(lambda: len(pool._idle) == 2))
+        self.assertEqual(3, len(pool.elements))
+
+        client = FakeClient(2)
+        node_pool = NodeListPool(client, min_idle=1, reap_interval=0.01)
+        with node_pool.take():
+            pass
+        self.assertTrue(_wait_for(lambda: all(
+            stats['idle'] == 1 for stats in node_pool.stats().values())))
+        self.assertEqual(2, len(node_pool.stats()))
+
+    def test_node_pool_skips_nodes(self):
+        """
+        The node pool should yield resources from nodes that are not
+        skipped, and fall back to all nodes when every one is skipped.
+        """
+        client = FakeClient(3)
+        pool = NodeListPool(client)
+        for node in client.nodes:
+            skip = [n for n in client.nodes if n is not node]
+            with pool.take(skip_nodes=skip) as resource:
+                self.assertEqual([node], resource)
+        with pool.take(skip_nodes=client.nodes) as resource:
+            self.assertIn(resource[0], client.nodes)
+        self.assertEqual(3, len(pool.elements))
+
+    def test_node_pool_prefers_idle_nodes(self):
+        """
+        The node pool should reuse an idle resource on any node
+        before creating another.
+        """
+        client = FakeClient(3)
+        pool = NodeListPool(client)
+        with pool.take() as first:
+            pass
+        for i in range(10):
+            with pool.take() as resource:
+                self.assertIs(first, resource)
+        self.assertEqual(1, len(pool.elements))
+
+    def test_node_pool_caps_each_node(self):
+        """
+        The max_size option should apply to each node, spreading
+        concurrent claims across the nodes.
+        """
+        client = FakeClient(2)
+        pool = NodeListPool(client, max_size=1, acquire_timeout=0.05)
+        with pool.take() as first:
+            with pool.take() as second:
+                self.assertNotEqual(first, second)
+                with self.assertRaises(PoolExhausted):
+                    with pool.take():
+                        pass
+            stats = pool.stats()
+            self.assertEqual({'size': 1, 'idle': 0, 'claimed': 1},
+                             stats[first[0]])
+            self.assertEqual({'size': 1, 'idle': 1, 'claimed': 0},
+                             stats[second[0]])
+
+    def test_node_pool_warm_up(self):
+        """
+        Warming up should park the given number of warmed resources
+        for each node, skipping nodes that fail.
+        """
+        client = FakeClient(3)
+        client.nodes[2].host = 'down'
+        pool = NodeListPool(client)
+        self.assertEqual(4, pool.warm_up(2))
+        for node in client.nodes[:2]:
+            self.assertEqual({'size': 2, 'idle': 2, 'claimed': 0},
+                             pool.stats()[node])
+        self.assertEqual(0, pool.stats()[client.nodes[2]]['size'])
+        self.assertGreater(client.nodes[2].error_rate.value(), 0)
+        for element in pool.elements:
+            self.assertEqual('warm', element.object[1])
+
+    def test_ewma_tracks_recent_samples(self):
+        """
+        The moving average should start at the first sample and move
+        toward later ones.
+        """
+        avg = Ewma(tau=0.05)
+        self.assertEqual(0.0, avg.value())
+        avg.add(1.0)
+        self.assertAlmostEqual(1.0, avg.value(), places=1)
+        sleep(0.05)
+        avg.add(0.0)
+        self.assertLess(avg.value(), 0.5)
+
+    def test_least_outstanding_policy(self):
+        """
+        The least-outstanding policy should choose the node with the
+        fewest requests in flight.
+        """
+        nodes = FakeClient(3).nodes
+        nodes[0]._start_request()
+        nodes[2]._start_request()
+        for i in range(10):
+            self.assertIs(nodes[1], least_outstanding_policy(nodes))
+        nodes[2]._finish_request(0.01)
+        self.assertEqual(0, nodes[2].in_flight)
+        self.assertGreater(nodes[2].latency.value(), 0)
+
+    def test_power_of_two_policy_avoids_slow_node(self):
+        """
+        The power-of-two policy should never choose the slower of two
+        nodes, and should choose the only node when given one.
+        """
+        nodes = FakeClient(2).nodes
+        nodes[0].latency.add(1.0)
+        nodes[1].latency.add(0.001)
+        for i in range(10):
+            self.assertIs(nodes[1], power_of_two_policy(nodes))
+        self.assertIs(nodes[0], power_of_two_policy(nodes[:1]))
+
     def test_stress(self):
         """
         Runs a large number of threads doing operations with elements
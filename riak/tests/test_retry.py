@@ -0,0 +1,168 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import httplib
+import platform
+from time import sleep, time
+from riak import DeadlineExceeded
+from riak.client import RiakClient
+from riak.client.retry import RetryBudget, backoff
+from riak.transports.pool import NodePool
+
+if platform.python_version() < '2.7':
+    unittest = __import__('unittest2')
+else:
+    import unittest
+
+
+class FailingTransport(object):
+    """
+    Pings fail with a retryable error on nodes named 'down'.
+    """
+    delay = 0
+
+    def __init__(self, node):
+        self._node = node
+        self.timeouts = []
+
+    def _set_timeout(self, timeout):
+        self.timeouts.append(timeout)
+
+    def ping(self):
+        sleep(self.delay)
+        if self._node.host == 'down':
+            raise httplib.BadStatusLine('')
+        return True
+
+    def get(self, robj, r=None, pr=None, timeout=None):
+        robj.timeout = timeout
+        return robj
+
+
+class FailingPool(NodePool):
+    def create_node_resource(self, node):
+        return FailingTransport(node)
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = RiakClient(nodes=[{'host': 'down'}])
+        self.client._http_pool = FailingPool(self.client)
+        self.client.retry_backoff = 0.001
+
+    def test_backoff_is_jittered_and_capped(self):
+        """
+        Backoff should stay between zero and the capped exponential
+        bound.
+        """
+        for attempt in range(1, 10):
+            wait = backoff(attempt, 0.01, 0.05)
+            self.assertGreaterEqual(wait, 0)
+            self.assertLessEqual(wait, min(0.05, 0.01 * 2 ** (attempt - 1)))
+
+    def test_retries_are_counted(self):
+        """
+        Failed requests should be retried the configured number of
+        times, drawing from the budget.
+        """
+        with self.client.retry_count(4):
+            with self.assertRaises(httplib.BadStatusLine):
+                self.client.ping()
+        budget = self.client.retry_budget
+        self.assertEqual(1, budget.requests)
+        self.assertEqual(3, budget.retries)
+        self.assertEqual(0, budget.rejected)
+
+    def test_budget_limits_retries(self):
+        """
+        Once the budget is spent, requests should fail without
+        retrying.
+        """
+        budget = RetryBudget(percent=10, min_per_second=0, max_tokens=2)
+        self.client.retry_budget = budget
+        for i in range(3):
+            with self.assertRaises(httplib.BadStatusLine):
+                self.client.ping()
+        self.assertEqual(3, budget.requests)
+        self.assertEqual(2, budget.retries)
+        self.assertEqual(2, budget.rejected)
+
+    def test_deadline_bounds_retries(self):
+        """
+        Retries should stop once the deadline has passed.
+        """
+        FailingTransport.delay = 0.01
+        self.client.retry_budget = None
+        try:
+            start = time()
+            with self.client.retry_count(1000):
+                with self.assertRaises(DeadlineExceeded):
+                    self.client.ping(deadline=50)
+            self.assertLess(time() - start, 0.5)
+        finally:
+            FailingTransport.delay = 0
+
+    def test_deadline_lowers_timeouts(self):
+        """
+        The server-side and socket timeouts should be lowered to the
+        time remaining, and restored afterwards.
+        """
+        self.client.nodes[0].host = 'up'
+        obj = self.client.bucket('deadline').new('key')
+        with self.client.deadline(100):
+            self.client.get(obj, timeout=5000)
+            self.assertLessEqual(obj.timeout, 100)
+            self.client.get(obj, None, None, 20)
+            self.assertEqual(20, obj.timeout)
+        self.client.get(obj, timeout=5000)
+        self.assertEqual(5000, obj.timeout)
+
+        transport = self.client._http_pool.elements[0].object
+        self.assertLessEqual(transport.timeouts[0], 0.1)
+        self.assertIsNone(transport.timeouts[1])
+
+    def test_deadline_bounds_pool_wait(self):
+        """
+        Waiting for a transport from an exhausted pool should stop at
+        the deadline, even without an acquire timeout.
+        """
+        self.client.nodes[0].host = 'up'
+        pool = FailingPool(self.client, max_size=1)
+        self.client._http_pool = pool
+        with pool.take():
+            start = time()
+            with self.assertRaises(DeadlineExceeded):
+                self.client.ping(deadline=50)
+            self.assertLess(time() - start, 0.5)
+        self.assertTrue(self.client.ping(deadline=50))
+
+    def test_spent_deadline_fails_fast(self):
+        """
+        No request should be made once the deadline has passed, and
+        nested deadlines should not extend it.
+        """
+        self.client.nodes[0].host = 'up'
+        with self.client.deadline(10):
+            sleep(0.02)
+            with self.client.deadline(1000):
+                with self.assertRaises(DeadlineExceeded):
+                    self.client.ping()
+        self.assertEqual([], self.client._http_pool.elements)
+
+if __name__ == '__main__':
+    unittest.main()
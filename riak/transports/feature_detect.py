@@ -35,7 +35,9 @@ class FeatureDetection(object):
     Implements boolean methods that can be checked for the presence of
     specific server-side features. Subclasses must implement the
     :meth:`_server_version` method to use this functionality, which
-    should return the server's version as a string.
+    should return the server's version as a string. The version is
+    cached on the :class:`~riak.node.RiakNode` of the transport, if
+    any, for new connections to reuse.
 
     :class:`FeatureDetection` is a parent class of
     :class:`RiakTransport <riak.transports.transport.RiakTransport>`.
@@ -178,4 +180,17 @@ class FeatureDetection(object):
 
     @lazy_property
     def server_version(self):
-        return LooseVersion(self._server_version())
+        # Detected once per node and protocol rather than once per
+        # connection, unless the node has a fixed version
+        node = getattr(self, '_node', None)
+        if node is None:
+            return LooseVersion(self._server_version())
+        if node.server_version is not None:
+            return LooseVersion(node.server_version)
+        return node.capability(
+            (self._protocol, 'server_version'),
+            lambda: LooseVersion(self._server_version()))
+
+    #: The protocol of the transport, which keys the capabilities it
+    #: detects on its node
+    _protocol = None
@@ -20,7 +20,7 @@ under the License.
 
 import httplib
 import socket
-from riak.transports.pool import Pool
+from riak.transports.pool import NodePool
 from riak.transports.http.transport import RiakHttpTransport
 
 
@@ -37,25 +37,24 @@ class NoNagleHTTPConnection(httplib.HTTPConnection):
         self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 
-class RiakHttpPool(Pool):
+class RiakHttpPool(NodePool):
     """
-    A pool of HTTP(S) transport connections.
+    A pool of HTTP(S) transport connections, with a sub-pool per
+    node.
     """
     def __init__(self, client, **options):
-        self.client = client
-        self.options = options
         if client.protocol == 'https':
             self.connection_class = httplib.HTTPSConnection
         else:
             self.connection_class = NoNagleHTTPConnection
-        super(RiakHttpPool, self).__init__()
+        super(RiakHttpPool, self).__init__(client, **options)
 
-    def create_resource(self):
-        node = self.client._choose_node()
+    def create_node_resource(self, node, **options):
+        options = dict(self._options, **options)
         return RiakHttpTransport(node=node,
-                                 client=self.client,
+                                 client=self._client,
                                  connection_class=self.connection_class,
-                                 **self.options)
+                                 **options)
 
     def destroy_resource(self, transport):
         transport.close()
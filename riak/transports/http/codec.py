@@ -27,7 +27,6 @@ import re
 import csv
 import urllib
 from cgi import parse_header
-from email import message_from_string
 from rfc822 import parsedate_tz, mktime_tz
 from xml.etree import ElementTree
 from riak import RiakError
@@ -35,8 +34,81 @@ from riak.content import RiakContent
 from riak.riak_object import VClock
 from riak.multidict import MultiDict
 from riak.transports.http.search import XMLSearchResult
+from riak.transports.http.multipart import parse_multipart
 from riak.util import decode_index_value
 
+#: Matches a link in a Link header, in the /buckets or /riak form
+LINK = re.compile(r'</(?:buckets/([^/]+)/keys/([^/]+)|[^/]+/([^/]+)/([^/]+))>;'
+                  r' ?riaktag="([^"]+)"')
+
+META_PREFIX = 'x-riak-meta-'
+INDEX_PREFIX = 'x-riak-index-'
+
+
+def _decode_content_type(codec, sibling, value):
+    sibling.content_type, sibling.charset = codec._parse_content_type(value)
+
+
+def _decode_content_encoding(codec, sibling, value):
+    sibling.content_encoding = value
+
+
+def _decode_etag(codec, sibling, value):
+    sibling.etag = value
+
+
+def _decode_links(codec, sibling, value):
+    sibling.links.extend(codec._parse_links(value))
+
+
+def _decode_last_modified(codec, sibling, value):
+    sibling.last_modified = mktime_tz(parsedate_tz(value))
+
+
+def _decode_deleted(codec, sibling, value):
+    sibling.exists = False
+
+
+def _decode_usermeta(codec, sibling, key, value):
+    sibling.usermeta[key] = value
+
+
+def _decode_index(codec, sibling, field, value):
+    if not value:
+        return
+    if '"' in value:
+        # Quoted values may contain commas
+        tokens = []
+        for line in csv.reader([value], skipinitialspace=True):
+            tokens.extend(decode_index_value(field, token) for token in line)
+    elif '_int' in field:
+        # long() ignores the spaces after the commas
+        tokens = map(long, value.split(','))
+    else:
+        tokens = [token.lstrip(' ') for token in value.split(',')]
+    # add_index checks the field name once, the rest are added directly
+    sibling.add_index(field, tokens[0])
+    sibling.indexes.update([(field, token) for token in tokens[1:]])
+
+
+#: The decoders of object metadata headers, by lowercase header name,
+#: each called with the codec, the sibling and the header value
+HEADER_DECODERS = {
+    'content-type': _decode_content_type,
+    'content-encoding': _decode_content_encoding,
+    'etag': _decode_etag,
+    'link': _decode_links,
+    'last-modified': _decode_last_modified,
+    'x-riak-deleted': _decode_deleted,
+}
+
+#: The decoders of object metadata headers with a name prefix, called
+#: with the rest of the header name before the value
+PREFIX_DECODERS = (
+    (META_PREFIX, _decode_usermeta),
+    (INDEX_PREFIX, _decode_index),
+)
+
 
 class RiakHttpCodec(object):
     """
@@ -78,14 +150,10 @@ class RiakHttpCodec(object):
         elif status == 300:
             ctype, params = parse_header(headers['content-type'])
             if ctype == 'multipart/mixed':
-                boundary = re.compile('\r?\n--%s(?:--)?\r?\n' %
-                                      re.escape(params['boundary']))
-                parts = [message_from_string(p)
-                         for p in re.split(boundary, data)[1:-1]]
+                parts = parse_multipart(data, params['boundary'])
                 robj.siblings = [self._parse_sibling(RiakContent(robj),
-                                                     part.items(),
-                                                     part.get_payload())
-                                 for part in parts]
+                                                     part_headers, body)
+                                 for part_headers, body in parts]
 
                 # Invoke sibling-resolution logic
                 if robj.resolver is not None:
@@ -111,27 +179,14 @@ class RiakHttpCodec(object):
         # Parse the headers...
         for header, value in headers:
             header = header.lower()
-            if header == 'content-type':
-                sibling.content_type, sibling.charset = \
-                    self._parse_content_type(value)
-            elif header == 'etag':
-                sibling.etag = value
-            elif header == 'link':
-                sibling.links = self._parse_links(value)
-            elif header == 'last-modified':
-                sibling.last_modified = mktime_tz(parsedate_tz(value))
-            elif header.startswith('x-riak-meta-'):
-                metakey = header.replace('x-riak-meta-', '')
-                sibling.usermeta[metakey] = value
-            elif header.startswith('x-riak-index-'):
-                field = header.replace('x-riak-index-', '')
-                reader = csv.reader([value], skipinitialspace=True)
-                for line in reader:
-                    for token in line:
-                        token = decode_index_value(field, token)
-                        sibling.add_index(field, token)
-            elif header == 'x-riak-deleted':
-                sibling.exists = False
+            decoder = HEADER_DECODERS.get(header)
+            if decoder is not None:
+                decoder(self, sibling, value)
+                continue
+            for prefix, decoder in PREFIX_DECODERS:
+                if header[:len(prefix)] == prefix:
+                    decoder(self, sibling, header[len(prefix):], value)
+                    break
 
         sibling.encoded_data = data
 
@@ -151,37 +206,38 @@ class RiakHttpCodec(object):
         return header
 
     def _parse_links(self, linkHeaders):
+        def unquote(segment):
+            if '%' in segment or '+' in segment:
+                return urllib.unquote_plus(segment)
+            return segment
+
         links = []
-        oldform = "</([^/]+)/([^/]+)/([^/]+)>; ?riaktag=\"([^\"]+)\""
-        newform = "</(buckets)/([^/]+)/keys/([^/]+)>; ?riaktag=\"([^\"]+)\""
-        for linkHeader in linkHeaders.strip().split(','):
-            linkHeader = linkHeader.strip()
-            matches = (re.match(oldform, linkHeader) or
-                       re.match(newform, linkHeader))
-            if matches is not None:
-                link = (urllib.unquote_plus(matches.group(2)),
-                        urllib.unquote_plus(matches.group(3)),
-                        urllib.unquote_plus(matches.group(4)))
-                links.append(link)
+        for match in LINK.finditer(linkHeaders):
+            new_bucket, new_key, bucket, key, tag = match.groups()
+            if new_bucket is not None:
+                bucket, key = new_bucket, new_key
+            links.append((unquote(bucket), unquote(key), unquote(tag)))
         return links
 
-    def _add_links_for_riak_object(self, robject, headers):
-        links = robject.links
-        if links:
-            current_header = ''
-            for link in links:
-                header = self._to_link_header(link)
-                if len(current_header + header) > MAX_LINK_HEADER_SIZE:
-                    headers.add('Link', current_header)
-                    current_header = ''
-
-                if current_header != '':
-                    header = ', ' + header
-                current_header += header
-
-            headers.add('Link', current_header)
-
-        return headers
+    def _link_headers(self, links):
+        """
+        Returns the values of the Link headers for the links, each
+        holding as many links as fit in MAX_LINK_HEADER_SIZE.
+        """
+        values = []
+        current = []
+        size = 0
+        for link in links:
+            header = self._to_link_header(link)
+            if current and size + len(header) > MAX_LINK_HEADER_SIZE:
+                values.append(', '.join(current))
+                current = []
+                size = 0
+            current.append(header)
+            size += len(header) + 2
+        if current:
+            values.append(', '.join(current))
+        return values
 
     def _build_put_headers(self, robj, if_none_match=False):
         """Build the headers for a POST/PUT request."""
@@ -193,30 +249,37 @@ class RiakHttpCodec(object):
         else:
             content_type = robj.content_type
 
-        headers = MultiDict({'Content-Type': content_type,
-                             'X-Riak-ClientId': self._client_id})
+        items = [('Content-Type', content_type),
+                 ('X-Riak-ClientId', self._client_id)]
+
+        if robj.content_encoding is not None:
+            items.append(('Content-Encoding', robj.content_encoding))
 
         # Add the vclock if it exists...
         if robj.vclock is not None:
-            headers['X-Riak-Vclock'] = robj.vclock.encode('base64')
+            items.append(('X-Riak-Vclock', robj.vclock.encode('base64')))
 
-        # Create the header from metadata
-        self._add_links_for_riak_object(robj, headers)
+        # Create the headers from metadata, with the values of each
+        # index field joined once
+        items.extend(('Link', value)
+                     for value in self._link_headers(robj.links))
 
-        for key, value in robj.usermeta.iteritems():
-            headers['X-Riak-Meta-%s' % key] = value
+        items.extend(('X-Riak-Meta-' + key, value)
+                     for key, value in robj.usermeta.iteritems())
 
+        fields = {}
         for field, value in robj.indexes:
-            key = 'X-Riak-Index-%s' % field
-            if key in headers:
-                headers[key] += ", " + str(value)
-            else:
-                headers[key] = str(value)
+            values = fields.get(field)
+            if values is None:
+                values = fields[field] = []
+            values.append(str(value))
+        items.extend(('X-Riak-Index-' + field, ', '.join(values))
+                     for field, values in fields.iteritems())
 
         if if_none_match:
-            headers['If-None-Match'] = '*'
+            items.append(('If-None-Match', '*'))
 
-        return headers
+        return MultiDict(items)
 
     def _normalize_json_search_response(self, json):
         """
@@ -261,3 +324,168 @@ class RiakHttpCodec(object):
         else:
             charset = None
         return content_type, charset
+
+if __name__ == '__main__':
+    # Run a benchmark of parsing fetch responses with 10 to 100
+    # siblings of 1 KB each, splitting the body with a regular
+    # expression and the email package as before and with the
+    # multipart parser. Then run a benchmark of encoding and decoding
+    # the headers of an object with 50 index entries, usermeta and
+    # links, with the previous header code and the decoder tables.
+    from email import message_from_string
+    import riak.benchmark as benchmark
+    from riak.client import RiakClient
+    from riak.transports.http.resources import RiakHttpResources
+
+    class Codec(RiakHttpResources, RiakHttpCodec):
+        resources = {'riak_kv_wm_buckets': '/buckets'}
+        _client_id = 'client'
+
+        def check_http_code(self, status, expected_statuses):
+            pass
+
+    class LegacyCodec(Codec):
+        def _parse_body(self, robj, response, expected_statuses):
+            status, headers, data = response
+            ctype, params = parse_header(headers['content-type'])
+            boundary = re.compile('\r?\n--%s(?:--)?\r?\n' %
+                                  re.escape(params['boundary']))
+            parts = [message_from_string(p)
+                     for p in re.split(boundary, data)[1:-1]]
+            robj.siblings = [self._parse_sibling(RiakContent(robj),
+                                                 part.items(),
+                                                 part.get_payload())
+                             for part in parts]
+            return robj
+
+    def siblings_response(count):
+        parts = ['\r\n--XYZ\r\n'
+                 'Content-Type: text/plain\r\n'
+                 'Etag: "etag%d"\r\n'
+                 'Last-Modified: Tue, 14 Jan 2014 10:00:00 GMT\r\n'
+                 'X-Riak-Meta-Sibling: %d\r\n'
+                 'X-Riak-Index-Field_bin: value%d\r\n'
+                 '\r\n%s' % (i, i, i, 'x' * 1024)
+                 for i in range(count)]
+        body = ''.join(parts) + '\r\n--XYZ--\r\n'
+        return (300, {'content-type': 'multipart/mixed; boundary=XYZ'},
+                body)
+
+    bucket = RiakClient().bucket('bench')
+    responses = dict((count, siblings_response(count))
+                     for count in (10, 25, 50, 100))
+
+    print "Benchmarking HTTP sibling parsing:"
+    print "  Fetches: 1000"
+    print
+
+    for b in benchmark.measure_with_rehearsal():
+        for count, response in sorted(responses.items()):
+            for name, codec in (('email', LegacyCodec()),
+                                ('multipart', Codec())):
+                with b.report('%s %d' % (name, count)):
+                    for _ in xrange(1000):
+                        codec._parse_body(bucket.new('key'), response,
+                                          [300])
+
+    class LegacyHeaderCodec(Codec):
+        def _parse_sibling(self, sibling, headers, data):
+            sibling.exists = True
+            for header, value in headers:
+                header = header.lower()
+                if header == 'content-type':
+                    sibling.content_type, sibling.charset = \
+                        self._parse_content_type(value)
+                elif header == 'etag':
+                    sibling.etag = value
+                elif header == 'link':
+                    sibling.links = self._parse_links(value)
+                elif header == 'last-modified':
+                    sibling.last_modified = mktime_tz(parsedate_tz(value))
+                elif header.startswith('x-riak-meta-'):
+                    metakey = header.replace('x-riak-meta-', '')
+                    sibling.usermeta[metakey] = value
+                elif header.startswith('x-riak-index-'):
+                    field = header.replace('x-riak-index-', '')
+                    reader = csv.reader([value], skipinitialspace=True)
+                    for line in reader:
+                        for token in line:
+                            token = decode_index_value(field, token)
+                            sibling.add_index(field, token)
+                elif header == 'x-riak-deleted':
+                    sibling.exists = False
+            sibling.encoded_data = data
+            return sibling
+
+        def _parse_links(self, linkHeaders):
+            links = []
+            oldform = "</([^/]+)/([^/]+)/([^/]+)>; ?riaktag=\"([^\"]+)\""
+            newform = ("</(buckets)/([^/]+)/keys/([^/]+)>; "
+                       "?riaktag=\"([^\"]+)\"")
+            for linkHeader in linkHeaders.strip().split(','):
+                linkHeader = linkHeader.strip()
+                matches = (re.match(oldform, linkHeader) or
+                           re.match(newform, linkHeader))
+                if matches is not None:
+                    link = (urllib.unquote_plus(matches.group(2)),
+                            urllib.unquote_plus(matches.group(3)),
+                            urllib.unquote_plus(matches.group(4)))
+                    links.append(link)
+            return links
+
+        def _build_put_headers(self, robj, if_none_match=False):
+            headers = MultiDict({'Content-Type': robj.content_type,
+                                 'X-Riak-ClientId': self._client_id})
+            if robj.vclock is not None:
+                headers['X-Riak-Vclock'] = robj.vclock.encode('base64')
+            if robj.links:
+                current_header = ''
+                for link in robj.links:
+                    header = self._to_link_header(link)
+                    if len(current_header + header) > MAX_LINK_HEADER_SIZE:
+                        headers.add('Link', current_header)
+                        current_header = ''
+                    if current_header != '':
+                        header = ', ' + header
+                    current_header += header
+                headers.add('Link', current_header)
+            for key, value in robj.usermeta.iteritems():
+                headers['X-Riak-Meta-%s' % key] = value
+            for field, value in robj.indexes:
+                key = 'X-Riak-Index-%s' % field
+                if key in headers:
+                    headers[key] += ", " + str(value)
+                else:
+                    headers[key] = str(value)
+            if if_none_match:
+                headers['If-None-Match'] = '*'
+            return headers
+
+    robj = bucket.new('key', encoded_data='x', content_type='text/plain')
+    robj.vclock = VClock('vclock' * 10, 'binary')
+    robj.usermeta = dict(('meta%d' % i, 'value%d' % i) for i in range(5))
+    for i in range(25):
+        robj.add_index('field%d_bin' % (i % 5), 'value%d' % i)
+        robj.add_index('field%d_int' % (i % 5), i)
+    for i in range(5):
+        robj.add_link(('linked', 'key%d' % i, 'tag'))
+    meta_headers = Codec()._build_put_headers(robj).items()
+    meta_headers.extend([('ETag', '"etag"'),
+                         ('Last-Modified', 'Tue, 14 Jan 2014 10:00:00 GMT')])
+
+    print
+    print "Benchmarking HTTP object metadata headers:"
+    print "   Indexes: {0}".format(len(robj.indexes))
+    print "Operations: 10000"
+    print
+
+    for b in benchmark.measure_with_rehearsal():
+        for name, codec in (('legacy', LegacyHeaderCodec()),
+                            ('tables', Codec())):
+            with b.report('%s encode' % name):
+                for _ in xrange(10000):
+                    codec._build_put_headers(robj)
+            with b.report('%s decode' % name):
+                for _ in xrange(10000):
+                    codec._parse_sibling(RiakContent(robj), meta_headers,
+                                         'x')
@@ -17,6 +17,9 @@ under the License.
 """
 
 import httplib
+import socket
+from riak.transports.http.compression import ACCEPT_ENCODING, ENCODINGS, \
+    DecompressedResponse, decompress
 
 
 class RiakHttpConnection(object):
@@ -24,25 +27,46 @@ class RiakHttpConnection(object):
     Connection and low-level request methods for RiakHttpTransport.
     """
 
-    def _request(self, method, uri, headers={}, body='', stream=False):
+    def _request(self, method, uri, headers={}, body='', stream=False,
+                 compress=False):
         """
         Given a Method, URL, Headers, and Body, perform and HTTP
         request, and return a 3-tuple containing the response status,
         response headers (as httplib.HTTPMessage), and response body.
+
+        When ``compress`` is given and compression is enabled for the
+        transport, a gzip or deflate response is accepted, and the
+        body is decompressed as it is read. This is not for object
+        requests, whose Content-Encoding is that of the stored value.
         """
         response = None
         headers.setdefault('Accept',
                            'multipart/mixed, application/json, */*;q=0.5')
+        compress = compress and self._compression
+        if compress:
+            headers = dict(headers)
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
         try:
             self._connection.request(method, uri, body, headers)
             response = self._connection.getresponse()
 
+            encoding = None
+            if compress:
+                encoding = response.getheader('content-encoding', '')
+                encoding = encoding.strip().lower()
+                if encoding not in ENCODINGS:
+                    encoding = None
+
             if stream:
                 # The caller is responsible for fully reading the
                 # response and closing it when streaming.
                 response_body = response
+                if encoding:
+                    response_body = DecompressedResponse(response, encoding)
             else:
                 response_body = response.read()
+                if encoding:
+                    response_body = decompress(response_body, encoding)
         finally:
             if response and not stream:
                 response.close()
@@ -52,10 +76,22 @@ class RiakHttpConnection(object):
     def _connect(self):
         self._connection = self._connection_class(self._node.host,
                                                   self._node.http_port)
+        if self._timeout is not None:
+            self._connection.timeout = self._timeout
+        self._connection_timeout = self._connection.timeout
         # Forces the population of stats and resources before any
-        # other requests are made.
+        # other requests are made, unless already known for the node.
         self.server_version
 
+    def _set_timeout(self, timeout):
+        if timeout is None:
+            timeout = self._connection_timeout
+        self._connection.timeout = timeout
+        if self._connection.sock:
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            self._connection.sock.settimeout(timeout)
+
     def close(self):
         """
         Closes the underlying HTTP connection.
@@ -68,3 +104,5 @@ class RiakHttpConnection(object):
     # These are set by the RiakHttpTransport initializer
     _connection_class = httplib.HTTPConnection
     _node = None
+    _compression = False
+    _timeout = None
@@ -0,0 +1,159 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+__all__ = ['MultipartParser', 'parse_multipart', 'parse_part']
+
+
+def parse_part(data, start=0, end=None):
+    """
+    Parses the part of a multipart body between the given offsets
+    into its headers and its body. Header lines are split at the
+    first colon, and continuation lines are joined to the previous
+    header.
+
+    :param data: the multipart body
+    :type data: str
+    :param start: the offset of the first header line
+    :type start: int
+    :param end: the offset after the end of the part body
+    :type end: int
+    :rtype: tuple of a list of (name, value) pairs and a str
+    """
+    if end is None:
+        end = len(data)
+    headers = []
+    pos = start
+    while pos < end:
+        eol = data.find('\n', pos, end)
+        if eol < 0:
+            eol = end
+        line_end = eol
+        if line_end > pos and data[line_end - 1] == '\r':
+            line_end -= 1
+        if line_end == pos:
+            # The blank line before the body
+            return headers, data[eol + 1:end]
+        if data[pos] in ' \t' and headers:
+            name, value = headers[-1]
+            headers[-1] = (name,
+                           value + ' ' + data[pos:line_end].strip())
+        else:
+            colon = data.find(':', pos, line_end)
+            if colon >= 0:
+                headers.append((data[pos:colon].strip(),
+                                data[colon + 1:line_end].strip()))
+        pos = eol + 1
+    return headers, ''
+
+
+def parse_multipart(data, boundary):
+    """
+    Splits a complete ``multipart/mixed`` body into its parts,
+    parsed by :func:`parse_part`. Parts after the last delimiter,
+    which are unterminated, are left out.
+
+    :param data: the body
+    :type data: str
+    :param boundary: the boundary parameter of the content type
+    :type boundary: str
+    :rtype: list of (headers, body) tuples
+    """
+    parts, _, _ = MultipartParser(boundary)._split(data)
+    return parts
+
+
+class MultipartParser(object):
+    """
+    Splits a ``multipart/mixed`` body into parts as it is fed, such
+    as a streaming response. Delimiters are found by offset, and only
+    looked for in the data that was just fed and the few bytes before
+    it. The data of a part is joined once, when its closing delimiter
+    has arrived, so that the work is linear in the size of the body.
+    """
+
+    def __init__(self, boundary):
+        """
+        :param boundary: the boundary parameter of the content type
+        :type boundary: str
+        """
+        self._delimiter = '\n--' + boundary
+        self._pending = []
+        self._tail = ''
+        # Whether a delimiter may be in the pending data: the first one
+        # needs no preceding newline, and one may be awaiting the end
+        # of its line
+        self._waiting = True
+        self._started = False
+        #: Whether the closing delimiter was found
+        self.done = False
+
+    def feed(self, data):
+        """
+        Adds data to the body, returning the parts which it completes,
+        parsed by :func:`parse_part`.
+
+        :param data: the next data of the body
+        :type data: str
+        :rtype: list of (headers, body) tuples
+        """
+        if self.done or not data:
+            return []
+        window = self._tail + data
+        self._pending.append(data)
+        self._tail = window[1 - len(self._delimiter):]
+        if not self._waiting and self._delimiter not in window:
+            return []
+
+        buffer = ''.join(self._pending)
+        parts, pos, self._waiting = self._split(buffer)
+        rest = buffer[pos:]
+        self._pending = [rest]
+        self._tail = rest[1 - len(self._delimiter):]
+        return parts
+
+    def _split(self, buffer):
+        """
+        Splits the parts out of the buffer, returning them, the offset
+        after the last complete one, and whether a delimiter may
+        follow that offset.
+        """
+        delimiter = self._delimiter
+        parts = []
+        pos = 0
+        while not self.done:
+            if not self._started and buffer.startswith(delimiter[1:]):
+                # The first delimiter, at the very start of the body
+                index = -1
+            else:
+                index = buffer.find(delimiter, pos)
+                if index < 0:
+                    return parts, pos, not self._started
+            after = index + len(delimiter)
+            eol = buffer.find('\n', after)
+            if eol < 0:
+                # Whether this is the closing delimiter is not known yet
+                return parts, pos, True
+            if self._started:
+                end = index
+                if end > pos and buffer[end - 1] == '\r':
+                    end -= 1
+                parts.append(parse_part(buffer, pos, end))
+            self._started = True
+            self.done = buffer.startswith('--', after)
+            pos = eol + 1
+        return parts, len(buffer), False
@@ -171,7 +171,10 @@ class RiakHttpResources(object):
 
     @lazy_property
     def resources(self):
-        return self.get_resources()
+        if self._node is None:
+            return self.get_resources()
+        return self._node.capability(('http', 'resources'),
+                                     self.get_resources)
 
 
 def mkpath(*segments, **query):
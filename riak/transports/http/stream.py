@@ -17,15 +17,20 @@ under the License.
 """
 
 import json
-import string
 import re
+from collections import deque
 from cgi import parse_header
-from email import message_from_string
 from riak.util import decode_index_value
 from riak.client.index_page import CONTINUATION
+from riak.transports.http.multipart import MultipartParser
 from riak import RiakError
 
 
+#: Skips JSON text other than braces, including whole strings, up to
+#: the next brace or the opening quote of an unterminated string
+JSON_SKIP = re.compile(r'(?:[^{}"]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+
+
 class RiakHttpStream(object):
     """
     Base class for HTTP streaming iterators.
@@ -33,8 +38,16 @@ class RiakHttpStream(object):
 
     BLOCK_SIZE = 2048
 
-    def __init__(self, response):
+    def __init__(self, response, block_size=None):
+        """
+        :param response: the response to read
+        :type response: httplib.HTTPResponse
+        :param block_size: the number of bytes to read at a time,
+            defaults to :attr:`BLOCK_SIZE`
+        :type block_size: int
+        """
         self.response = response
+        self.block_size = block_size or self.BLOCK_SIZE
         self.buffer = ''
         self.response_done = False
 
@@ -42,7 +55,7 @@ class RiakHttpStream(object):
         return self
 
     def _read(self):
-        chunk = self.response.read(self.BLOCK_SIZE)
+        chunk = self.response.read(self.block_size)
         if chunk == '':
             self.response_done = True
         self.buffer += chunk
@@ -55,20 +68,86 @@ class RiakHttpStream(object):
 
 
 class RiakHttpJsonStream(RiakHttpStream):
+    """
+    Streaming iterator for a sequence of JSON objects over HTTP, such
+    as ``{"keys":[...]}{"keys":[...]}``. The objects are split by
+    matching braces outside of strings, so keys may contain braces.
+    Scanning resumes where it stopped when more is read, and the
+    scanned part of an unfinished object is set aside instead of being
+    copied on every read, so that the work is linear in the size of
+    the response.
+    """
+
+    # Larger blocks take fewer reads and scans of the response, at the
+    # cost of waiting for a full block when objects arrive slowly
+    BLOCK_SIZE = 65536
+
     _json_field = None
 
+    def __init__(self, response, block_size=None):
+        super(RiakHttpJsonStream, self).__init__(response, block_size)
+        # Where scanning resumes in the buffer and the nesting depth
+        # there, where the unfinished object starts in the buffer, and
+        # its parts that were read before
+        self._pos = 0
+        self._depth = 0
+        self._start = 0
+        self._parts = []
+
     def next(self):
-        while '}' not in self.buffer and not self.response_done:
+        while True:
+            end = self._scan()
+            if end is not None:
+                chunk = self.buffer[self._start:end]
+                if self._parts:
+                    self._parts.append(chunk)
+                    chunk = ''.join(self._parts)
+                    self._parts = []
+                return json.loads(chunk)[self._json_field]
+            elif self.response_done:
+                raise StopIteration
             self._read()
 
-        if '}' in self.buffer:
-            idx = string.index(self.buffer, '}') + 1
-            chunk = self.buffer[:idx]
-            self.buffer = self.buffer[idx:]
-            field = json.loads(chunk)[self._json_field]
-            return field
-        else:
-            raise StopIteration
+    def _read(self):
+        # Only an unterminated string is left to scan again
+        if self._depth:
+            self._parts.append(self.buffer[self._start:self._pos])
+        self.buffer = self.buffer[self._pos:]
+        self._pos = self._start = 0
+        super(RiakHttpJsonStream, self)._read()
+
+    def _scan(self):
+        """
+        Scans the buffer from where the last scan stopped, returning
+        the offset after the end of the next complete object, or None
+        if it has not been read in full.
+
+        :rtype: int
+        """
+        buffer = self.buffer
+        size = len(buffer)
+        depth = self._depth
+        pos = self._pos
+        while True:
+            pos = JSON_SKIP.match(buffer, pos).end()
+            if pos == size:
+                break
+            char = buffer[pos]
+            if char == '"':
+                # Unterminated string, scanned again after a read
+                break
+            elif char == '{':
+                if depth == 0:
+                    self._start = pos
+                depth += 1
+            elif depth:
+                depth -= 1
+                if depth == 0:
+                    self._pos, self._depth = pos + 1, 0
+                    return pos + 1
+            pos += 1
+        self._pos, self._depth = pos, depth
+        return None
 
 
 class RiakHttpKeyStream(RiakHttpJsonStream):
@@ -87,46 +166,26 @@ class RiakHttpBucketStream(RiakHttpJsonStream):
 
 class RiakHttpMultipartStream(RiakHttpStream):
     """
-    Streaming iterator for multipart messages over HTTP
+    Streaming iterator for multipart messages over HTTP, returning the
+    headers and body of each part, see
+    :class:`~riak.transports.http.multipart.MultipartParser`.
     """
     def __init__(self, response):
         super(RiakHttpMultipartStream, self).__init__(response)
         ctypehdr = response.getheader('content-type')
         _, params = parse_header(ctypehdr)
-        self.boundary_re = re.compile('\r?\n--%s(?:--)?\r?\n' %
-                                      re.escape(params['boundary']))
-        self.next_boundary = None
-        self.seen_first = False
+        self.parser = MultipartParser(params['boundary'])
+        self.parts = deque()
 
     def next(self):
-        # multipart/mixed starts with a boundary, then the first part.
-        if not self.seen_first:
-            self.read_until_boundary()
-            self.advance_buffer()
-            self.seen_first = True
-
-        self.read_until_boundary()
-
-        if self.next_boundary:
-            part = self.advance_buffer()
-            message = message_from_string(part)
-            return message
-        else:
-            raise StopIteration
-
-    def try_match(self):
-        self.next_boundary = self.boundary_re.search(self.buffer)
-        return self.next_boundary
-
-    def advance_buffer(self):
-        part = self.buffer[:self.next_boundary.start()]
-        self.buffer = self.buffer[self.next_boundary.end():]
-        self.next_boundary = None
-        return part
-
-    def read_until_boundary(self):
-        while not self.try_match() and not self.response_done:
-            self._read()
+        while not self.parts:
+            if self.response_done or self.parser.done:
+                raise StopIteration
+            chunk = self.response.read(self.block_size)
+            if chunk == '':
+                self.response_done = True
+            self.parts.extend(self.parser.feed(chunk))
+        return self.parts.popleft()
 
 
 class RiakHttpMapReduceStream(RiakHttpMultipartStream):
@@ -135,8 +194,8 @@ class RiakHttpMapReduceStream(RiakHttpMultipartStream):
     """
 
     def next(self):
-        message = super(RiakHttpMapReduceStream, self).next()
-        payload = json.loads(message.get_payload())
+        _, body = super(RiakHttpMapReduceStream, self).next()
+        payload = json.loads(body)
         return payload['phase'], payload['data']
 
 
@@ -151,8 +210,8 @@ class RiakHttpIndexStream(RiakHttpMultipartStream):
         self.return_terms = return_terms
 
     def next(self):
-        message = super(RiakHttpIndexStream, self).next()
-        payload = json.loads(message.get_payload())
+        _, body = super(RiakHttpIndexStream, self).next()
+        payload = json.loads(body)
         if u'error' in payload:
             raise RiakError(payload[u'error'])
         elif u'keys' in payload:
@@ -166,3 +225,49 @@ class RiakHttpIndexStream(RiakHttpMultipartStream):
 
     def _decode_pair(self, pair):
         return (decode_index_value(self.index, pair[0]), pair[1])
+
+if __name__ == '__main__':
+    # Run a benchmark of streaming a million keys from an in-memory
+    # response, in objects of 10000 and of 100000 keys, with the
+    # previous splitter that searched the whole buffer for '}' and
+    # with the incremental one, at the old and new block sizes.
+    from cStringIO import StringIO
+    import riak.benchmark as benchmark
+
+    class LegacyKeyStream(RiakHttpStream):
+        def next(self):
+            while '}' not in self.buffer and not self.response_done:
+                self._read()
+
+            if '}' in self.buffer:
+                idx = self.buffer.index('}') + 1
+                chunk = self.buffer[:idx]
+                self.buffer = self.buffer[idx:]
+                return json.loads(chunk)[u'keys']
+            else:
+                raise StopIteration
+
+    keys = ['key%07d' % i for i in xrange(1000000)]
+    bodies = {}
+    for size in (10000, 100000):
+        bodies[size] = ''.join(json.dumps({'keys': keys[i:i + size]})
+                               for i in xrange(0, len(keys), size))
+
+    def stream_all(stream_class, body, block_size):
+        count = 0
+        for chunk in stream_class(StringIO(body), block_size):
+            count += len(chunk)
+        assert count == len(keys)
+
+    print "Benchmarking HTTP key streams:"
+    print "      Keys: {0}".format(len(keys))
+    print
+
+    for b in benchmark.measure_with_rehearsal():
+        for size, body in sorted(bodies.items()):
+            with b.report('legacy %dk/2k' % (size / 1000)):
+                stream_all(LegacyKeyStream, body, 2048)
+            with b.report('new %dk/2k' % (size / 1000)):
+                stream_all(RiakHttpKeyStream, body, 2048)
+            with b.report('new %dk/64k' % (size / 1000)):
+                stream_all(RiakHttpKeyStream, body, 65536)
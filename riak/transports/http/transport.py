@@ -47,13 +47,32 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
     connect to Riak via HTTP.
     """
 
+    _protocol = 'http'
+
     def __init__(self, node=None,
                  client=None,
                  connection_class=httplib.HTTPConnection,
                  client_id=None,
+                 stream_block_size=None,
+                 compression=False,
+                 timeout=None,
                  **unused_options):
         """
         Construct a new HTTP connection to Riak.
+
+        :param stream_block_size: the number of bytes to read at a
+            time from streaming key and bucket lists, defaults to
+            :attr:`RiakHttpJsonStream.BLOCK_SIZE
+            <riak.transports.http.stream.RiakHttpJsonStream.BLOCK_SIZE>`
+        :type stream_block_size: int
+        :param compression: whether to accept gzip or deflate
+            compressed responses to requests other than those for
+            objects, such as key lists, MapReduce and secondary index
+            queries, trading CPU time for bandwidth
+        :type compression: bool
+        :param timeout: the socket timeout in seconds for connecting
+            and for each response, by default that of :mod:`httplib`
+        :type timeout: float
         """
         super(RiakHttpTransport, self).__init__()
 
@@ -61,6 +80,9 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         self._node = node
         self._connection_class = connection_class
         self._client_id = client_id
+        self._stream_block_size = stream_block_size
+        self._compression = compression
+        self._timeout = timeout
         if not self._client_id:
             self._client_id = self.make_random_client_id()
         self._connect()
@@ -129,8 +151,10 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         params = {'returnbody': return_body, 'w': w, 'dw': dw, 'pw': pw,
                   'timeout': timeout}
         url = self.object_path(robj.bucket.name, robj.key, **params)
-        headers = self._build_put_headers(robj, if_none_match=if_none_match)
+        # The value is encoded first, as that may compress it and set
+        # the Content-Encoding header
         content = bytearray(robj.encoded_data)
+        headers = self._build_put_headers(robj, if_none_match=if_none_match)
 
         if robj.key is None:
             expect = [201]
@@ -168,7 +192,7 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         Fetch a list of keys for the bucket
         """
         url = self.key_list_path(bucket.name, timeout=timeout)
-        status, _, body = self._request('GET', url)
+        status, _, body = self._request('GET', url, compress=True)
 
         if status == 200:
             props = json.loads(body)
@@ -178,10 +202,11 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
 
     def stream_keys(self, bucket, timeout=None):
         url = self.key_list_path(bucket.name, keys='stream', timeout=timeout)
-        status, headers, response = self._request('GET', url, stream=True)
+        status, headers, response = self._request('GET', url, stream=True,
+                                                  compress=True)
 
         if status == 200:
-            return RiakHttpKeyStream(response)
+            return RiakHttpKeyStream(response, self._stream_block_size)
         else:
             raise RiakError('Error listing keys.')
 
@@ -190,7 +215,7 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         Fetch a list of all buckets
         """
         url = self.bucket_list_path(timeout=timeout)
-        status, headers, body = self._request('GET', url)
+        status, headers, body = self._request('GET', url, compress=True)
 
         if status == 200:
             props = json.loads(body)
@@ -208,10 +233,11 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
                                       self.server_version.vstring)
 
         url = self.bucket_list_path(buckets="stream", timeout=timeout)
-        status, headers, response = self._request('GET', url, stream=True)
+        status, headers, response = self._request('GET', url, stream=True,
+                                                  compress=True)
 
         if status == 200:
-            return RiakHttpBucketStream(response)
+            return RiakHttpBucketStream(response, self._stream_block_size)
         else:
             raise RiakError('Error listing buckets.')
 
@@ -272,7 +298,8 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         # Do the request...
         url = self.mapred_path()
         headers = {'Content-Type': 'application/json'}
-        status, headers, body = self._request('POST', url, headers, content)
+        status, headers, body = self._request('POST', url, headers, content,
+                                              compress=True)
 
         # Make sure the expected status code came back...
         if status != 200:
@@ -289,7 +316,8 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
         url = self.mapred_path(chunked=True)
         reqheaders = {'Content-Type': 'application/json'}
         status, headers, response = self._request('POST', url, reqheaders,
-                                                  content, stream=True)
+                                                  content, stream=True,
+                                                  compress=True)
 
         if status == 200:
             return RiakHttpMapReduceStream(response)
@@ -317,7 +345,7 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
                   'term_regex': term_regex}
 
         url = self.index_path(bucket, index, startkey, endkey, **params)
-        status, headers, body = self._request('GET', url)
+        status, headers, body = self._request('GET', url, compress=True)
         self.check_http_code(status, [200])
         json_data = json.loads(body)
         if return_terms and u'results' in json_data:
@@ -356,7 +384,8 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
                   'max_results': max_results, 'continuation': continuation,
                   'timeout': timeout, 'term_regex': term_regex}
         url = self.index_path(bucket, index, startkey, endkey, **params)
-        status, headers, response = self._request('GET', url, stream=True)
+        status, headers, response = self._request('GET', url, stream=True,
+                                                  compress=True)
 
         if status == 200:
             return RiakHttpIndexStream(response, index, return_terms)
@@ -377,7 +406,7 @@ class RiakHttpTransport(RiakHttpConnection, RiakHttpResources, RiakHttpCodec,
 
         options.update(params)
         url = self.solr_select_path(index, query, **options)
-        status, headers, data = self._request('GET', url)
+        status, headers, data = self._request('GET', url, compress=True)
         self.check_http_code(status, [200])
         if 'json' in headers['content-type']:
             results = json.loads(data)
@@ -21,24 +21,24 @@ under the License.
 
 import errno
 import socket
-from riak.transports.pool import Pool
+from riak.transports.pool import NodePool
 from riak.transports.pbc.transport import RiakPbcTransport
 
 
-class RiakPbcPool(Pool):
+class RiakPbcPool(NodePool):
     """
-    A resource pool of PBC transports.
+    A resource pool of PBC transports, with a sub-pool per node.
     """
-    def __init__(self, client, **options):
-        super(RiakPbcPool, self).__init__()
-        self._client = client
-        self._options = options
-
-    def create_resource(self):
-        node = self._client._choose_node()
+    def create_node_resource(self, node, **options):
+        options = dict(self._options, **options)
         return RiakPbcTransport(node=node,
                                 client=self._client,
-                                **self._options)
+                                **options)
+
+    def warm_resource(self, pbc):
+        # Connect and detect the server version up front
+        pbc._connect()
+        pbc.server_version
 
     def destroy_resource(self, pbc):
         pbc.close()
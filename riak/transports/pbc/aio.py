@@ -0,0 +1,240 @@
+"""
+Copyright 2013 Basho Technologies, Inc.
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import json
+import struct
+import trollius as asyncio
+from trollius import From, Return
+from distutils.version import LooseVersion
+import riak_pb
+from riak.transports.pbc.transport import RiakPbcTransport
+from riak_pb.messages import (
+    MSG_CODE_GET_SERVER_INFO_REQ,
+    MSG_CODE_GET_SERVER_INFO_RESP,
+    MSG_CODE_GET_REQ,
+    MSG_CODE_GET_RESP,
+    MSG_CODE_PUT_REQ,
+    MSG_CODE_PUT_RESP,
+    MSG_CODE_DEL_REQ,
+    MSG_CODE_DEL_RESP,
+    MSG_CODE_LIST_KEYS_REQ,
+    MSG_CODE_LIST_KEYS_RESP,
+    MSG_CODE_MAP_RED_REQ,
+    MSG_CODE_MAP_RED_RESP,
+    MSG_CODE_INDEX_REQ,
+    MSG_CODE_INDEX_RESP
+)
+
+__all__ = ['AsyncRiakPbcTransport', 'AsyncKeyStream']
+
+
+class AsyncRiakPbcTransport(RiakPbcTransport):
+    """
+    The Protocol Buffers transport over trollius (asyncio) streams.
+    Requests are built and responses decoded as in
+    :class:`~riak.transports.pbc.RiakPbcTransport`, but the operations
+    below are coroutines. Used by
+    :class:`~riak.client.aio.AsyncRiakClient`.
+    """
+
+    def __init__(self, node=None, client=None, loop=None, **options):
+        """
+        Takes the options of
+        :class:`~riak.transports.pbc.RiakPbcTransport`, and the event
+        loop to use.
+        """
+        super(AsyncRiakPbcTransport, self).__init__(node=node,
+                                                    client=client,
+                                                    **options)
+        self._loop = loop
+        self._reader = None
+        self._writer = None
+
+    @asyncio.coroutine
+    def connect(self):
+        """
+        Connects to the node and detects its server version, which the
+        request builders need, unless it is known for the node.
+        """
+        if self._writer is not None:
+            return
+        host, port = self._address
+        self._reader, self._writer = yield From(asyncio.wait_for(
+            asyncio.open_connection(host, port, loop=self._loop),
+            self._connect_timeout or self._timeout, loop=self._loop))
+        # Unlike the blocking transport, the options can only be set
+        # once connected.
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            self._set_socket_options(sock)
+
+        # As for blocking connections, the version is detected once
+        # per node, unless fixed
+        node = self._node
+        if node.server_version is not None:
+            self.server_version = LooseVersion(node.server_version)
+            return
+        key = (self._protocol, 'server_version')
+        version = node.capability(key)
+        if version is None:
+            msg_code, resp = yield From(self._call(
+                MSG_CODE_GET_SERVER_INFO_REQ, None,
+                MSG_CODE_GET_SERVER_INFO_RESP))
+            version = LooseVersion(resp.server_version)
+            node.remember_capability(key, version)
+        self.server_version = version
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    @asyncio.coroutine
+    def _call(self, msg_code, msg=None, expect=None):
+        self._writer.write(self._encode_msg(msg_code, msg))
+        yield From(self._writer.drain())
+        result = yield From(self._read(expect))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def _read(self, expect=None):
+        header = yield From(self._reader.readexactly(4))
+        msglen, = struct.unpack('!i', header)
+        data = yield From(self._reader.readexactly(msglen))
+        raise Return(self._decode_msg(ord(data[0]), buffer(data, 1),
+                                      expect))
+
+    @asyncio.coroutine
+    def get(self, robj, r=None, pr=None, timeout=None):
+        req = self._get_req(robj, r=r, pr=pr, timeout=timeout)
+        msg_code, resp = yield From(self._call(MSG_CODE_GET_REQ, req,
+                                               MSG_CODE_GET_RESP))
+        raise Return(self._get_resp(robj, resp))
+
+    @asyncio.coroutine
+    def put(self, robj, w=None, dw=None, pw=None, return_body=True,
+            if_none_match=False, timeout=None):
+        req = self._put_req(robj, w=w, dw=dw, pw=pw,
+                            return_body=return_body,
+                            if_none_match=if_none_match, timeout=timeout)
+        msg_code, resp = yield From(self._call(MSG_CODE_PUT_REQ, req,
+                                               MSG_CODE_PUT_RESP))
+        raise Return(self._put_resp(robj, resp))
+
+    @asyncio.coroutine
+    def delete(self, robj, rw=None, r=None, w=None, dw=None, pr=None,
+               pw=None, timeout=None):
+        req = self._delete_req(robj, rw=rw, r=r, w=w, dw=dw, pr=pr, pw=pw,
+                               timeout=timeout)
+        yield From(self._call(MSG_CODE_DEL_REQ, req, MSG_CODE_DEL_RESP))
+        raise Return(self._delete_resp(robj, None))
+
+    @asyncio.coroutine
+    def get_index(self, bucket, index, startkey, endkey=None,
+                  return_terms=None, max_results=None, continuation=None,
+                  timeout=None, term_regex=None):
+        if not self.pb_indexes():
+            raise NotImplementedError("Secondary indexes are not supported "
+                                      "over Protocol Buffers")
+        req = self._get_index_req(bucket, index, startkey, endkey,
+                                  return_terms, max_results, continuation,
+                                  timeout, term_regex)
+        msg_code, resp = yield From(self._call(MSG_CODE_INDEX_REQ, req,
+                                               MSG_CODE_INDEX_RESP))
+        raise Return(self._get_index_resp(index, return_terms,
+                                          max_results, resp))
+
+    @asyncio.coroutine
+    def mapred(self, inputs, query, timeout=None):
+        req = self._mapred_req(inputs, query, timeout)
+        self._writer.write(self._encode_msg(MSG_CODE_MAP_RED_REQ, req))
+        yield From(self._writer.drain())
+
+        phases = []
+        while True:
+            msg_code, resp = yield From(self._read(MSG_CODE_MAP_RED_RESP))
+            if resp.HasField('response'):
+                phases.append((resp.phase, json.loads(resp.response)))
+            if resp.done:
+                break
+        raise Return(self._mapred_result(phases))
+
+    @asyncio.coroutine
+    def stream_keys(self, bucket, timeout=None):
+        req = riak_pb.RpbListKeysReq()
+        req.bucket = bucket.name
+        if self.client_timeouts() and timeout:
+            req.timeout = timeout
+        self._writer.write(self._encode_msg(MSG_CODE_LIST_KEYS_REQ, req))
+        yield From(self._writer.drain())
+
+
+class AsyncKeyStream(object):
+    """
+    The lists of keys of a bucket, as they arrive. Python 2 has no
+    asynchronous iteration, so each list is read with the
+    :meth:`next` coroutine, which returns None at the end::
+
+        stream = yield From(client.stream_keys(bucket))
+        while True:
+            keys = yield From(stream.next())
+            if keys is None:
+                break
+            ...
+
+    The connection is returned to the pool at the end of the stream,
+    or closed by :meth:`close` if the stream is left unfinished.
+    """
+
+    def __init__(self, transport, done):
+        self._transport = transport
+        self._done = done
+        self.finished = False
+
+    @asyncio.coroutine
+    def next(self):
+        """
+        Returns the next list of keys, or None at the end.
+
+        :rtype: list
+        """
+        while not self.finished:
+            try:
+                msg_code, resp = yield From(self._transport._read(
+                    MSG_CODE_LIST_KEYS_RESP))
+            except BaseException:
+                self.close()
+                raise
+            if resp.done:
+                self.finished = True
+                self._done(self._transport, True)
+            if len(resp.keys) > 0:
+                raise Return(resp.keys[:])
+        raise Return(None)
+
+    def close(self):
+        """
+        Stops reading the stream. The connection is closed if the
+        stream is unfinished.
+        """
+        if not self.finished:
+            self.finished = True
+            self._done(self._transport, False)
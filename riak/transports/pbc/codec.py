@@ -55,6 +55,120 @@ MODFUN_PROPS = ['chash_keyfun', 'linkfun']
 QUORUM_PROPS = ['r', 'pr', 'w', 'pw', 'dw', 'rw']
 
 
+def _decode_link(link):
+    if link.HasField("bucket"):
+        bucket = link.bucket
+    else:
+        bucket = None
+    if link.HasField("key"):
+        key = link.key
+    else:
+        key = None
+    if link.HasField("tag"):
+        tag = link.tag
+    else:
+        tag = None
+
+    return (bucket, key, tag)
+
+
+def _decode_links(rpb_content):
+    return [_decode_link(link) for link in rpb_content.links]
+
+
+def _decode_last_modified(rpb_content):
+    if rpb_content.HasField("last_mod"):
+        last_modified = float(rpb_content.last_mod)
+        if rpb_content.HasField("last_mod_usecs"):
+            last_modified += rpb_content.last_mod_usecs / 1000000.0
+        return last_modified
+    else:
+        return None
+
+
+def _decode_usermeta(rpb_content):
+    return dict([(usermd.key, usermd.value)
+                 for usermd in rpb_content.usermeta])
+
+
+def _decode_indexes(rpb_content):
+    return set([(index.key, decode_index_value(index.key, index.value))
+                for index in rpb_content.indexes])
+
+
+class _lazy_metadata(object):
+    """
+    A field of :class:`RiakPbcContent` that is decoded from the
+    RpbContent message on first access, unless it was set before.
+    """
+    def __init__(self, name, decode):
+        self.name = name
+        self.decode = decode
+
+    def __get__(self, sibling, owner):
+        if sibling is None:
+            return self
+        try:
+            return sibling.__dict__[self.name]
+        except KeyError:
+            value = self.decode(sibling._rpb_content)
+            self.__set__(sibling, value)
+            return value
+
+    def __set__(self, sibling, value):
+        sibling.__dict__[self.name] = value
+        # The message is no longer needed once every field is known
+        if sibling._rpb_content is not None and \
+                all(name in sibling.__dict__
+                    for name in RiakPbcContent.LAZY_FIELDS):
+            sibling._rpb_content = None
+
+
+class RiakPbcContent(RiakContent):
+    """
+    A sibling fetched over Protocol Buffers. The links, user metadata,
+    indexes and last-modified time are only decoded from the RpbContent
+    message when first used, as most fetches only need the value.
+    Otherwise it behaves like any other
+    :class:`~riak.content.RiakContent`.
+
+    The message is not modified, as it belongs to the caller, but the
+    reference to it is dropped once all of the lazy fields have been
+    decoded or set.
+    """
+    #: The fields decoded from the message on first access
+    LAZY_FIELDS = ('links', 'last_modified', 'usermeta', 'indexes')
+
+    def __init__(self, robject, rpb_content):
+        self._robject = robject
+        self._rpb_content = rpb_content
+        self._data = None
+        self._encoded_data = rpb_content.value
+        self.exists = not (rpb_content.HasField("deleted") and
+                           rpb_content.deleted)
+        if rpb_content.HasField("content_type"):
+            self.content_type = rpb_content.content_type
+        else:
+            self.content_type = 'application/json'
+        if rpb_content.HasField("charset"):
+            self.charset = rpb_content.charset
+        else:
+            self.charset = None
+        if rpb_content.HasField("content_encoding"):
+            self.content_encoding = rpb_content.content_encoding
+        else:
+            self.content_encoding = None
+        if rpb_content.HasField("vtag"):
+            self.etag = rpb_content.vtag
+        else:
+            self.etag = None
+
+    links = _lazy_metadata('links', _decode_links)
+    last_modified = _lazy_metadata('last_modified', _decode_last_modified)
+    usermeta = _lazy_metadata('usermeta', _decode_usermeta)
+    indexes = _lazy_metadata('indexes', _decode_indexes)
+
+
 class RiakPbcCodec(object):
     """
     Protobuffs Encoding and decoding methods for RiakPbcTransport.
@@ -106,8 +220,7 @@ class RiakPbcCodec(object):
         :type obj: RiakObject
         :rtype RiakObject
         """
-        obj.siblings = [self._decode_content(c, RiakContent(obj))
-                        for c in contents]
+        obj.siblings = [RiakPbcContent(obj, c) for c in contents]
         # Invoke sibling-resolution logic
         if len(obj.siblings) > 1 and obj.resolver is not None:
             obj.resolver(obj)
@@ -116,7 +229,9 @@ class RiakPbcCodec(object):
     def _decode_content(self, rpb_content, sibling):
         """
         Decodes a single sibling from the protobuf representation into
-        a RiakObject.
+        a RiakObject, eagerly. Fetched objects use
+        :class:`RiakPbcContent` instead, which decodes the metadata on
+        first access.
 
         :param rpb_content: a single RpbContent message
         :type rpb_content: riak_pb.RpbContent
@@ -138,18 +253,10 @@ class RiakPbcCodec(object):
         if rpb_content.HasField("vtag"):
             sibling.etag = rpb_content.vtag
 
-        sibling.links = [self._decode_link(link)
-                         for link in rpb_content.links]
-        if rpb_content.HasField("last_mod"):
-            sibling.last_modified = float(rpb_content.last_mod)
-            if rpb_content.HasField("last_mod_usecs"):
-                sibling.last_modified += rpb_content.last_mod_usecs / 1000000.0
-
-        sibling.usermeta = dict([(usermd.key, usermd.value)
-                                 for usermd in rpb_content.usermeta])
-        sibling.indexes = set([(index.key,
-                                decode_index_value(index.key, index.value))
-                               for index in rpb_content.indexes])
+        sibling.links = _decode_links(rpb_content)
+        sibling.last_modified = _decode_last_modified(rpb_content)
+        sibling.usermeta = _decode_usermeta(rpb_content)
+        sibling.indexes = _decode_indexes(rpb_content)
 
         sibling.encoded_data = rpb_content.value
 
@@ -165,6 +272,14 @@ class RiakPbcCodec(object):
         :param rpb_content: the protobuf message to fill
         :type rpb_content: riak_pb.RpbContent
         """
+        # Avoid the call for values that are strings already, which
+        # is nearly all of them. The value is encoded first, as that
+        # may compress it and set its content encoding.
+        value = robj.encoded_data
+        if type(value) is not str:
+            value = str(value)
+        rpb_content.value = value
+
         if robj.content_type:
             rpb_content.content_type = robj.content_type
         if robj.charset:
@@ -194,8 +309,6 @@ class RiakPbcCodec(object):
             pair.key = field
             pair.value = str(value)
 
-        rpb_content.value = str(robj.encoded_data)
-
     def _decode_link(self, link):
         """
         Decodes an RpbLink message into a tuple
@@ -204,21 +317,7 @@ class RiakPbcCodec(object):
         :type link: riak_pb.RpbLink
         :rtype tuple
         """
-
-        if link.HasField("bucket"):
-            bucket = link.bucket
-        else:
-            bucket = None
-        if link.HasField("key"):
-            key = link.key
-        else:
-            key = None
-        if link.HasField("tag"):
-            tag = link.tag
-        else:
-            tag = None
-
-        return (bucket, key, tag)
+        return _decode_link(link)
 
     def _decode_index_value(self, index, value):
         """
@@ -437,3 +536,62 @@ class RiakPbcCodec(object):
         if index.HasField('n_val'):
             result['n_val'] = index.n_val
         return result
+
+
+if __name__ == '__main__':
+    # Run a benchmark of decoding fetched objects with many indexes
+    # and links, eagerly as before and lazily, both when only the
+    # value is used and when all of the metadata is.
+    import riak.benchmark as benchmark
+    from riak.client import RiakClient
+
+    def get_resp(siblings):
+        resp = riak_pb.RpbGetResp(vclock='vclock')
+        for i in range(siblings):
+            content = resp.content.add(value='{"value": %d}' % i,
+                                       content_type='application/json',
+                                       vtag='vtag%d' % i,
+                                       last_mod=1380000000,
+                                       last_mod_usecs=i)
+            for j in range(50):
+                content.indexes.add(key='field%d_int' % j, value=str(j))
+                content.indexes.add(key='field%d_bin' % j, value='v%d' % j)
+            for j in range(20):
+                content.links.add(bucket='bucket', key='key%d' % j,
+                                  tag='tag')
+            for j in range(10):
+                content.usermeta.add(key='meta%d' % j, value='value')
+        return resp
+
+    def decode_eager(codec, robj, resp):
+        robj.siblings = [codec._decode_content(c, RiakContent(robj))
+                         for c in resp.content]
+
+    def decode_lazy(codec, robj, resp):
+        codec._decode_contents(resp.content, robj)
+
+    def use_data(robj):
+        for sibling in robj.siblings:
+            sibling.data
+
+    def use_all(robj):
+        for sibling in robj.siblings:
+            sibling.data, sibling.links, sibling.usermeta, \
+                sibling.indexes, sibling.last_modified
+
+    codec = RiakPbcCodec()
+    robj = RiakClient().bucket('bench').new('key')
+    robj.resolver = None
+    cases = [(1, get_resp(1), 5000),
+             (3, get_resp(3), 2000)]
+
+    print "Benchmarking PBC content decoding:"
+    for b in benchmark.measure_with_rehearsal():
+        for siblings, resp, count in cases:
+            for prefix, decode in (('eager', decode_eager),
+                                   ('lazy', decode_lazy)):
+                for suffix, use in (('data', use_data), ('all', use_all)):
+                    with b.report('%s %d %s' % (prefix, siblings, suffix)):
+                        for i in range(count):
+                            decode(codec, robj, resp)
+                            use(robj)
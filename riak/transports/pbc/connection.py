@@ -16,6 +16,7 @@ specific language governing permissions and limitations
 under the License.
 """
 
+import errno
 import socket
 import struct
 from riak import RiakError
@@ -24,6 +25,16 @@ from riak_pb.messages import (
     MSG_CODE_ERROR_RESP
 )
 
+#: The initial size, in bytes, of the input and output buffers of a
+#: connection, which is also the size of most socket reads.
+INITIAL_BUFFER = 65536
+
+#: The largest input or output buffer, in bytes, that a connection
+#: keeps for reuse. Messages larger than this are received into a
+#: buffer of their own, which is released once the message is
+#: decoded, and a larger output buffer is released once sent.
+MAX_RETAINED_BUFFER = 1024 * 1024
+
 
 class RiakPbcConnection(object):
     """
@@ -43,18 +54,148 @@ class RiakPbcConnection(object):
         return self._recv_msg(expect)
 
     def _send_msg(self, msg_code, msg):
-        self._connect()
-        self._socket.send(self._encode_msg(msg_code, msg))
+        self._write_msg(msg_code, msg)
+        self._flush()
+
+    def _write_msg(self, msg_code, msg=None):
+        """
+        Appends a message to the output buffer of the connection,
+        to be sent by :meth:`_flush`. Several messages can be written
+        before flushing, so that they are sent with a single call.
+        """
+        if msg is None:
+            msgstr = ''
+        else:
+            msgstr = msg.SerializeToString()
+        size = 5 + len(msgstr)
+
+        outbuf = self._outbuf
+        end = self._outbuf_end
+        if outbuf is None:
+            outbuf = self._outbuf = bytearray(max(INITIAL_BUFFER, size))
+        elif end + size > len(outbuf):
+            outbuf.extend(bytearray(max(end + size - len(outbuf),
+                                        len(outbuf))))
+
+        struct.pack_into("!iB", outbuf, end, 1 + len(msgstr), msg_code)
+        outbuf[end + 5:end + size] = msgstr
+        self._outbuf_end = end + size
+
+    def _flush(self):
+        """
+        Sends the messages in the output buffer. Unlike ``send``,
+        ``sendall`` does not return until everything is written, so a
+        large message cannot be truncated. Buffers larger than
+        :data:`MAX_RETAINED_BUFFER` are released afterwards.
+        """
+        try:
+            self._connect()
+            self._socket.sendall(memoryview(self._outbuf)[:self._outbuf_end])
+        finally:
+            self._outbuf_end = 0
+            if len(self._outbuf) > MAX_RETAINED_BUFFER:
+                self._outbuf = None
+
+    def _send_some(self):
+        """
+        Sends as much of the output buffer as the socket takes without
+        blocking, for sockets in non-blocking mode. Returns whether
+        the buffer was sent completely.
+
+        :rtype: bool
+        """
+        start, end = self._outbuf_start, self._outbuf_end
+        try:
+            start += self._socket.send(
+                memoryview(self._outbuf)[start:end])
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        if start < end:
+            self._outbuf_start = start
+            return False
+        self._outbuf_start = self._outbuf_end = 0
+        if len(self._outbuf) > MAX_RETAINED_BUFFER:
+            self._outbuf = None
+        return True
+
+    def _recv_some(self):
+        """
+        Reads what the socket has available into the input buffer,
+        for sockets in non-blocking mode. Complete messages are then
+        taken out with :meth:`_buffered_pkt`. Returns the number of
+        bytes read, which is 0 once the connection is closed and None
+        if nothing was available.
+
+        :rtype: int
+        """
+        if self._inbuf is None or (
+                self._inbuf_start == self._inbuf_end and
+                len(self._inbuf) > MAX_RETAINED_BUFFER):
+            self._inbuf = bytearray(INITIAL_BUFFER)
+            self._inbuf_start = self._inbuf_end = 0
+        elif self._inbuf_end == len(self._inbuf):
+            self._reserve(self._inbuf_end - self._inbuf_start + 1)
+
+        end = self._inbuf_end
+        try:
+            count = self._socket.recv_into(memoryview(self._inbuf)[end:],
+                                           len(self._inbuf) - end)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+        self._inbuf_end = end + count
+        return count
+
+    def _buffered_pkt(self):
+        """
+        Takes the next message out of the input buffer, as with
+        :meth:`_recv_pkt`, but without reading from the socket. Returns
+        None if the message is not completely buffered yet, in which
+        case the buffer is made large enough to hold it.
+
+        :rtype: tuple
+        """
+        start, end = self._inbuf_start, self._inbuf_end
+        if end - start < 4:
+            return None
+        msglen, = struct.unpack_from('!i', self._inbuf, start)
+        if end - start < 4 + msglen:
+            self._reserve(4 + msglen)
+            return None
+        self._inbuf_start = start + 4 + msglen
+        return self._inbuf, start + 4, msglen
 
     def _recv_msg(self, expect=None):
-        self._recv_pkt()
-        msg_code, = struct.unpack("B", self._inbuf[:1])
+        inbuf, start, msglen = self._recv_pkt()
+        return self._decode_pkt(inbuf, start, msglen, expect)
 
-        if msg_code is MSG_CODE_ERROR_RESP:
-            err = self._parse_msg(msg_code, self._inbuf[1:])
+    def _decode_pkt(self, inbuf, start, msglen, expect=None):
+        """
+        Decodes a message received with :meth:`_recv_pkt` or
+        :meth:`_buffered_pkt`, raising error responses as
+        :class:`~riak.RiakError`.
+
+        :rtype: tuple
+        """
+        # A read-only view of the payload, which the protobuf parser
+        # accepts without copying it out of the input buffer first.
+        return self._decode_msg(inbuf[start],
+                                buffer(inbuf, start + 1, msglen - 1),
+                                expect)
+
+    def _decode_msg(self, msg_code, packet, expect=None):
+        """
+        Decodes the payload of a message with the given code.
+
+        :rtype: tuple
+        """
+        if msg_code == MSG_CODE_ERROR_RESP:
+            err = self._parse_msg(msg_code, packet)
             raise RiakError(err.errmsg)
         elif msg_code in MESSAGE_CLASSES:
-            msg = self._parse_msg(msg_code, self._inbuf[1:])
+            msg = self._parse_msg(msg_code, packet)
         else:
             raise Exception("unknown msg code %s" % msg_code)
 
@@ -64,38 +205,192 @@ class RiakPbcConnection(object):
         return msg_code, msg
 
     def _recv_pkt(self):
-        nmsglen = self._socket.recv(4)
-        if len(nmsglen) != 4:
+        """
+        Receives the next message, returning the buffer holding it,
+        its offset in the buffer and its length. The message is only
+        valid until the next one is received.
+
+        Socket reads fill as much of the input buffer of the
+        connection as possible, so that a stream of small messages
+        (such as a key listing) is sliced out of a few large reads.
+        The buffer grows when a message does not fit, up to
+        :data:`MAX_RETAINED_BUFFER`; larger messages are read
+        straight into a buffer of their own.
+
+        :rtype: tuple
+        """
+        if self._inbuf is None:
+            self._inbuf = bytearray(INITIAL_BUFFER)
+            self._inbuf_start = self._inbuf_end = 0
+
+        buffered = self._fill(4)
+        if buffered < 4:
             raise RiakError(
                 "Socket returned short packet length %d - expected 4"
-                % len(nmsglen))
-        msglen, = struct.unpack('!i', nmsglen)
-        self._inbuf_len = msglen
-        self._inbuf = ''
-        while len(self._inbuf) < msglen:
-            want_len = min(8192, msglen - len(self._inbuf))
-            recv_buf = self._socket.recv(want_len)
-            if not recv_buf:
-                break
-            self._inbuf += recv_buf
-        if len(self._inbuf) != self._inbuf_len:
+                % buffered)
+        msglen, = struct.unpack_from('!i', self._inbuf, self._inbuf_start)
+
+        if 4 + msglen > MAX_RETAINED_BUFFER:
+            self._inbuf_start += 4
+            return self._recv_large_pkt(msglen)
+
+        # The length is only taken out of the buffer with the message,
+        # so that a read that times out can be resumed.
+        buffered = self._fill(4 + msglen)
+        if buffered < 4 + msglen:
             raise RiakError("Socket returned short packet %d - expected %d"
-                            % (len(self._inbuf), self._inbuf_len))
+                            % (buffered - 4, msglen))
+        start = self._inbuf_start + 4
+        self._inbuf_start = start + msglen
+        return self._inbuf, start, msglen
+
+    def _recv_large_pkt(self, msglen):
+        """
+        Receives a message larger than the input buffer may grow into
+        a buffer of its own, starting with the part of it that is
+        already buffered. What was read of the message is lost if the
+        read fails, so the connection is then shut down rather than
+        left out of step.
+
+        :rtype: tuple
+        """
+        inbuf = bytearray(msglen)
+        start, end = self._inbuf_start, self._inbuf_end
+        buffered = min(end - start, msglen)
+        inbuf[:buffered] = buffer(self._inbuf, start, buffered)
+        self._inbuf_start = start + buffered
+
+        view = memoryview(inbuf)
+        try:
+            while buffered < msglen:
+                count = self._socket.recv_into(view[buffered:],
+                                               msglen - buffered)
+                if not count:
+                    raise RiakError("Socket returned short packet %d - "
+                                    "expected %d" % (buffered, msglen))
+                buffered += count
+        except:
+            self.close()
+            raise
+        return inbuf, 0, msglen
+
+    def _fill(self, size):
+        """
+        Reads from the socket until at least ``size`` bytes are
+        buffered, growing and compacting the input buffer as needed.
+        Returns the number of bytes buffered, which is less than
+        ``size`` only if the connection was closed.
+
+        :rtype: int
+        """
+        start, end = self._inbuf_start, self._inbuf_end
+        if end - start >= size:
+            return end - start
+
+        self._reserve(size)
+        inbuf = self._inbuf
+        start, end = self._inbuf_start, self._inbuf_end
+        view = memoryview(inbuf)
+        while end - start < size:
+            count = self._socket.recv_into(view[end:], len(inbuf) - end)
+            if not count:
+                break
+            end += count
+            # Kept up to date, so that what was read is not lost if
+            # the next read times out
+            self._inbuf_end = end
+        return end - start
+
+    def _reserve(self, size):
+        """
+        Makes room for ``size`` bytes from the start of the buffered
+        data, moving the partial message to the front of the input
+        buffer, into a larger one if it cannot hold the whole message.
+        """
+        start, end = self._inbuf_start, self._inbuf_end
+        inbuf = self._inbuf
+        if start + size > len(inbuf):
+            if size > len(inbuf):
+                capacity = len(inbuf)
+                while capacity < size:
+                    capacity *= 2
+                inbuf = bytearray(capacity)
+            partial = buffer(self._inbuf, start, end - start)
+            if inbuf is self._inbuf:
+                # Copied out first, as the slice assignment is a memcpy
+                # that is undefined for overlapping regions
+                partial = str(partial)
+            inbuf[:end - start] = partial
+            self._inbuf = inbuf
+            self._inbuf_start, self._inbuf_end = 0, end - start
 
     def _connect(self):
         if not self._socket:
-            if self._timeout:
-                self._socket = socket.create_connection(self._address,
-                                                        self._timeout)
-            else:
-                self._socket = socket.create_connection(self._address)
+            timeout = self._request_timeout or self._timeout
+            connect_timeout = self._connect_timeout or timeout
+            if self._request_timeout:
+                connect_timeout = min(connect_timeout, self._request_timeout)
+
+            # Like socket.create_connection, but with the socket
+            # options set before connecting, as the buffer sizes
+            # affect the TCP window negotiated by the handshake.
+            host, port = self._address
+            error = socket.error("getaddrinfo returns an empty list")
+            for res in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+                family, socktype, proto, canonname, address = res
+                sock = None
+                try:
+                    sock = socket.socket(family, socktype, proto)
+                    self._set_socket_options(sock)
+                    sock.settimeout(connect_timeout)
+                    sock.connect(address)
+                    sock.settimeout(timeout)
+                    self._socket = sock
+                    return
+                except socket.error as e:
+                    error = e
+                    if sock is not None:
+                        sock.close()
+            raise error
+
+    def _set_socket_options(self, sock):
+        """
+        Applies the socket options given to the transport.
+        """
+        options = self._socket_options
+        if options.get('nodelay', True):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if options.get('recv_buffer'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            options['recv_buffer'])
+        if options.get('send_buffer'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            options['send_buffer'])
+        if options.get('keepalive'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # These are not available on every platform
+            for option, name in (('keepalive_idle', 'TCP_KEEPIDLE'),
+                                 ('keepalive_interval', 'TCP_KEEPINTVL'),
+                                 ('keepalive_count', 'TCP_KEEPCNT')):
+                if options.get(option) and hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP,
+                                    getattr(socket, name), options[option])
+
+    def _set_timeout(self, timeout):
+        self._request_timeout = timeout
+        if self._socket:
+            self._socket.settimeout(timeout or self._timeout)
 
     def close(self):
         """
         Closes the underlying socket of the PB connection.
         """
         if self._socket:
-            self._socket.shutdown(socket.SHUT_RDWR)
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # The peer has already closed the connection
+                pass
 
     def _parse_msg(self, code, packet):
         try:
@@ -113,3 +408,89 @@ class RiakPbcConnection(object):
     # These are set in the RiakPbcTransport initializer
     _address = None
     _timeout = None
+    _connect_timeout = None
+    _socket_options = {}
+    _request_timeout = None
+    _inbuf = None
+    _inbuf_start = 0
+    _inbuf_end = 0
+    _outbuf = None
+    _outbuf_start = 0
+    _outbuf_end = 0
+
+
+if __name__ == '__main__':
+    # Run a benchmark of receiving messages, against the previous
+    # implementations: one that appended each chunk to a string, and
+    # one that read each message exactly (two reads per message).
+    import threading
+    import riak_pb
+    import riak.benchmark as benchmark
+    from riak_pb.messages import MSG_CODE_GET_RESP, MSG_CODE_LIST_KEYS_RESP
+
+    class StringConnection(RiakPbcConnection):
+        def _recv_msg(self, expect=None):
+            self._socket.recv(4)
+            msglen = self._msglen
+            self._inbuf = ''
+            while len(self._inbuf) < msglen:
+                want_len = min(8192, msglen - len(self._inbuf))
+                self._inbuf += self._socket.recv(want_len)
+            return self._parse_msg(ord(self._inbuf[0]), self._inbuf[1:])
+
+    class ExactConnection(RiakPbcConnection):
+        def _recv_exactly(self, buf, size):
+            view = memoryview(buf)
+            received = 0
+            while received < size:
+                received += self._socket.recv_into(view[received:],
+                                                   size - received)
+
+        def _recv_pkt(self):
+            header = bytearray(4)
+            self._recv_exactly(header, 4)
+            msglen, = struct.unpack_from('!i', header)
+            if self._inbuf is None or len(self._inbuf) < msglen:
+                self._inbuf = bytearray(msglen)
+            self._recv_exactly(self._inbuf, msglen)
+            return self._inbuf, 0, msglen
+
+    def get_frame(size):
+        resp = riak_pb.RpbGetResp(vclock='vclock')
+        resp.content.add(value='x' * size, content_type='text/plain')
+        return RiakPbcConnection()._encode_msg(MSG_CODE_GET_RESP, resp)
+
+    def keys_frame(count):
+        resp = riak_pb.RpbListKeysResp()
+        resp.keys.extend(['key%d' % i for i in range(count)])
+        return RiakPbcConnection()._encode_msg(MSG_CODE_LIST_KEYS_RESP, resp)
+
+    def receive(conn, data, count):
+        server, conn._socket = socket.socketpair()
+        conn._msglen = len(data) - 4
+
+        def _send():
+            server.sendall(data * min(count, 1000))
+            for i in range(count - min(count, 1000)):
+                server.sendall(data)
+        sender = threading.Thread(target=_send)
+        sender.start()
+        for i in range(count):
+            conn._recv_msg()
+        sender.join()
+        server.close()
+        conn._socket.close()
+
+    cases = [('1KB', get_frame(1024), 5000),
+             ('100KB', get_frame(100 * 1024), 500),
+             ('5MB', get_frame(5 * 1024 * 1024), 10),
+             ('keys', keys_frame(2), 20000)]
+    connections = [('str', StringConnection), ('exact', ExactConnection),
+                   ('buf', RiakPbcConnection)]
+
+    print "Benchmarking PBC message receive:"
+    for b in benchmark.measure_with_rehearsal():
+        for name, data, count in cases:
+            for prefix, connection in connections:
+                with b.report(prefix + ' ' + name):
+                    receive(connection(), data, count)
@@ -22,8 +22,9 @@ under the License.
 import riak_pb
 from riak import RiakError
 from riak.transports.transport import RiakTransport
+from riak.transports.pool import BadResource
 from riak.riak_object import VClock
-from riak.util import decode_index_value
+from riak.util import decode_index_value, lazy_property
 from connection import RiakPbcConnection
 from stream import (RiakPbcKeyStream, RiakPbcMapredStream, RiakPbcBucketStream,
                     RiakPbcIndexStream)
@@ -79,9 +80,44 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
     buffers interface on the riak server.
     """
 
-    def __init__(self, node=None, client=None, timeout=None, *unused_options):
+    _protocol = 'pbc'
+
+    def __init__(self, node=None, client=None, timeout=None,
+                 connect_timeout=None, nodelay=True, keepalive=False,
+                 keepalive_idle=None, keepalive_interval=None,
+                 keepalive_count=None, recv_buffer=None, send_buffer=None,
+                 **unused_options):
         """
-        Construct a new RiakPbcTransport object.
+        Construct a new RiakPbcTransport object. The options are
+        given to the client in ``transport_options``.
+
+        :param timeout: the socket timeout in seconds for each
+            operation, by default operations block
+        :type timeout: float
+        :param connect_timeout: the timeout in seconds for
+            establishing the connection, defaults to ``timeout``
+        :type connect_timeout: float
+        :param nodelay: whether to disable Nagle's algorithm
+            (``TCP_NODELAY``), defaults to True
+        :type nodelay: bool
+        :param keepalive: whether to enable TCP keepalive
+            (``SO_KEEPALIVE``), defaults to False
+        :type keepalive: bool
+        :param keepalive_idle: the idle time in seconds before
+            keepalive probes are sent, where supported
+        :type keepalive_idle: int
+        :param keepalive_interval: the time in seconds between
+            keepalive probes, where supported
+        :type keepalive_interval: int
+        :param keepalive_count: the number of failed keepalive probes
+            after which the connection is dropped, where supported
+        :type keepalive_count: int
+        :param recv_buffer: the size of the socket receive buffer
+            (``SO_RCVBUF``), defaults to the system setting
+        :type recv_buffer: int
+        :param send_buffer: the size of the socket send buffer
+            (``SO_SNDBUF``), defaults to the system setting
+        :type send_buffer: int
         """
         super(RiakPbcTransport, self).__init__()
 
@@ -89,12 +125,45 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         self._node = node
         self._address = (node.host, node.pb_port)
         self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._socket_options = {'nodelay': nodelay,
+                                'keepalive': keepalive,
+                                'keepalive_idle': keepalive_idle,
+                                'keepalive_interval': keepalive_interval,
+                                'keepalive_count': keepalive_count,
+                                'recv_buffer': recv_buffer,
+                                'send_buffer': send_buffer}
         self._socket = None
 
     # FeatureDetection API
     def _server_version(self):
         return self.get_server_info()['server_version']
 
+    @lazy_property
+    def _object_features(self):
+        """
+        Whether quorum controls, client timeouts and tombstone vclocks
+        are supported, checked once per connection instead of on every
+        request, as the server version of a connection does not
+        change.
+        """
+        return (self.quorum_controls(), self.client_timeouts(),
+                self.tombstone_vclocks())
+
+    # Request messages reused by each request of their kind on this
+    # connection, as they are serialized before the next is built
+    @lazy_property
+    def _get_msg(self):
+        return riak_pb.RpbGetReq()
+
+    @lazy_property
+    def _put_msg(self):
+        return riak_pb.RpbPutReq()
+
+    @lazy_property
+    def _delete_msg(self):
+        return riak_pb.RpbDelReq()
+
     def ping(self):
         """
         Ping the remote server
@@ -135,24 +204,32 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         """
         Serialize get request and deserialize response
         """
+        req = self._get_req(robj, r=r, pr=pr, timeout=timeout)
+        msg_code, resp = self._request(MSG_CODE_GET_REQ, req,
+                                       MSG_CODE_GET_RESP)
+        return self._get_resp(robj, resp)
+
+    def _get_req(self, robj, r=None, pr=None, timeout=None):
         bucket = robj.bucket
+        quorum_controls, client_timeouts, tombstone_vclocks = \
+            self._object_features
 
-        req = riak_pb.RpbGetReq()
+        req = self._get_msg
+        req.Clear()
         if r:
             req.r = self._encode_quorum(r)
-        if self.quorum_controls() and pr:
+        if quorum_controls and pr:
             req.pr = self._encode_quorum(pr)
-        if self.client_timeouts() and timeout:
+        if client_timeouts and timeout:
             req.timeout = timeout
-        if self.tombstone_vclocks():
+        if tombstone_vclocks:
             req.deletedvclock = 1
 
         req.bucket = bucket.name
         req.key = robj.key
+        return req
 
-        msg_code, resp = self._request(MSG_CODE_GET_REQ, req,
-                                       MSG_CODE_GET_RESP)
-
+    def _get_resp(self, robj, resp):
         # TODO: support if_modified flag
 
         if resp is not None:
@@ -173,21 +250,33 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         """
         Serialize get request and deserialize response
         """
+        req = self._put_req(robj, w=w, dw=dw, pw=pw,
+                            return_body=return_body,
+                            if_none_match=if_none_match, timeout=timeout)
+        msg_code, resp = self._request(MSG_CODE_PUT_REQ, req,
+                                       MSG_CODE_PUT_RESP)
+        return self._put_resp(robj, resp)
+
+    def _put_req(self, robj, w=None, dw=None, pw=None, return_body=True,
+                 if_none_match=False, timeout=None):
         bucket = robj.bucket
+        quorum_controls, client_timeouts, tombstone_vclocks = \
+            self._object_features
 
-        req = riak_pb.RpbPutReq()
+        req = self._put_msg
+        req.Clear()
         if w:
             req.w = self._encode_quorum(w)
         if dw:
             req.dw = self._encode_quorum(dw)
-        if self.quorum_controls() and pw:
+        if quorum_controls and pw:
             req.pw = self._encode_quorum(pw)
 
         if return_body:
             req.return_body = 1
         if if_none_match:
             req.if_none_match = 1
-        if self.client_timeouts() and timeout:
+        if client_timeouts and timeout:
             req.timeout = timeout
 
         req.bucket = bucket.name
@@ -197,10 +286,9 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
             req.vclock = robj.vclock.encode('binary')
 
         self._encode_content(robj, req.content)
+        return req
 
-        msg_code, resp = self._request(MSG_CODE_PUT_REQ, req,
-                                       MSG_CODE_PUT_RESP)
-
+    def _put_resp(self, robj, resp):
         if resp is not None:
             if resp.HasField('key'):
                 robj.key = resp.key
@@ -218,9 +306,20 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         """
         Serialize get request and deserialize response
         """
+        req = self._delete_req(robj, rw=rw, r=r, w=w, dw=dw, pr=pr, pw=pw,
+                               timeout=timeout)
+        msg_code, resp = self._request(MSG_CODE_DEL_REQ, req,
+                                       MSG_CODE_DEL_RESP)
+        return self
+
+    def _delete_req(self, robj, rw=None, r=None, w=None, dw=None, pr=None,
+                    pw=None, timeout=None):
         bucket = robj.bucket
+        quorum_controls, client_timeouts, tombstone_vclocks = \
+            self._object_features
 
-        req = riak_pb.RpbDelReq()
+        req = self._delete_msg
+        req.Clear()
         if rw:
             req.rw = self._encode_quorum(rw)
         if r:
@@ -230,24 +329,24 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         if dw:
             req.dw = self._encode_quorum(dw)
 
-        if self.quorum_controls():
+        if quorum_controls:
             if pr:
                 req.pr = self._encode_quorum(pr)
             if pw:
                 req.pw = self._encode_quorum(pw)
 
-        if self.client_timeouts() and timeout:
+        if client_timeouts and timeout:
             req.timeout = timeout
 
-        if self.tombstone_vclocks() and robj.vclock:
+        if tombstone_vclocks and robj.vclock:
             req.vclock = robj.vclock.encode('binary')
 
         req.bucket = bucket.name
         req.key = robj.key
+        return req
 
-        msg_code, resp = self._request(MSG_CODE_DEL_REQ, req,
-                                       MSG_CODE_DEL_RESP)
-        return self
+    def _delete_resp(self, robj, resp):
+        return robj
 
     def get_keys(self, bucket, timeout=None):
         """
@@ -352,10 +451,14 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         return True
 
     def mapred(self, inputs, query, timeout=None):
+        return self._mapred_result(self.stream_mapred(inputs, query,
+                                                      timeout))
+
+    def _mapred_result(self, phases):
         # dictionary of phase results - each content should be an encoded array
         # which is appended to the result for that phase.
         result = {}
-        for phase, content in self.stream_mapred(inputs, query, timeout):
+        for phase, content in phases:
             if phase in result:
                 result[phase] += content
             else:
@@ -371,16 +474,19 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
             return result
 
     def stream_mapred(self, inputs, query, timeout=None):
+        req = self._mapred_req(inputs, query, timeout)
+        self._send_msg(MSG_CODE_MAP_RED_REQ, req)
+
+        return RiakPbcMapredStream(self)
+
+    def _mapred_req(self, inputs, query, timeout=None):
         # Construct the job, optionally set the timeout...
         content = self._construct_mapred_json(inputs, query, timeout)
 
         req = riak_pb.RpbMapRedReq()
         req.request = content
         req.content_type = "application/json"
-
-        self._send_msg(MSG_CODE_MAP_RED_REQ, req)
-
-        return RiakPbcMapredStream(self)
+        return req
 
     def get_index(self, bucket, index, startkey, endkey=None,
                   return_terms=None, max_results=None, continuation=None,
@@ -388,17 +494,26 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         if not self.pb_indexes():
             return self._get_index_mapred_emu(bucket, index, startkey, endkey)
 
+        req = self._get_index_req(bucket, index, startkey, endkey,
+                                  return_terms, max_results, continuation,
+                                  timeout, term_regex)
+
+        msg_code, resp = self._request(MSG_CODE_INDEX_REQ, req,
+                                       MSG_CODE_INDEX_RESP)
+        return self._get_index_resp(index, return_terms, max_results, resp)
+
+    def _get_index_req(self, bucket, index, startkey, endkey=None,
+                       return_terms=None, max_results=None,
+                       continuation=None, timeout=None, term_regex=None):
         if term_regex and not self.index_term_regex():
             raise NotImplementedError("Secondary index term_regex is not "
                                       "supported")
 
-        req = self._encode_index_req(bucket, index, startkey, endkey,
-                                     return_terms, max_results, continuation,
-                                     timeout, term_regex)
-
-        msg_code, resp = self._request(MSG_CODE_INDEX_REQ, req,
-                                       MSG_CODE_INDEX_RESP)
+        return self._encode_index_req(bucket, index, startkey, endkey,
+                                      return_terms, max_results,
+                                      continuation, timeout, term_regex)
 
+    def _get_index_resp(self, index, return_terms, max_results, resp):
         if return_terms and resp.results:
             results = [(decode_index_value(index, pair.key), pair.value)
                        for pair in resp.results]
@@ -551,6 +666,12 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
         return result
 
     def get_counter(self, bucket, key, **params):
+        req = self._get_counter_req(bucket, key, **params)
+        msg_code, resp = self._request(MSG_CODE_COUNTER_GET_REQ, req,
+                                       MSG_CODE_COUNTER_GET_RESP)
+        return self._get_counter_resp(bucket, resp)
+
+    def _get_counter_req(self, bucket, key, **params):
         if not self.counters():
             raise NotImplementedError("Counters are not supported")
 
@@ -565,15 +686,21 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
             req.basic_quorum = params['basic_quorum']
         if params.get('notfound_ok') is not None:
             req.notfound_ok = params['notfound_ok']
+        return req
 
-        msg_code, resp = self._request(MSG_CODE_COUNTER_GET_REQ, req,
-                                       MSG_CODE_COUNTER_GET_RESP)
+    def _get_counter_resp(self, bucket, resp):
         if resp.HasField('value'):
             return resp.value
         else:
             return None
 
     def update_counter(self, bucket, key, value, **params):
+        req = self._update_counter_req(bucket, key, value, **params)
+        msg_code, resp = self._request(MSG_CODE_COUNTER_UPDATE_REQ, req,
+                                       MSG_CODE_COUNTER_UPDATE_RESP)
+        return self._update_counter_resp(bucket, resp)
+
+    def _update_counter_req(self, bucket, key, value, **params):
         if not self.counters():
             raise NotImplementedError("Counters are not supported")
 
@@ -589,10 +716,183 @@ class RiakPbcTransport(RiakTransport, RiakPbcConnection, RiakPbcCodec):
             req.pw = self._encode_quorum(params['pw'])
         if params.get('returnvalue') is not None:
             req.returnvalue = params['returnvalue']
+        return req
 
-        msg_code, resp = self._request(MSG_CODE_COUNTER_UPDATE_REQ, req,
-                                       MSG_CODE_COUNTER_UPDATE_RESP)
+    def _update_counter_resp(self, bucket, resp):
         if resp.HasField('value'):
             return resp.value
         else:
             return True
+
+    #: The request and response message codes of the operations that
+    #: can be pipelined, see :meth:`pipeline`.
+    PIPELINE_OPERATIONS = {
+        'get': (MSG_CODE_GET_REQ, MSG_CODE_GET_RESP),
+        'put': (MSG_CODE_PUT_REQ, MSG_CODE_PUT_RESP),
+        'delete': (MSG_CODE_DEL_REQ, MSG_CODE_DEL_RESP),
+        'get_counter': (MSG_CODE_COUNTER_GET_REQ,
+                        MSG_CODE_COUNTER_GET_RESP),
+        'update_counter': (MSG_CODE_COUNTER_UPDATE_REQ,
+                           MSG_CODE_COUNTER_UPDATE_RESP)
+    }
+
+    #: The most requests that are written before their responses are
+    #: read, so that neither side blocks on a full socket buffer.
+    PIPELINE_WINDOW = 100
+
+    #: The most bytes of requests that are written before their
+    #: responses are read, so that large values do not fill the
+    #: socket buffers either.
+    PIPELINE_BUFFER = 65536
+
+    def pipeline(self, operations):
+        """
+        Performs several operations on this connection, writing their
+        requests back to back and then reading the responses in
+        order, instead of waiting for each response before sending the
+        next request. The responses are read after at most
+        :attr:`PIPELINE_WINDOW` requests, or :attr:`PIPELINE_BUFFER`
+        bytes of them, have been written.
+
+        Each operation is a tuple of the operation name (a key of
+        :attr:`PIPELINE_OPERATIONS`), its positional arguments, the
+        first of which is the object or bucket, and its keyword
+        arguments, as taken by the method of the same name. The result
+        of each operation is returned in the same order; an operation
+        that fails with an error from Riak, or that cannot be encoded,
+        has the exception as its result instead. Any other failure
+        while reading the responses raises
+        :class:`~riak.transports.pool.BadResource`, so that the
+        connection is discarded.
+
+        :param operations: the operations to perform
+        :type operations: list
+        :rtype: list
+        """
+        results = []
+        for start in range(0, len(operations), self.PIPELINE_WINDOW):
+            window = operations[start:start + self.PIPELINE_WINDOW]
+            results.extend(self._pipeline_window(window))
+        return results
+
+    def _pipeline_window(self, operations):
+        results = [None] * len(operations)
+        sent = []
+        for index, (name, args, kwargs) in enumerate(operations):
+            req_code, resp_code = self.PIPELINE_OPERATIONS[name]
+            try:
+                req = getattr(self, '_%s_req' % name)(*args, **kwargs)
+                self._write_msg(req_code, req)
+                sent.append(index)
+            except Exception as e:
+                results[index] = e
+            if self._outbuf_end >= self.PIPELINE_BUFFER:
+                self._pipeline_responses(operations, sent, results)
+                sent = []
+
+        if sent:
+            self._pipeline_responses(operations, sent, results)
+        return results
+
+    def _pipeline_responses(self, operations, sent, results):
+        """
+        Sends the requests written so far in a single send, and reads
+        their responses into ``results``.
+
+        :param operations: the operations of the window
+        :type operations: list
+        :param sent: the indexes of the operations written
+        :type sent: list
+        :param results: the results of the window
+        :type results: list
+        """
+        self._flush()
+
+        # Every request gets exactly one response, so an error
+        # response does not disturb the responses that follow it.
+        for index in sent:
+            name, args, kwargs = operations[index]
+            req_code, resp_code = self.PIPELINE_OPERATIONS[name]
+            try:
+                msg_code, resp = self._recv_msg(resp_code)
+                results[index] = getattr(self, '_%s_resp' % name)(args[0],
+                                                                  resp)
+            except RiakError as e:
+                results[index] = e
+            except Exception as e:
+                # The responses still outstanding are left unread, so
+                # the connection cannot be reused
+                raise BadResource(e)
+
+
+if __name__ == '__main__':
+    # Run a benchmark of encoding fetch and store requests and of
+    # decoding fetch responses, without any I/O, against transports
+    # that build new messages and check the server version on every
+    # request as before, reporting calls per second.
+    import time
+    import riak.benchmark as benchmark
+    from distutils.version import LooseVersion
+    from riak.client import RiakClient
+    from riak.node import RiakNode
+
+    class FreshTransport(RiakPbcTransport):
+        _object_features = property(lambda self: (
+            self.quorum_controls(), self.client_timeouts(),
+            self.tombstone_vclocks()))
+        _get_msg = property(lambda self: riak_pb.RpbGetReq())
+        _put_msg = property(lambda self: riak_pb.RpbPutReq())
+        _delete_msg = property(lambda self: riak_pb.RpbDelReq())
+
+    def transport(cls):
+        t = cls(node=RiakNode())
+        t.server_version = LooseVersion('1.4.8')
+        return t
+
+    bucket = RiakClient().bucket('bench')
+    robj = bucket.new('key', encoded_data='x' * 1024,
+                      content_type='text/plain')
+    robj.vclock = VClock('vclock' * 10, 'binary')
+    for i in range(10):
+        robj.add_index('field%d_bin' % i, 'value%d' % i)
+
+    resp = riak_pb.RpbGetResp(vclock='vclock' * 10)
+    resp.content.add(value='x' * 1024, content_type='text/plain')
+    resp_data = resp.SerializeToString()
+
+    def encode_get(t):
+        t._get_req(robj, r='quorum', pr=1, timeout=1000).SerializeToString()
+
+    def encode_put(t):
+        t._put_req(robj, w='quorum', return_body=True,
+                   timeout=1000).SerializeToString()
+
+    def decode_get(t):
+        msg = riak_pb.RpbGetResp()
+        msg.ParseFromString(resp_data)
+        t._get_resp(robj, msg)
+
+    count = 20000
+    fresh = transport(FreshTransport)
+    reused = transport(RiakPbcTransport)
+    # Decoding does not depend on how requests are built
+    cases = [('fresh encode get', encode_get, fresh),
+             ('reused encode get', encode_get, reused),
+             ('fresh encode put', encode_put, fresh),
+             ('reused encode put', encode_put, reused),
+             ('decode get', decode_get, reused)]
+    rates = []
+
+    print "Benchmarking PBC request encoding and response decoding:"
+    for b in benchmark.measure_with_rehearsal():
+        rates = []
+        for label, fn, t in cases:
+            with b.report(label):
+                start = time.time()
+                for i in range(count):
+                    fn(t)
+                rates.append((label, count / (time.time() - start)))
+
+    print
+    for label, rate in rates:
+        print "{:<20s} {:10.0f} calls/sec".format(label, rate)
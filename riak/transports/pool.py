@@ -16,8 +16,16 @@ specific language governing permissions and limitations
 under the License.
 """
 
+from collections import deque
 from contextlib import contextmanager
+from itertools import chain
 import threading
+import time
+import weakref
+
+#: How often in seconds the reaper refills pools that only have
+#: ``min_idle`` set, unless given a ``reap_interval``
+FILL_INTERVAL = 5.0
 
 
 # This file is a rough port of the Innertube Ruby library
@@ -30,6 +38,15 @@ class BadResource(StandardError):
     pass
 
 
+class PoolExhausted(StandardError):
+    """
+    Raised by :meth:`Pool.take` when the pool has reached its maximum
+    size and no resource was released before the acquire timeout
+    expired.
+    """
+    pass
+
+
 class Element(object):
     """
     A member of the :class:`Pool`, a container for the actual resource
@@ -51,6 +68,18 @@ class Element(object):
         self.claimed = False
         """Whether the resource is currently in use."""
 
+        self.tomb = False
+        """Whether the resource has been removed from the pool."""
+
+        self.created_at = time.time()
+        """When the resource was created."""
+
+        self.last_used = self.created_at
+        """When the resource was last released back to the pool."""
+
+        self.use_count = 0
+        """How many times the resource has been claimed."""
+
 
 class Pool(object):
     """
@@ -79,61 +108,387 @@ class Pool(object):
             resource.append(1)
         with pool.take() as resource2:
             print repr(resource2) # should be [1]
+
+    The number of resources can be bounded with ``max_size``. Once
+    the pool is full, :meth:`take` waits for another thread to release
+    a resource instead of creating a new one. Note that this makes
+    nested claims in the same thread block when the pool is full.
+
+    Resources can also be retired by age with ``max_idle`` and
+    ``max_lifetime``. Expired resources are never handed out, and a
+    background thread periodically reaps them from the pool (see
+    :meth:`reap`). Because unclaimed resources are reused most
+    recently released first, the resources left unused after a burst
+    of activity are the ones that age out.
     """
 
-    def __init__(self):
+    def __init__(self, max_size=None, min_idle=0, acquire_timeout=None,
+                 max_idle=None, max_lifetime=None, reap_interval=None):
         """
         Creates a new Pool. This should be called manually if you
         override the :meth:`__init__` method in a subclass.
+
+        :param max_size: the maximum number of resources in the pool,
+            or None for no limit
+        :type max_size: int
+        :param min_idle: the number of unclaimed resources that
+            :meth:`fill` keeps in the pool, which the background
+            reaper refills
+        :type min_idle: int
+        :param acquire_timeout: how long in seconds :meth:`take` waits
+            for a resource when the pool is full before raising
+            :class:`PoolExhausted`, or None to wait indefinitely
+        :type acquire_timeout: float
+        :param max_idle: how long in seconds a resource may stay
+            unclaimed before it is removed, or None for no limit
+        :type max_idle: float
+        :param max_lifetime: how long in seconds after its creation a
+            resource is removed, or None for no limit
+        :type max_lifetime: float
+        :param reap_interval: how often in seconds the background
+            reaper runs, defaults to half of the smaller of
+            ``max_idle`` and ``max_lifetime``, or to
+            :data:`FILL_INTERVAL` if only ``min_idle`` is set
+        :type reap_interval: float
         """
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+        if max_size is not None and min_idle > max_size:
+            raise ValueError("min_idle must not exceed max_size")
+
         self.lock = threading.RLock()
         self.releaser = threading.Condition(self.lock)
         self.elements = list()
+        self.max_size = max_size
+        self.min_idle = min_idle
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self._idle = deque()
+        self._creating = 0
+
+        interval = _reap_interval(min_idle, max_idle, max_lifetime,
+                                  reap_interval)
+        if interval:
+            self._start_reaper(interval)
 
     @contextmanager
-    def take(self, _filter=None, default=None):
+    def take(self, _filter=None, default=None, timeout=None):
         """
-        take(_filter=None, default=None)
+        take(_filter=None, default=None, timeout=None)
 
         Claims a resource from the pool for use in a thread-safe,
         reentrant manner (as part of a with statement). Resources are
         created as needed when all members of the pool are claimed or
-        the pool is empty.
+        the pool is empty. If the pool has reached ``max_size``, take
+        waits up to ``acquire_timeout`` seconds (or ``timeout``, if
+        that is shorter) for a resource to be released and then
+        raises :class:`PoolExhausted`.
+
+        Unclaimed elements are kept on a LIFO free-list, so claiming
+        and releasing a resource does not depend on the size of the
+        pool. When a filter is given, only the unclaimed elements are
+        examined, most recently released first.
 
         :param _filter: a filter that can be used to select a member
             of the pool
         :type _filter: callable
         :param default: a value that will be used instead of calling
             :meth:`create_resource` if a new resource needs to be created
+        :param timeout: how long in seconds to wait at most for this
+            claim
+        :type timeout: float
         """
-        if not _filter:
-            def _filter(obj):
-                return True
-        elif not callable(_filter):
+        if _filter is not None and not callable(_filter):
             raise TypeError("_filter is not a callable")
 
-        element = None
-        with self.lock:
-            for e in self.elements:
-                if not e.claimed and _filter(e.object):
-                    element = e
-                    break
-            if element is None:
-                if default is not None:
-                    element = Element(default)
-                else:
-                    element = Element(self.create_resource())
-                self.elements.append(element)
-            element.claimed = True
+        element = self._acquire(_filter, default, timeout)
         try:
             yield element.object
         except BadResource:
             self.delete_element(element)
             raise
         finally:
+            self._release(element)
+
+    def _acquire(self, _filter=None, default=None, timeout=None):
+        """
+        Claims an unclaimed element that passes the filter, creating
+        one if the pool has room, or waiting for a release if it does
+        not.
+
+        :param _filter: a filter that can be used to select a member
+            of the pool
+        :type _filter: callable
+        :param default: a value that will be used instead of calling
+            :meth:`create_resource` if a new resource needs to be created
+        :param timeout: how long in seconds to wait at most, if less
+            than ``acquire_timeout``
+        :type timeout: float
+        :rtype: Element
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        elif self.acquire_timeout is not None:
+            timeout = min(timeout, self.acquire_timeout)
+        element = None
+        evicted = []
+        deadline = None
+        with self.lock:
+            while True:
+                element = self._claim_idle(_filter)
+                if element is not None:
+                    if not self._expired(element, time.time(), True):
+                        break
+                    # Never hand out a resource that has aged out.
+                    self._discard(element)
+                    evicted.append(element)
+                    continue
+                if not self._full():
+                    self._creating += 1
+                    break
+                if self._idle:
+                    # The pool is full of resources the filter
+                    # rejects; replace the least recently used one.
+                    stale = self._idle[0]
+                    self._discard(stale)
+                    evicted.append(stale)
+                    self._creating += 1
+                    break
+                if timeout is None:
+                    self.releaser.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.time() + timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolExhausted("no resource was released within "
+                                        "%ss" % timeout)
+                self.releaser.wait(remaining)
+
+        for stale in evicted:
+            self.destroy_resource(stale.object)
+
+        if element is None:
+            element = self._create_element(default, claimed=True)
+        return element
+
+    def _create_element(self, default=None, claimed=False, init=None):
+        """
+        Creates a new element, for which room has already been
+        reserved by incrementing ``_creating``, and adds it to the
+        pool. Resource creation may block on the network, so it must
+        be called without the pool lock held.
+
+        :param default: a value that will be used instead of calling
+            :meth:`create_resource`
+        :param claimed: whether the element is returned claimed, or
+            placed on the free-list
+        :type claimed: bool
+        :param init: a function to call with the new resource before
+            it is added to the pool
+        :type init: function
+        :rtype: Element
+        """
+        try:
+            if default is not None:
+                element = Element(default)
+            else:
+                element = Element(self.create_resource())
+            if init is not None:
+                try:
+                    init(element.object)
+                except:
+                    self.destroy_resource(element.object)
+                    raise
+        except:
             with self.releaser:
-                element.claimed = False
+                self._creating -= 1
+                self.releaser.notify_all()
+            raise
+
+        with self.releaser:
+            self._creating -= 1
+            self.elements.append(element)
+            element.claimed = claimed
+            if claimed:
+                element.use_count += 1
+            else:
+                self._idle.append(element)
                 self.releaser.notify_all()
+        return element
+
+    def _full(self):
+        """
+        Whether the pool has reached its maximum size, counting
+        resources that are still being created. Must be called with
+        the pool lock held.
+
+        :rtype: bool
+        """
+        return (self.max_size is not None and
+                len(self.elements) + self._creating >= self.max_size)
+
+    def _expired(self, element, now, check_idle=False):
+        """
+        Whether an element has outlived ``max_lifetime``, or, when
+        ``check_idle`` is set, has been unclaimed longer than
+        ``max_idle``.
+
+        :param element: the element to check
+        :type element: Element
+        :param now: the current time
+        :type now: float
+        :param check_idle: whether to check the time since last use
+        :type check_idle: bool
+        :rtype: bool
+        """
+        if (self.max_lifetime is not None and
+                now - element.created_at >= self.max_lifetime):
+            return True
+        return (check_idle and self.max_idle is not None and
+                now - element.last_used >= self.max_idle)
+
+    def reap(self):
+        """
+        Removes unclaimed resources that have outlived
+        ``max_lifetime``, or that have been unclaimed for longer than
+        ``max_idle`` while more than ``min_idle`` are unclaimed, then
+        refills the pool with :meth:`fill`. This is called
+        periodically by the background reaper, oldest resources
+        first. Returns the number of resources removed.
+
+        :rtype: int
+        """
+        now = time.time()
+        with self.lock:
+            reaped = []
+            spare = len(self._idle) - self.min_idle
+            for element in self._idle:
+                if (self._expired(element, now) or
+                        (spare > 0 and self._expired(element, now, True))):
+                    reaped.append(element)
+                    spare -= 1
+            for element in reaped:
+                self._discard(element)
+
+        for element in reaped:
+            self.destroy_resource(element.object)
+        self.fill()
+        return len(reaped)
+
+    def _start_reaper(self, interval):
+        """
+        Starts the background reaper for this pool. See
+        :func:`start_reaper`.
+
+        :param interval: the number of seconds between runs
+        :type interval: float
+        """
+        start_reaper(self, interval)
+
+    def fill(self, count=None, init=None):
+        """
+        Creates unclaimed resources until there are at least ``count``
+        of them, without growing the pool past ``max_size``. Several
+        threads may fill the same pool concurrently to create the
+        resources in parallel.
+
+        :param count: the number of unclaimed resources wanted,
+            defaults to ``min_idle``
+        :type count: int
+        :param init: a function to call with each new resource before
+            it is added to the pool
+        :type init: function
+        """
+        if count is None:
+            count = self.min_idle
+        while True:
+            with self.lock:
+                if len(self._idle) + self._creating >= count or \
+                        self._full():
+                    return
+                self._creating += 1
+            self._create_element(init=init)
+
+    def _claim_idle(self, _filter=None):
+        """
+        Pops an unclaimed element off the free-list and marks it
+        claimed, returning None if no unclaimed element passes the
+        filter. Must be called with the pool lock held.
+
+        :param _filter: a filter that can be used to select a member
+            of the pool
+        :type _filter: callable
+        :rtype: Element
+        """
+        idle = self._idle
+        if not idle:
+            return None
+
+        if _filter is None:
+            element = idle.pop()
+        else:
+            last = len(idle) - 1
+            for offset, candidate in enumerate(reversed(idle)):
+                if _filter(candidate.object):
+                    del idle[last - offset]
+                    element = candidate
+                    break
+            else:
+                return None
+
+        element.claimed = True
+        element.use_count += 1
+        return element
+
+    def _claim_element(self, element):
+        """
+        Claims a specific unclaimed element, removing it from the
+        free-list. Must be called with the pool lock held.
+
+        :param element: the element to claim
+        :type element: Element
+        """
+        self._idle.remove(element)
+        element.claimed = True
+
+    def _release(self, element):
+        """
+        Releases a claimed element, returning it to the top of the
+        free-list unless it has been deleted or has outlived
+        ``max_lifetime``, and wakes any threads waiting for a release.
+
+        :param element: the element to release
+        :type element: Element
+        """
+        now = time.time()
+        with self.releaser:
+            element.claimed = False
+            element.last_used = now
+            expired = not element.tomb and self._expired(element, now)
+            if expired:
+                self._discard(element)
+            elif not element.tomb:
+                self._idle.append(element)
+            self.releaser.notify_all()
+        if expired:
+            self.destroy_resource(element.object)
+
+    def _discard(self, element):
+        """
+        Removes an element from the pool without destroying its
+        resource, waking any threads waiting for room. Must be called
+        with the pool lock held.
+
+        :param element: the element to remove
+        :type element: Element
+        """
+        self.elements.remove(element)
+        element.tomb = True
+        if not element.claimed:
+            self._idle.remove(element)
+        self.releaser.notify_all()
 
     def delete_element(self, element):
         """
@@ -144,8 +499,8 @@ class Pool(object):
         :param element: the element to remove
         :type element: Element
         """
-        with self.lock:
-            self.elements.remove(element)
+        with self.releaser:
+            self._discard(element)
         self.destroy_resource(element.object)
         del element
 
@@ -182,11 +537,316 @@ class Pool(object):
         pass
 
 
+class SubPool(Pool):
+    """
+    The pool of resources for a single node in a :class:`NodePool`.
+    Resources are created and destroyed by the parent, which also
+    runs the reaper for all of its sub-pools.
+    """
+
+    def __init__(self, parent, node, **options):
+        """
+        :param parent: the pool this sub-pool belongs to
+        :type parent: NodePool
+        :param node: the node whose resources this pool holds
+        :type node: riak.node.RiakNode
+        """
+        self.parent = parent
+        self.node = node
+        super(SubPool, self).__init__(**options)
+
+    def create_resource(self):
+        return self.parent.create_node_resource(self.node)
+
+    def destroy_resource(self, obj):
+        self.parent.destroy_resource(obj)
+
+    def _start_reaper(self, interval):
+        pass
+
+
+class NodePool(object):
+    """
+    A pool of transports to the nodes of a client, which keeps a
+    separate :class:`SubPool` for each node. Requests that have to
+    avoid certain nodes (e.g. when retrying) go straight to the idle
+    resources of the other nodes, and ``max_size`` and ``min_idle``
+    apply to each node individually.
+
+    Subclasses implement :meth:`create_node_resource` and, if
+    necessary, :meth:`destroy_resource`.
+    """
+
+    def __init__(self, client, max_size=None, min_idle=0,
+                 acquire_timeout=None, max_idle=None, max_lifetime=None,
+                 reap_interval=None, **options):
+        """
+        Creates a new NodePool. The pool options are described in
+        :class:`Pool`, any other options are kept in ``_options`` for
+        use by :meth:`create_node_resource`.
+
+        :param client: the client whose nodes are pooled
+        :type client: riak.client.RiakClient
+        """
+        self._client = client
+        self._options = options
+        self._pool_options = {'max_size': max_size,
+                              'min_idle': min_idle,
+                              'acquire_timeout': acquire_timeout,
+                              'max_idle': max_idle,
+                              'max_lifetime': max_lifetime}
+        self._pools = {}
+        self.lock = threading.Lock()
+
+        interval = _reap_interval(min_idle, max_idle, max_lifetime,
+                                  reap_interval)
+        if interval:
+            start_reaper(self, interval)
+
+    @contextmanager
+    def take(self, _filter=None, default=None, skip_nodes=None,
+             timeout=None):
+        """
+        take(_filter=None, default=None, skip_nodes=None, timeout=None)
+
+        Claims a resource from the sub-pool of a node, as with
+        :meth:`Pool.take`. Among the nodes not in ``skip_nodes``, the
+        client prefers healthy nodes with idle resources, then nodes
+        with room for a new resource, leaving the final choice to its
+        node policy. Nodes whose circuit is open are skipped as well.
+        If every node is skipped, all of them are considered.
+
+        :param _filter: a filter that can be used to select a member
+            of the pool
+        :type _filter: callable
+        :param default: a value that will be used instead of calling
+            :meth:`create_node_resource` if a new resource needs to be
+            created
+        :param skip_nodes: nodes to avoid
+        :type skip_nodes: list
+        :param timeout: how long in seconds to wait at most for this
+            claim, if less than ``acquire_timeout``
+        :type timeout: float
+        """
+        pool = self._choose_pool(skip_nodes)
+        with pool.take(_filter=_filter, default=default,
+                       timeout=timeout) as resource:
+            yield resource
+
+    def _choose_pool(self, skip_nodes=None):
+        """
+        Selects the sub-pool to claim a resource from.
+
+        :param skip_nodes: nodes to avoid
+        :type skip_nodes: list
+        :rtype: SubPool
+        """
+        nodes = self._client.nodes
+        if skip_nodes:
+            nodes = [n for n in nodes if n not in skip_nodes] or nodes
+        nodes = [n for n in nodes if n.available] or nodes
+
+        pools = dict((n, self.pool(n)) for n in nodes)
+        available = [n for n in nodes
+                     if pools[n]._idle or not pools[n]._full()] or nodes
+
+        def _load(node):
+            return len(pools[node]._idle) == 0
+
+        return pools[self._client._choose_node(available, load=_load)]
+
+    def pool(self, node):
+        """
+        Returns the sub-pool for the given node, creating it if
+        necessary.
+
+        :param node: the node
+        :type node: riak.node.RiakNode
+        :rtype: SubPool
+        """
+        try:
+            return self._pools[node]
+        except KeyError:
+            with self.lock:
+                if node not in self._pools:
+                    self._pools[node] = SubPool(self, node,
+                                                **self._pool_options)
+                return self._pools[node]
+
+    @property
+    def elements(self):
+        """
+        The elements of all sub-pools.
+        """
+        return list(chain(*[p.elements for p in self._pools.values()]))
+
+    def stats(self):
+        """
+        Reports the number of resources held for each node, as a dict
+        mapping each node to a dict with the ``size``, ``idle`` and
+        ``claimed`` counts.
+
+        :rtype: dict
+        """
+        stats = {}
+        for node, pool in self._pools.items():
+            with pool.lock:
+                size, idle = len(pool.elements), len(pool._idle)
+            stats[node] = {'size': size, 'idle': idle,
+                           'claimed': size - idle}
+        return stats
+
+    def fill(self):
+        """
+        Fills the sub-pool of every node up to ``min_idle``.
+        """
+        for node in self._client.nodes:
+            self.pool(node).fill()
+
+    def warm_up(self, count):
+        """
+        Opens ``count`` connections to every node in parallel, passes
+        each of them to :meth:`warm_resource` and parks them in the
+        sub-pools as idle resources. A node that cannot be reached has
+        its error rate increased rather than failing the warm-up, and
+        nodes whose circuit is open are skipped.
+        Returns the number of idle resources in the pool afterwards.
+
+        :param count: the number of connections per node
+        :type count: int
+        :rtype: int
+        """
+        def _fill(node):
+            try:
+                self.pool(node).fill(count, init=self.warm_resource)
+            except Exception:
+                node.error_rate.incr(1)
+
+        workers = []
+        for node in self._client.nodes:
+            if not node.available:
+                continue
+            for i in range(count):
+                worker = threading.Thread(target=_fill, args=(node,),
+                                          name="riak.transports.warm-up")
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        return sum(len(p._idle) for p in self._pools.values())
+
+    def reap(self):
+        """
+        Reaps the sub-pools of all nodes, see :meth:`Pool.reap`.
+
+        :rtype: int
+        """
+        return sum(p.reap() for p in self._pools.values())
+
+    def __iter__(self):
+        """
+        Iterator callback to iterate over the elements of all
+        sub-pools.
+        """
+        return chain(*[iter(p) for p in self._pools.values()])
+
+    def clear(self):
+        """
+        Removes all resources from all sub-pools.
+        """
+        for pool in self._pools.values():
+            pool.clear()
+
+    def create_node_resource(self, node, **options):
+        """
+        Implemented by subclasses to allocate a new resource connected
+        to the given node.
+
+        :param node: the node to connect to
+        :type node: riak.node.RiakNode
+        :param options: options that override those of the pool, for
+            resources used outside of it
+        """
+        raise NotImplementedError
+
+    def warm_resource(self, obj):
+        """
+        Called by :meth:`warm_up` with each new resource, so that it
+        can do its connection setup before any request needs it.
+        The default implementation is a no-op.
+
+        :param obj: the new resource
+        """
+        pass
+
+    def destroy_resource(self, obj):
+        """
+        Called when removing a resource from a sub-pool so that it
+        can be cleanly deallocated. The default implementation is a
+        no-op.
+
+        :param obj: the resource being removed
+        """
+        pass
+
+
+def _reap_interval(min_idle, max_idle, max_lifetime, reap_interval):
+    """
+    Returns how often the reaper of a pool with the given options
+    should run, or None if the pool needs no reaper.
+
+    :rtype: float
+    """
+    limits = [l for l in (max_idle, max_lifetime) if l is not None]
+    if limits:
+        return reap_interval or min(limits) / 2.0
+    elif min_idle:
+        return reap_interval or FILL_INTERVAL
+    return None
+
+
+def start_reaper(pool, interval):
+    """
+    Starts a daemon thread that calls ``pool.reap()`` every
+    ``interval`` seconds. The thread only holds a weak reference to
+    the pool and exits once the pool is garbage-collected.
+
+    :param pool: the pool to reap
+    :type pool: Pool or NodePool
+    :param interval: the number of seconds between runs
+    :type interval: float
+    """
+    ref = weakref.ref(pool)
+
+    def _run():
+        while True:
+            time.sleep(interval)
+            pool = ref()
+            if pool is None:
+                return
+            try:
+                pool.reap()
+            except Exception:
+                # Destroying or creating a resource failed; the next
+                # run will try again.
+                pass
+            del pool
+
+    reaper = threading.Thread(target=_run,
+                              name="riak.transports.pool-reaper")
+    reaper.daemon = True
+    reaper.start()
+
+
 class PoolIterator(object):
     """
     Iterates over a snapshot of the pool in a thread-safe manner,
     eventually touching all resources that were known when the
-    iteration started.
+    iteration started. Each element is claimed while it is the
+    current one, and released when the iterator moves on to the next
+    one or reaches the end; call :meth:`close` when stopping early.
 
     Note that if claimed resources are not released for long periods,
     the iterator may hang, waiting for those last resources to be
@@ -200,6 +860,8 @@ class PoolIterator(object):
         with pool.lock:
             self.targets = pool.elements[:]
         self.unlocked = []
+        self.current = None
+        self.pool = pool
         self.lock = pool.lock
         self.releaser = pool.releaser
 
@@ -207,22 +869,41 @@ class PoolIterator(object):
         return self
 
     def next(self):
-        if len(self.targets) == 0:
-            raise StopIteration
-        if len(self.unlocked) == 0:
+        self.__release_current()
+        while len(self.unlocked) == 0:
+            if len(self.targets) == 0:
+                raise StopIteration
             self.__claim_elements()
-        return self.unlocked.pop(0)
+        self.current = self.unlocked.pop(0)
+        return self.current
+
+    def close(self):
+        """
+        Releases the current element, and any claimed but not yet
+        returned.
+        """
+        while self.unlocked:
+            self.pool._release(self.unlocked.pop())
+        self.__release_current()
+
+    def __release_current(self):
+        if self.current is not None:
+            element, self.current = self.current, None
+            self.pool._release(element)
 
     def __claim_elements(self):
         with self.lock:
+            # Elements deleted since the snapshot was taken will never
+            # be claimable again.
+            self.targets = [e for e in self.targets if not e.tomb]
             with self.releaser:
-                if self.__all_claimed():
+                if self.targets and self.__all_claimed():
                     self.releaser.wait()
-            for element in self.targets:
-                if not element.claimed:
+            for element in self.targets[:]:
+                if not element.claimed and not element.tomb:
                     self.targets.remove(element)
+                    self.pool._claim_element(element)
                     self.unlocked.append(element)
-                    element.claimed = True
 
     def __all_claimed(self):
         for element in self.targets:
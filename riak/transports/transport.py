@@ -59,6 +59,18 @@ class RiakTransport(FeatureDetection):
         thread = threading.currentThread().getName()
         return base64.b64encode('%s|%s|%s' % (machine, process, thread))
 
+    def _set_timeout(self, timeout):
+        """
+        Overrides the socket timeout of the connection for the
+        current request, or restores the configured one when given
+        None. Used to enforce deadlines; the default implementation
+        does nothing.
+
+        :param timeout: the timeout in seconds
+        :type timeout: float
+        """
+        pass
+
     def ping(self):
         """
         Ping the remote server
@@ -71,6 +83,12 @@ class RiakTransport(FeatureDetection):
         """
         raise NotImplementedError
 
+    def pipeline(self, operations):
+        """
+        Performs several operations with their requests pipelined.
+        """
+        raise NotImplementedError
+
     def put(self, robj, w=None, dw=None, pw=None, return_body=None,
             if_none_match=None, timeout=None):
         """
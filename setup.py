@@ -18,6 +18,7 @@ def make_docs():
 install_requires = ["riak_pb >=2.0.0"]
 requires = ["riak_pb(>=2.0.0)"]
 tests_require = []
+extras_require = {'aio': ["trollius"]}
 if platform.python_version() < '2.7':
     tests_require.append("unittest2")
 
@@ -28,6 +29,7 @@ setup(
     requires=requires,
     install_requires=install_requires,
     tests_require=tests_require,
+    extras_require=extras_require,
     package_data={'riak': ['erl_src/*']},
     description='Python client for Riak',
     zip_safe=True,